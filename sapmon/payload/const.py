@@ -13,6 +13,9 @@ PATH_TRACE         = os.path.join(PATH_ROOT, "trace")
 PATH_STATE         = os.path.join(PATH_ROOT, "state")
 FILENAME_TRACE     = os.path.join(PATH_TRACE, "sapmon.trc")
 FILENAME_REFRESH   = os.path.join(PATH_STATE, "refresh")
+PATH_SPOOL         = os.path.join(PATH_STATE, "spool")
+FILENAME_STATE_DB  = os.path.join(PATH_STATE, "state.db")
+PATH_WSDL_CACHE    = os.path.join(PATH_STATE, "wsdl")
 
 # Time formats
 TIME_FORMAT_LOG_ANALYTICS = "%a, %d %b %Y %H:%M:%S GMT"
@@ -33,9 +36,59 @@ CONFIG_REFRESH_IN_SECONDS = 86400
 
 # Parallel configurations
 NUMBER_OF_THREADS     = 10
-CHECK_WAIT_IN_SECONDS = 5
+CONFIG_REFRESH_POLL_IN_SECONDS = 5
 HEARTBEAT_WAIT_IN_SECONDS = 60
 
+# Log Analytics ingestion
+LOG_ANALYTICS_TIMEOUT_SECS             = 30
+LOG_ANALYTICS_CONNECTION_POOL_SIZE     = 4
+LOG_ANALYTICS_MAX_POST_BYTES           = 30 * 1024 * 1024
+INGESTION_MAX_BATCH_AGE_IN_SECONDS     = 10
+INGESTION_RETRY_MAX_ATTEMPTS           = 8
+INGESTION_RETRY_BACKOFF_IN_SECONDS     = 5
+INGESTION_RETRY_MAX_BACKOFF_IN_SECONDS = 300
+# Responses that mean the payload itself is invalid, so the batch is dropped without retrying
+INGESTION_REJECTED_STATUS_CODES        = (400, 413)
+# Responses that mean the workspace credentials are not (or no longer) valid, e.g. after a shared key
+# rotation or because of clock skew; these batches are kept until they can be ingested
+INGESTION_AUTH_FAILURE_STATUS_CODES    = (401, 403)
+
+# Customer analytics (storage queue)
+CUSTOMER_ANALYTICS_MAX_MESSAGE_BYTES        = 64 * 1024
+CUSTOMER_ANALYTICS_MAX_BUFFERED_RECORDS     = 50000
+CUSTOMER_ANALYTICS_MAX_BATCH_AGE_IN_SECONDS = 5
+
+# State store
+STATE_FLUSH_INTERVAL_IN_SECONDS = 1
+STATE_KEY_GLOBAL                = "global"
+STATE_KEY_CHECK_PREFIX          = "check:"
+STATE_KEY_FORMAT                = "format"
+STATE_FORMAT_TYPED              = 2
+STATE_TAG_DATETIME              = "$datetime"
+
+# Endpoint health (backoff for unreachable hosts)
+ENDPOINT_BACKOFF_IN_SECONDS       = 30
+ENDPOINT_MAX_BACKOFF_IN_SECONDS   = 1800
+ENDPOINT_BACKOFF_JITTER           = 0.2
+ENDPOINT_PROBE_TIMEOUT_IN_SECONDS = 120
+
+# KeyVault access
+KEYVAULT_MAX_PARALLEL_REQUESTS        = 8
+KEYVAULT_SECRET_REVALIDATE_IN_SECONDS = 60
+PROVIDER_LOAD_MAX_WORKERS             = 8
+
+# Change detection
+INGEST_ON_CHANGE_MAX_SILENCE_IN_SECONDS = 86400
+
+# SQL result processing
+SQL_FETCH_BATCH_SIZE   = 1000
+RESULT_CHUNK_MAX_BYTES = 4 * 1024 * 1024
+
+# Ingestion spool
+SPOOL_SEGMENT_EXTENSION = ".spool"
+SPOOL_MAX_SEGMENT_BYTES = 8 * 1024 * 1024
+SPOOL_MAX_SIZE_BYTES    = 256 * 1024 * 1024
+
 # Naming conventions for generated resources
 KEYVAULT_NAMING_CONVENTION               = "sapmon-kv-%s"
 STORAGE_ACCOUNT_NAMING_CONVENTION        = "sapmonsto%s"
@@ -0,0 +1,166 @@
+# Azure modules
+from azure.storage.queue import QueueService
+
+# Python modules
+from collections import deque
+import logging
+import threading
+from time import time
+from typing import Dict, List
+
+# Payload modules
+from const import *
+
+###############################################################################
+
+# Log handler that sends customer analytics records to an Azure Storage queue without blocking the caller
+# emit() only appends the formatted record to a bounded buffer; a background thread packs the buffered records
+# into JSON arrays of up to maxMessageBytes and sends every array as one queue message
+# If the buffer is full (e.g. while the queue cannot be reached), the oldest records are dropped
+class BatchedQueueStorageHandler(logging.Handler):
+   def __init__(self,
+                tracer: logging.Logger,
+                accountName: str,
+                accountKey: str,
+                queue: str,
+                protocol: str = "https",
+                maxMessageBytes: int = CUSTOMER_ANALYTICS_MAX_MESSAGE_BYTES,
+                maxBufferedRecords: int = CUSTOMER_ANALYTICS_MAX_BUFFERED_RECORDS,
+                maxBatchAgeSecs: float = CUSTOMER_ANALYTICS_MAX_BATCH_AGE_IN_SECONDS):
+      logging.Handler.__init__(self)
+      self.tracer = tracer
+      self.service = QueueService(account_name = accountName,
+                                  account_key = accountKey,
+                                  protocol = protocol)
+      self.queue = queue
+      self.maxMessageBytes = maxMessageBytes
+      self.maxBatchAgeSecs = maxBatchAgeSecs
+      self._isQueueCreated = False
+      self._buffer = deque(maxlen = maxBufferedRecords)
+      # Time at which the oldest buffered record was added
+      self._oldestTime = None
+      self._bufferedBytes = 0
+      self._condition = threading.Condition()
+      self._isStopping = False
+      self._thread = threading.Thread(target = self._run,
+                                      name = "customerAnalytics",
+                                      daemon = True)
+      self.statistics = {
+         "records": 0,
+         "messages": 0,
+         "failedMessages": 0,
+         "droppedRecords": 0,
+         "oversizedRecords": 0
+      }
+      self._thread.start()
+
+   # Buffer a single record (called by the logging framework)
+   def emit(self,
+            record: logging.LogRecord) -> None:
+      try:
+         message = self.format(record)
+      except Exception:
+         self.handleError(record)
+         return
+      messageSize = BatchedQueueStorageHandler._getMessageSize(message)
+      with self._condition:
+         self.statistics["records"] += 1
+         if messageSize + 2 > self.maxMessageBytes:
+            self.statistics["oversizedRecords"] += 1
+            return
+         if len(self._buffer) == self._buffer.maxlen:
+            # the deque discards the oldest record when appending
+            self.statistics["droppedRecords"] += 1
+            self._bufferedBytes -= self._buffer[0][1] + 1
+         isFirstRecord = not self._buffer
+         if isFirstRecord:
+            self._oldestTime = time()
+         self._buffer.append((message, messageSize))
+         self._bufferedBytes += messageSize + 1
+         # wake up the sender to start waiting for the maximum batch age, or because a message is full
+         if isFirstRecord or self._bufferedBytes >= self.maxMessageBytes:
+            self._condition.notify_all()
+
+   # Send all buffered records and stop the background sender
+   def close(self,
+             timeoutSecs: float = LOG_ANALYTICS_TIMEOUT_SECS) -> None:
+      with self._condition:
+         self._isStopping = True
+         self._condition.notify_all()
+      if self._thread.is_alive() and self._thread is not threading.current_thread():
+         self._thread.join(timeoutSecs)
+      logging.Handler.close(self)
+
+   # Return a snapshot of the handler statistics
+   def getStatistics(self) -> Dict[str, int]:
+      with self._condition:
+         statistics = dict(self.statistics)
+         statistics["bufferedRecords"] = len(self._buffer)
+      return statistics
+
+   # Size of a message once it has been XML-encoded for the queue service
+   @staticmethod
+   def _getMessageSize(message: str) -> int:
+      size = len(message) if message.isascii() else len(message.encode("utf-8"))
+      return size + 3 * (message.count("<") + message.count(">")) + 4 * message.count("&")
+
+   # Take all buffered records and pack them into messages (JSON arrays) of at most maxMessageBytes
+   # Caller must hold self._condition
+   def _takeMessages(self) -> List[str]:
+      messages = []
+      records = []
+      size = 2
+      while self._buffer:
+         (record, recordSize) = self._buffer.popleft()
+         if records and size + recordSize + 1 > self.maxMessageBytes:
+            messages.append("[%s]" % ",".join(records))
+            records = []
+            size = 2
+         size += recordSize + (1 if records else 0)
+         records.append(record)
+      if records:
+         messages.append("[%s]" % ",".join(records))
+      self._bufferedBytes = 0
+      self._oldestTime = None
+      return messages
+
+   # Seconds until the oldest buffered record reaches the maximum batch age
+   # Caller must hold self._condition
+   def _getWaitTime(self) -> float:
+      if self._oldestTime is None:
+         return None
+      return max(0.0, self._oldestTime + self.maxBatchAgeSecs - time())
+
+   # Main loop of the background sender
+   def _run(self) -> None:
+      while True:
+         with self._condition:
+            isStopping = self._isStopping
+            isDue = self._buffer and (self._bufferedBytes >= self.maxMessageBytes or self._getWaitTime() == 0.0)
+            if not isDue and not isStopping:
+               self._condition.wait(self._getWaitTime())
+               continue
+            messages = self._takeMessages()
+         for message in messages:
+            self._send(message)
+         if isStopping:
+            return
+
+   # Send a single message to the storage queue
+   def _send(self,
+             message: str) -> bool:
+      success = False
+      try:
+         if not self._isQueueCreated:
+            self.service.create_queue(self.queue)
+            self._isQueueCreated = True
+         self.service.put_message(self.queue, message)
+         success = True
+      except Exception as e:
+         # Customer analytics are best-effort, so a failed message is not retried
+         self.tracer.warning("could not send customer analytics message (%s)" % e)
+      with self._condition:
+         self.statistics["messages"] += 1
+         if not success:
+            self.statistics["failedMessages"] += 1
+      return success
@@ -5,12 +5,17 @@ from azure.keyvault.secrets import SecretClient, KeyVaultSecret
 
 # Python modules
 import base64
+from concurrent.futures import ThreadPoolExecutor
+import gzip
 import hashlib
 import hmac
 import json
 import logging
 import requests
+import requests.adapters
 import sys
+import threading
+from time import monotonic
 from typing import Callable, Dict, Optional, Tuple
 
 # Payload modules
@@ -105,6 +110,8 @@ class AzureInstanceMetadataService:
 ###############################################################################
 
 # Provide access to an Azure KeyVault instance
+# Credentials (and thereby their access tokens) and SecretClients are shared by all instances accessing the same
+# KeyVault, and secrets are cached per KeyVault so that only secrets with a new version need to be fetched again
 class AzureKeyVault:
    headers = None
    kvName = None
@@ -112,6 +119,13 @@ class AzureKeyVault:
    tracer = None
    uri = None
 
+   # Shared across all instances: (vault URL, MSI client ID) -> SecretClient, MSI client ID -> credential
+   _clients = {}
+   _credentials = {}
+   # Shared across all instances: (vault URL, secret name) -> (KeyVaultSecret, time it was last known to be current)
+   _secretCache = {}
+   _lock = threading.Lock()
+
    def __init__(self,
                 tracer: logging.Logger,
                 kvName: str,
@@ -120,8 +134,38 @@ class AzureKeyVault:
       self.tracer.info("initializing KeyVault %s" % kvName)
       self.kvName = kvName
       self.uri = "https://%s.vault.azure.net" % kvName
-      self.token = ManagedIdentityCredential(client_id = msiClientId)
-      self.kv_client = SecretClient(vault_url=self.uri, credential = self.token)
+      with AzureKeyVault._lock:
+         self.token = AzureKeyVault._credentials.get(msiClientId, None)
+         if not self.token:
+            self.token = ManagedIdentityCredential(client_id = msiClientId)
+            AzureKeyVault._credentials[msiClientId] = self.token
+         self.kv_client = AzureKeyVault._clients.get((self.uri, msiClientId), None)
+         if not self.kv_client:
+            self.kv_client = SecretClient(vault_url=self.uri, credential = self.token)
+            AzureKeyVault._clients[(self.uri, msiClientId)] = self.kv_client
+
+   # Return the cached secret (or None), if it is the requested version or, without a version, has recently been current
+   def _getCachedSecret(self,
+                        secretName: str,
+                        version: Optional[str] = None) -> KeyVaultSecret:
+      with AzureKeyVault._lock:
+         (secret, validatedTime) = AzureKeyVault._secretCache.get((self.uri, secretName), (None, None))
+      if not secret:
+         return None
+      if version:
+         return secret if secret.properties.version == version else None
+      if monotonic() - validatedTime > KEYVAULT_SECRET_REVALIDATE_IN_SECONDS:
+         return None
+      return secret
+
+   def _cacheSecret(self,
+                    secretName: str,
+                    secret: Optional[KeyVaultSecret]) -> None:
+      with AzureKeyVault._lock:
+         if secret is None:
+            AzureKeyVault._secretCache.pop((self.uri, secretName), None)
+         else:
+            AzureKeyVault._secretCache[(self.uri, secretName)] = (secret, monotonic())
 
    # Set a secret in the KeyVault
    def setSecret(self,
@@ -129,7 +173,7 @@ class AzureKeyVault:
                  secretValue: str) -> bool:
       self.tracer.info("setting KeyVault secret for secretName=%s" % secretName)
       try:
-         self.kv_client.set_secret(secretName, secretValue)
+         self._cacheSecret(secretName, self.kv_client.set_secret(secretName, secretValue))
       except Exception as e:
          self.tracer.critical("could not set KeyVault secret (%s)" % e)
          sys.exit(ERROR_SETTING_KEYVAULT_SECRET)
@@ -139,6 +183,7 @@ class AzureKeyVault:
    def deleteSecret(self,
                     secretName: str) -> bool:
       self.tracer.info("deleting KeyVault secret %s" % secretName)
+      self._cacheSecret(secretName, None)
       try:
          poller = self.kv_client.begin_delete_secret(secretName)
          poller.wait()
@@ -153,25 +198,64 @@ class AzureKeyVault:
                  secretId: str,
                  version: Optional[str] = None) -> KeyVaultSecret:
       self.tracer.info("getting KeyVault secret for secretId=%s" % secretId)
-      secret = None
+      secret = self._getCachedSecret(secretId, version)
+      if secret:
+         return secret
       try:
          secret = self.kv_client.get_secret(secretId,
                                             version)
+         if not version:
+            self._cacheSecret(secretId, secret)
       except Exception as e:
          self.tracer.error("could not get KeyVault secret for secretId=%s (%s)" % (secretId, e))
       return secret
 
    # Get the current versions of all secrets inside the customer KeyVault
+   # Only secrets whose version or update time differ from the cached ones are fetched, in parallel
    def getCurrentSecrets(self) -> Dict[str, str]:
       self.tracer.info("getting current KeyVault secrets")
       secrets = {}
       try:
-         kvSecrets = self.kv_client.list_properties_of_secrets()
-         for k in kvSecrets:
-            secrets[k.name] = self.kv_client.get_secret(k.name).value
+         kvSecrets = list(self.kv_client.list_properties_of_secrets())
       except Exception as e:
          self.tracer.error("could not get current KeyVault secrets (%s)" % e)
-      return secrets
+         return secrets
+
+      fetchNames = []
+      for properties in kvSecrets:
+         cachedSecret = self._getCachedSecret(properties.name, properties.version)
+         if cachedSecret and cachedSecret.properties.updated_on == properties.updated_on:
+            self._cacheSecret(properties.name, cachedSecret)
+            secrets[properties.name] = cachedSecret.value
+         else:
+            fetchNames.append(properties.name)
+      self.tracer.info("%d KeyVault secrets unchanged, fetching %d new or updated secrets" % (len(secrets),
+                                                                                            len(fetchNames)))
+
+      def fetchSecret(secretName: str) -> KeyVaultSecret:
+         try:
+            return self.kv_client.get_secret(secretName)
+         except Exception as e:
+            self.tracer.error("could not get KeyVault secret for secretId=%s (%s)" % (secretName, e))
+            return None
+
+      if fetchNames:
+         with ThreadPoolExecutor(min(len(fetchNames), KEYVAULT_MAX_PARALLEL_REQUESTS),
+                                 thread_name_prefix = "keyvault") as pool:
+            for (secretName, secret) in zip(fetchNames, pool.map(fetchSecret, fetchNames)):
+               if secret:
+                  self._cacheSecret(secretName, secret)
+                  secrets[secretName] = secret.value
+
+      # Forget cached secrets that no longer exist
+      currentNames = set(properties.name for properties in kvSecrets)
+      with AzureKeyVault._lock:
+         for (uri, secretName) in list(AzureKeyVault._secretCache.keys()):
+            if uri == self.uri and secretName not in currentNames:
+               del AzureKeyVault._secretCache[(uri, secretName)]
+
+      # Keep the order in which the KeyVault lists its secrets
+      return {properties.name: secrets[properties.name] for properties in kvSecrets if properties.name in secrets}
 
    # Check if a KeyVault with a specified name exists
    def exists(self) -> bool:
@@ -194,65 +278,99 @@ class AzureLogAnalytics:
    tracer = None
    uri = None
    workspaceId = None
+   session = None
 
    def __init__(self,
                 tracer: logging.Logger,
                 workspaceId: str,
-                sharedKey: str):
+                sharedKey: str,
+                compress: bool = False):
       self.tracer = tracer
       self.tracer.info("initializing Log Analytics instance")
       self.workspaceId = workspaceId
       self.sharedKey = sharedKey
+      self.decodedKey = base64.b64decode(sharedKey)
+      self.compress = compress
       self.uri = "https://%s.ods.opinsights.azure.com/api/logs?api-version=2016-04-01" % workspaceId
 
+      # Re-use keep-alive connections to the Data Collector API across all ingestion requests
+      self.session = requests.Session()
+      self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections = 1,
+                                                                   pool_maxsize = LOG_ANALYTICS_CONNECTION_POOL_SIZE))
+
+   # Check whether this instance ingests into the given workspace with the given shared key
+   def hasCredentials(self,
+                      workspaceId: str,
+                      sharedKey: str) -> bool:
+      return self.workspaceId == workspaceId and self.sharedKey == sharedKey
+
+   # Close the pooled connections of this instance
+   def close(self) -> None:
+      self.session.close()
+
+   # Sign the content as required by Data Collector API
+   def _buildSignature(self,
+                       contentLength: int,
+                       timestamp: str) -> str:
+      stringHash  = """POST
+%d
+application/json
+x-ms-date:%s
+/api/logs""" % (contentLength, timestamp)
+      bytesHash = bytes(stringHash, encoding="utf-8")
+      encodedHash = base64.b64encode(hmac.new(self.decodedKey,
+                                              bytesHash,
+                                              digestmod = hashlib.sha256).digest())
+      return "SharedKey %s:%s" % (self.workspaceId, encodedHash.decode("utf-8"))
+
    # Ingest JSON content as custom log via Log Analytics Data Collector API
    # https://docs.microsoft.com/en-us/azure/azure-monitor/platform/data-collector-api
    def ingest(self,
               customLog: str,
               jsonData: str,
-              colTimeGenerated: str = None) -> bytes:
-      # Sign the content as required by Data Collector API
-      def buildSig(content: str,
-                   timestamp: str) -> str:
-         stringHash  = """POST
-%d
-application/json
-x-ms-date:%s
-/api/logs""" % (len(content), timestamp)
-         bytesHash = bytes(stringHash, encoding="utf-8")
-         decodedKey = base64.b64decode(self.sharedKey)
-         encodedHash = base64.b64encode(hmac.new(decodedKey,
-                                                 bytesHash,
-                                                 digestmod = hashlib.sha256).digest())
-         stringHash = encodedHash.decode("utf-8")
-         return "SharedKey %s:%s" % (self.workspaceId, stringHash)
-
+              colTimeGenerated: str = None) -> bool:
+      statusCode = self.ingestWithStatus(customLog, jsonData, colTimeGenerated)
+      return statusCode is not None and 200 <= statusCode < 300
+
+   # Same as ingest(), but return the HTTP status code of the response
+   # (None if no response has been received at all, e.g. after a connection error or timeout)
+   def ingestWithStatus(self,
+                        customLog: str,
+                        jsonData: str,
+                        colTimeGenerated: str = None) -> Optional[int]:
       self.tracer.info("ingesting telemetry into Log Analytics, custom log %s" % customLog)
 
-      # Log Analytics expects a specific time format
-      timestamp = datetime.utcnow().strftime(TIME_FORMAT_LOG_ANALYTICS)
+      body = jsonData.encode("utf-8") if isinstance(jsonData, str) else jsonData
       headers = {
          "content-type":  "application/json",
-         "Authorization": buildSig(jsonData, timestamp),
          "Log-Type":      customLog,
-         "x-ms-date":     timestamp
       }
+      if self.compress:
+         body = gzip.compress(body)
+         headers["Content-Encoding"] = "gzip"
+
+      # Log Analytics expects a specific time format
+      timestamp = datetime.utcnow().strftime(TIME_FORMAT_LOG_ANALYTICS)
+      headers["Authorization"] = self._buildSignature(len(body), timestamp)
+      headers["x-ms-date"] = timestamp
+
       # Only set the time-generated-field header if colTimeGenerated was provided
       if colTimeGenerated:
         headers["time-generated-field"] = colTimeGenerated
 
-      response = None
       # Ingest the actual content via Data Collector API
       try:
-         response = REST.sendRequest(self.tracer,
-                                     self.uri,
-                                     method = requests.post,
-                                     headers = headers,
-                                     data = jsonData)
+         response = self.session.post(self.uri,
+                                      headers = headers,
+                                      data = body,
+                                      timeout = LOG_ANALYTICS_TIMEOUT_SECS)
       except Exception as e:
          self.tracer.error("could not ingest telemetry into Log Analytics (%s)" % e)
-
-      return response
+         return None
+      if not response.ok:
+         self.tracer.error("could not ingest telemetry into Log Analytics (HTTP %d: %s)" % (response.status_code,
+                                                                                         response.text[:500]))
+      return response.status_code
 
 ###############################################################################
 
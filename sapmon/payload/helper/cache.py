@@ -0,0 +1,167 @@
+# Python modules
+from collections import OrderedDict
+import threading
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable
+import weakref
+
+###############################################################################
+
+# Load of a single key that is in progress; concurrent callers wait for it instead of loading the key themselves
+class _InFlightLoad:
+   def __init__(self):
+      self.event = threading.Event()
+      self.value = None
+      self.exception = None
+
+###############################################################################
+
+# Thread-safe cache with a time-to-live per entry, an optional size bound (least recently used entries are
+# evicted first) and single-flight loading, so concurrent misses for the same key result in only one load
+# None is never cached, so a loader can return None for results that should be retried on the next call
+class TtlCache:
+   # all caches, so their statistics can be reported together
+   _caches = weakref.WeakSet()
+
+   def __init__(self,
+                name: str,
+                ttlSecs: float,
+                maxEntries: int = None):
+      self.name = name
+      self.ttlSecs = ttlSecs
+      self.maxEntries = maxEntries
+      self._entries = OrderedDict()
+      self._inFlight = {}
+      self._lock = threading.Lock()
+      self.statistics = {
+         "hits": 0,
+         "misses": 0,
+         "loads": 0,
+         "loadFailures": 0,
+         "sharedLoads": 0,
+         "expirations": 0,
+         "evictions": 0
+      }
+      TtlCache._caches.add(self)
+
+   # Return the cached value of a key (or the default, if it is not cached or has expired)
+   def get(self,
+           key: Hashable,
+           default: Any = None) -> Any:
+      with self._lock:
+         value = self._get(key)
+         if value is None:
+            self.statistics["misses"] += 1
+            return default
+         self.statistics["hits"] += 1
+         return value
+
+   # Cache the value of a key, with the default time-to-live unless ttlSecs is given
+   def put(self,
+           key: Hashable,
+           value: Any,
+           ttlSecs: float = None) -> None:
+      if value is None:
+         return
+      with self._lock:
+         self._put(key, value, ttlSecs)
+
+   # Remove a key from the cache
+   def pop(self,
+           key: Hashable) -> None:
+      with self._lock:
+         self._entries.pop(key, None)
+
+   # Remove all keys from the cache
+   def clear(self) -> None:
+      with self._lock:
+         self._entries.clear()
+
+   # Return the cached value of a key, or load (and cache) it by calling loader()
+   # If the key is already being loaded by another thread, wait for that load and share its result (or exception)
+   def getOrLoad(self,
+                 key: Hashable,
+                 loader: Callable[[], Any],
+                 ttlSecs: float = None) -> Any:
+      with self._lock:
+         value = self._get(key)
+         if value is not None:
+            self.statistics["hits"] += 1
+            return value
+         self.statistics["misses"] += 1
+         load = self._inFlight.get(key, None)
+         isLoader = load is None
+         if isLoader:
+            load = _InFlightLoad()
+            self._inFlight[key] = load
+            self.statistics["loads"] += 1
+         else:
+            self.statistics["sharedLoads"] += 1
+
+      if not isLoader:
+         load.event.wait()
+         if load.exception:
+            raise load.exception
+         return load.value
+
+      try:
+         load.value = loader()
+      except Exception as e:
+         load.exception = e
+         with self._lock:
+            self.statistics["loadFailures"] += 1
+         raise
+      finally:
+         with self._lock:
+            if load.exception is None and load.value is not None:
+               self._put(key, load.value, ttlSecs)
+            del self._inFlight[key]
+         load.event.set()
+      return load.value
+
+   # Return a snapshot of the cache statistics
+   def getStatistics(self) -> Dict[str, int]:
+      with self._lock:
+         statistics = dict(self.statistics)
+         statistics["entries"] = len(self._entries)
+      return statistics
+
+   # Return the statistics of all caches, by cache name
+   @staticmethod
+   def getAllStatistics() -> Dict[str, Dict[str, int]]:
+      allStatistics = {}
+      for cache in list(TtlCache._caches):
+         statistics = cache.getStatistics()
+         if cache.name in allStatistics:
+            # caches with the same name (e.g. one per provider instance) are reported as one
+            for (counter, value) in statistics.items():
+               allStatistics[cache.name][counter] += value
+         else:
+            allStatistics[cache.name] = statistics
+      return allStatistics
+
+   # Caller must hold self._lock
+   def _get(self,
+            key: Hashable) -> Any:
+      entry = self._entries.get(key, None)
+      if entry is None:
+         return None
+      (value, expirationTime) = entry
+      if expirationTime <= monotonic():
+         del self._entries[key]
+         self.statistics["expirations"] += 1
+         return None
+      self._entries.move_to_end(key)
+      return value
+
+   # Caller must hold self._lock
+   def _put(self,
+            key: Hashable,
+            value: Any,
+            ttlSecs: float) -> None:
+      self._entries[key] = (value, monotonic() + (self.ttlSecs if ttlSecs is None else ttlSecs))
+      self._entries.move_to_end(key)
+      if self.maxEntries:
+         while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last = False)
+            self.statistics["evictions"] += 1
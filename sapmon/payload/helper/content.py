@@ -0,0 +1,51 @@
+# Python modules
+import json
+import logging
+import os
+import threading
+from types import MappingProxyType
+from typing import Any, Mapping, Tuple
+
+# Payload modules
+from const import *
+
+###############################################################################
+
+# Process-wide registry of provider content (the checks defined in content/<providerType>.json)
+# Every content file is read and parsed only once; its check definitions are frozen into read-only
+# mappings and tuples, so they can safely be shared by all provider instances of the same type
+class ContentRegistry:
+   _checkDefinitions = {}
+   _lock = threading.Lock()
+
+   # Return the (read-only) check definitions of a provider type
+   # Raises FileNotFoundError if there is no content file for the provider type
+   @staticmethod
+   def getCheckDefinitions(tracer: logging.Logger,
+                           providerType: str) -> Tuple[Mapping[str, Any], ...]:
+      with ContentRegistry._lock:
+         checkDefinitions = ContentRegistry._checkDefinitions.get(providerType, None)
+         if checkDefinitions is not None:
+            return checkDefinitions
+
+         filename = os.path.join(PATH_CONTENT, "%s.json" % providerType)
+         tracer.info("loading content file %s" % filename)
+         with open(filename, "r") as file:
+            # content files do not contain any timestamps, so they are parsed without JsonDecoder.datetimeHook
+            jsonData = json.load(file)
+         checkDefinitions = tuple(ContentRegistry._freezeCheck(checkOptions) for checkOptions in jsonData.get("checks", []))
+         ContentRegistry._checkDefinitions[providerType] = checkDefinitions
+         return checkDefinitions
+
+   # Freeze the options of a single check and of all of its actions
+   @staticmethod
+   def _freezeCheck(checkOptions: Mapping[str, Any]) -> Mapping[str, Any]:
+      frozenCheck = dict(checkOptions)
+      frozenCheck["actions"] = tuple(ContentRegistry._freezeAction(action) for action in checkOptions.get("actions", []))
+      return MappingProxyType(frozenCheck)
+
+   @staticmethod
+   def _freezeAction(action: Mapping[str, Any]) -> Mapping[str, Any]:
+      frozenAction = dict(action)
+      frozenAction["parameters"] = MappingProxyType(dict(action.get("parameters", {})))
+      return MappingProxyType(frozenAction)
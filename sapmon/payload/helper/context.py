@@ -18,15 +18,19 @@ from helper.tracing import *
 # Internal context handler
 class Context(object):
    azKv = None
+   azLa = None
    sapmonId = None
    vmInstance = None
    vmTage = None
    analyticsTracer = None
+   analyticsHandler = None
    tracer = None
 
    globalParams = {}
    instances = []
    checkLockSet = set()
+   # Checks that are currently being executed (check objects, unlike the names in checkLockSet)
+   runningChecks = set()
    lastConfigRefreshTime = datetime(2020, 1, 1)
 
    def __init__(self,
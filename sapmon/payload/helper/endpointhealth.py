@@ -0,0 +1,120 @@
+# Python modules
+import logging
+import random
+import threading
+from time import time
+from typing import Dict
+
+# Payload modules
+from const import *
+from helper.tools import Singleton
+
+###############################################################################
+
+# Health of a single remote endpoint (circuit breaker)
+class EndpointHealth:
+   # endpoint is healthy, connections are attempted
+   STATE_CLOSED = "closed"
+   # endpoint is failing, connections are skipped until the backoff has expired
+   STATE_OPEN = "open"
+   # backoff has expired and a single probe connection is in progress
+   STATE_HALF_OPEN = "halfOpen"
+
+   def __init__(self):
+      self.state = EndpointHealth.STATE_CLOSED
+      self.failureCount = 0
+      self.retryTime = 0.0
+      self.probeStartTime = None
+
+###############################################################################
+
+# Registry with the health of all remote endpoints (SOAP, RFC, HANA, SQL Server), shared by all providers
+# After a failed connection, an endpoint is skipped for an exponentially growing (jittered) backoff; once it has
+# expired, exactly one caller is allowed to probe the endpoint, and the outcome of the probe closes or re-opens it
+class EndpointHealthRegistry(metaclass=Singleton):
+   tracer = None
+
+   def __init__(self,
+                tracer: logging.Logger,
+                backoffSecs: float = ENDPOINT_BACKOFF_IN_SECONDS,
+                maxBackoffSecs: float = ENDPOINT_MAX_BACKOFF_IN_SECONDS,
+                jitter: float = ENDPOINT_BACKOFF_JITTER,
+                probeTimeoutSecs: float = ENDPOINT_PROBE_TIMEOUT_IN_SECONDS):
+      self.tracer = tracer
+      self.backoffSecs = backoffSecs
+      self.maxBackoffSecs = maxBackoffSecs
+      self.jitter = jitter
+      self.probeTimeoutSecs = probeTimeoutSecs
+      self._endpoints = {}
+      self._lock = threading.Lock()
+      self.statistics = {
+         "skipped": 0,
+         "probes": 0,
+         "failures": 0,
+         "recoveries": 0
+      }
+
+   # Return the name under which an endpoint is tracked
+   @staticmethod
+   def getEndpointName(protocol: str,
+                       host: str,
+                       port) -> str:
+      return "%s://%s:%s" % (protocol, host, port)
+
+   # Determine if a connection to an endpoint should be attempted
+   # Returns False while the endpoint is backing off, or while another caller is probing it
+   def isAvailable(self,
+                   endpoint: str) -> bool:
+      with self._lock:
+         health = self._endpoints.get(endpoint, None)
+         if not health or health.state == EndpointHealth.STATE_CLOSED:
+            return True
+         now = time()
+         if health.state == EndpointHealth.STATE_HALF_OPEN and health.probeStartTime + self.probeTimeoutSecs > now:
+            self.statistics["skipped"] += 1
+            return False
+         if health.state == EndpointHealth.STATE_OPEN and health.retryTime > now:
+            self.statistics["skipped"] += 1
+            return False
+         # backoff has expired (or a previous probe never reported back), so let this caller probe the endpoint
+         health.state = EndpointHealth.STATE_HALF_OPEN
+         health.probeStartTime = now
+         self.statistics["probes"] += 1
+      self.tracer.info("probing endpoint %s after %d failures" % (endpoint, health.failureCount))
+      return True
+
+   # Record a successful connection to an endpoint
+   def recordSuccess(self,
+                     endpoint: str) -> None:
+      with self._lock:
+         health = self._endpoints.pop(endpoint, None)
+         if not health:
+            return
+         self.statistics["recoveries"] += 1
+      self.tracer.info("endpoint %s is reachable again after %d failures" % (endpoint, health.failureCount))
+
+   # Record a failed connection to an endpoint and start (or extend) its backoff
+   def recordFailure(self,
+                     endpoint: str) -> None:
+      with self._lock:
+         health = self._endpoints.get(endpoint, None)
+         if not health:
+            health = EndpointHealth()
+            self._endpoints[endpoint] = health
+         health.failureCount += 1
+         backoffSecs = min(self.backoffSecs * 2 ** (health.failureCount - 1), self.maxBackoffSecs)
+         backoffSecs *= random.uniform(1 - self.jitter, 1 + self.jitter)
+         health.state = EndpointHealth.STATE_OPEN
+         health.retryTime = time() + backoffSecs
+         health.probeStartTime = None
+         self.statistics["failures"] += 1
+      self.tracer.warning("endpoint %s failed %d times in a row, skipping it for %d seconds" % (endpoint,
+                                                                                              health.failureCount,
+                                                                                              backoffSecs))
+
+   # Return a snapshot of the registry statistics, including the endpoints that are currently unhealthy
+   def getStatistics(self) -> Dict:
+      with self._lock:
+         statistics = dict(self.statistics)
+         statistics["unhealthy"] = {e: h.failureCount for (e, h) in self._endpoints.items()}
+      return statistics
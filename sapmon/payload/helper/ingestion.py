@@ -0,0 +1,329 @@
+# Python modules
+from collections import deque
+import logging
+import threading
+from time import monotonic, time
+from typing import Dict, List, Optional, Set, Tuple
+
+# Payload modules
+from const import *
+from helper.azure import AzureLogAnalytics
+from helper.spool import IngestionSpool
+
+###############################################################################
+
+# Records of one custom log (and TimeGenerated column) that will be sent in a single request
+class IngestionBatch:
+   def __init__(self,
+                customLog: str,
+                colTimeGenerated: str):
+      self.customLog = customLog
+      self.colTimeGenerated = colTimeGenerated
+      self.records = []
+      self.segmentIds = []
+      self.size = 2 # enclosing brackets of the JSON array
+      self.createdTime = time()
+      self.attempts = 0
+      # monotonic time at which a failed batch is sent again
+      self.nextAttemptTime = None
+
+   # Add the (already JSON-encoded) records of one JSON array to this batch
+   def add(self,
+           records: bytes,
+           segmentId: int = None) -> None:
+      if self.records:
+         self.size += 1 # separating comma
+      self.records.append(records)
+      self.segmentIds.append(segmentId)
+      self.size += len(records)
+
+   # Remove all records that were spooled to one of the given segments
+   def discardSegments(self,
+                       segmentIds: Set[int]) -> None:
+      kept = [(r, s) for (r, s) in zip(self.records, self.segmentIds) if s not in segmentIds]
+      self.records = [r for (r, _) in kept]
+      self.segmentIds = [s for (_, s) in kept]
+      self.size = 2 + sum(len(r) for r in self.records) + max(0, len(self.records) - 1)
+
+   # Return the JSON array with all records of this batch
+   def getBody(self) -> bytes:
+      return b"[" + b",".join(self.records) + b"]"
+
+###############################################################################
+
+# Background stage that coalesces check results per custom log and ingests them in batches
+# A batch is flushed once it would exceed the maximum request size or once its oldest record
+# reaches the maximum batch age
+# If a spool is used, every result is written to disk before submit() returns and is only removed
+# from there once it has been ingested; failed requests are retried with exponential backoff
+# Failed batches are parked until their next attempt is due, so they never hold up other batches;
+# batches rejected by Log Analytics because of their payload (400/413) are dropped without retrying,
+# while batches that failed authentication (401/403) are kept (without a limit on the number of attempts)
+# and are retried right away once new workspace credentials have been set
+class LogAnalyticsIngestionPipeline:
+   tracer = None
+   logAnalytics = None
+   spool = None
+
+   def __init__(self,
+                tracer: logging.Logger,
+                logAnalytics: AzureLogAnalytics,
+                spool: IngestionSpool = None,
+                maxBatchBytes: int = LOG_ANALYTICS_MAX_POST_BYTES,
+                maxBatchAgeSecs: float = INGESTION_MAX_BATCH_AGE_IN_SECONDS):
+      self.tracer = tracer
+      self.logAnalytics = logAnalytics
+      self.spool = spool
+      self.maxBatchBytes = maxBatchBytes
+      self.maxBatchAgeSecs = maxBatchAgeSecs
+      self._openBatches = {}
+      self._readyBatches = deque()
+      self._retryBatches = []
+      self._condition = threading.Condition()
+      self._isStopping = False
+      self._thread = threading.Thread(target = self._run,
+                                      name = "ingestion",
+                                      daemon = True)
+      self.statistics = {
+         "submitted": 0,
+         "requests": 0,
+         "failedRequests": 0,
+         "retries": 0,
+         "droppedBatches": 0,
+         "rejectedBatches": 0,
+         "authFailures": 0,
+         "replayed": 0
+      }
+
+   # Start the background sender, after queueing all results left over in the spool
+   def start(self) -> None:
+      if self.spool:
+         replayRecords = self.spool.open()
+         self.spool.onEvict = self._discardSegments
+         with self._condition:
+            for (segmentId, customLog, colTimeGenerated, records) in replayRecords:
+               self._addRecords(customLog, colTimeGenerated, records, segmentId)
+            self.statistics["replayed"] += len(replayRecords)
+      self._thread.start()
+
+   # Flush all pending batches and stop the background sender
+   # Batches that cannot be ingested right away are left in the spool (if any)
+   def stop(self,
+            timeoutSecs: float = None) -> None:
+      with self._condition:
+         self._isStopping = True
+         self._condition.notify_all()
+      self._thread.join(timeoutSecs)
+      if self.spool:
+         self.spool.close()
+
+   # Switch to a different Log Analytics workspace or credentials (e.g. after a config refresh)
+   # All failed batches are retried right away, since they may have failed because of the old credentials
+   def setLogAnalytics(self,
+                       logAnalytics: AzureLogAnalytics) -> None:
+      with self._condition:
+         if logAnalytics is self.logAnalytics:
+            return
+         self.logAnalytics = logAnalytics
+         now = monotonic()
+         for batch in self._retryBatches:
+            batch.attempts = 0
+            batch.nextAttemptTime = now
+         self._condition.notify_all()
+
+   # Queue the result of one check for ingestion
+   def submit(self,
+              customLog: str,
+              jsonData: str,
+              colTimeGenerated: str = None) -> None:
+      records = LogAnalyticsIngestionPipeline._stripJsonArray(jsonData)
+      if not records:
+         # nothing to ingest
+         return
+
+      segmentId = None
+      if self.spool:
+         try:
+            segmentId = self.spool.append(customLog, colTimeGenerated, records)
+         except Exception as e:
+            self.tracer.error("could not spool result for custom log %s, ingesting from memory only (%s)" % (customLog, e), exc_info=True)
+
+      with self._condition:
+         self.statistics["submitted"] += 1
+         self._addRecords(customLog, colTimeGenerated, records, segmentId)
+
+   # Return a snapshot of the ingestion statistics
+   def getStatistics(self) -> Dict[str, int]:
+      with self._condition:
+         statistics = dict(self.statistics)
+         statistics["pendingBatches"] = len(self._openBatches) + len(self._readyBatches)
+         statistics["retryingBatches"] = len(self._retryBatches)
+      if self.spool:
+         statistics["spool"] = self.spool.getStatistics()
+      return statistics
+
+   # Add records to the open batch of their custom log
+   # Caller must hold self._condition
+   def _addRecords(self,
+                   customLog: str,
+                   colTimeGenerated: str,
+                   records: bytes,
+                   segmentId: int) -> None:
+      key = (customLog, colTimeGenerated)
+      batch = self._openBatches.get(key, None)
+      if batch and batch.size + len(records) + 1 > self.maxBatchBytes:
+         # batch is full, so seal it and start a new one
+         self._readyBatches.append(self._openBatches.pop(key))
+         batch = None
+      if not batch:
+         batch = IngestionBatch(customLog, colTimeGenerated)
+         self._openBatches[key] = batch
+      batch.add(records, segmentId)
+      if batch.size >= self.maxBatchBytes:
+         self._readyBatches.append(self._openBatches.pop(key))
+      self._condition.notify_all()
+
+   # Drop all pending records of spool segments that have been evicted
+   def _discardSegments(self,
+                        segmentIds: Set[int]) -> None:
+      with self._condition:
+         for batch in list(self._openBatches.values()) + list(self._readyBatches) + self._retryBatches:
+            batch.discardSegments(segmentIds)
+         for key in [k for (k, b) in self._openBatches.items() if not b.records]:
+            del self._openBatches[key]
+         self._readyBatches = deque(b for b in self._readyBatches if b.records)
+         self._retryBatches = [b for b in self._retryBatches if b.records]
+
+   # Return the JSON-encoded records of a JSON array (without the enclosing brackets)
+   @staticmethod
+   def _stripJsonArray(jsonData: str) -> bytes:
+      if not jsonData:
+         return None
+      jsonData = jsonData.strip()
+      if not jsonData.startswith("[") or not jsonData.endswith("]"):
+         raise ValueError("result is not a JSON array")
+      records = jsonData[1:-1].strip()
+      if not records:
+         return None
+      return records.encode("utf-8")
+
+   # Move all batches that are due into the list of ready batches and return them
+   # Failed batches are only included once their next attempt is due (and never while stopping,
+   # since they are left in the spool)
+   # Caller must hold self._condition
+   def _takeReadyBatches(self,
+                         flushAll: bool) -> List[Tuple[AzureLogAnalytics, IngestionBatch]]:
+      now = time()
+      for key in list(self._openBatches.keys()):
+         if flushAll or self._openBatches[key].createdTime + self.maxBatchAgeSecs <= now:
+            self._readyBatches.append(self._openBatches.pop(key))
+      if not flushAll:
+         now = monotonic()
+         self._readyBatches.extend(b for b in self._retryBatches if b.nextAttemptTime <= now)
+         self._retryBatches = [b for b in self._retryBatches if b.nextAttemptTime > now]
+      # a workspace change that happened in the meantime is picked up by failed batches as well
+      readyBatches = [(self.logAnalytics, b) for b in self._readyBatches]
+      self._readyBatches.clear()
+      return readyBatches
+
+   # Seconds until the oldest open batch reaches the maximum batch age or the next failed batch is due
+   # Caller must hold self._condition
+   def _getWaitTime(self) -> Optional[float]:
+      waitTimes = []
+      if self._openBatches:
+         oldest = min(b.createdTime for b in self._openBatches.values())
+         waitTimes.append(oldest + self.maxBatchAgeSecs - time())
+      if self._retryBatches:
+         waitTimes.append(min(b.nextAttemptTime for b in self._retryBatches) - monotonic())
+      if not waitTimes:
+         return None
+      return max(0.0, min(waitTimes))
+
+   # Main loop of the background sender
+   # Waking up early (e.g. because a result has been submitted) is harmless, since the due batches
+   # are determined again after every wait
+   def _run(self) -> None:
+      while True:
+         with self._condition:
+            isStopping = self._isStopping
+            readyBatches = self._takeReadyBatches(flushAll = isStopping)
+            if not readyBatches and not isStopping:
+               self._condition.wait(self._getWaitTime())
+               continue
+         for (logAnalytics, batch) in readyBatches:
+            self._sendBatch(logAnalytics, batch)
+         if isStopping:
+            return
+
+   # Send a single batch; if it fails, park it for another attempt with exponential backoff,
+   # unless it has been rejected, the maximum number of attempts has been reached or the pipeline is stopped
+   # Authentication failures do not count towards the maximum number of attempts, so these batches
+   # are kept until the credentials have been fixed (or the spool evicts them)
+   def _sendBatch(self,
+                  logAnalytics: AzureLogAnalytics,
+                  batch: IngestionBatch) -> None:
+      if not batch.records:
+         # all records have been evicted from the spool in the meantime
+         return
+      statusCode = self._send(logAnalytics, batch)
+      if statusCode is not None and 200 <= statusCode < 300:
+         if self.spool:
+            self.spool.acknowledge(batch.segmentIds)
+         return
+      if statusCode in INGESTION_REJECTED_STATUS_CODES:
+         self.tracer.error("dropping batch of %d results for custom log %s rejected by Log Analytics (HTTP %d)" % (len(batch.records),
+                                                                                                                  batch.customLog,
+                                                                                                                  statusCode))
+         with self._condition:
+            self.statistics["rejectedBatches"] += 1
+         if self.spool:
+            self.spool.acknowledge(batch.segmentIds)
+         return
+      isAuthFailure = statusCode in INGESTION_AUTH_FAILURE_STATUS_CODES
+      if isAuthFailure:
+         self.tracer.error("authentication failed ingesting batch for custom log %s (HTTP %d), keeping it until it can be ingested" % (batch.customLog,
+                                                                                                                                    statusCode))
+         with self._condition:
+            self.statistics["authFailures"] += 1
+      batch.attempts += 1
+      if batch.attempts >= INGESTION_RETRY_MAX_ATTEMPTS and not isAuthFailure:
+         self.tracer.error("giving up on batch of %d results for custom log %s after %d attempts" % (len(batch.records),
+                                                                                                   batch.customLog,
+                                                                                                   batch.attempts))
+         with self._condition:
+            self.statistics["droppedBatches"] += 1
+         if self.spool:
+            self.spool.acknowledge(batch.segmentIds)
+         return
+      backoffSecs = min(INGESTION_RETRY_BACKOFF_IN_SECONDS * 2 ** (batch.attempts - 1),
+                        INGESTION_RETRY_MAX_BACKOFF_IN_SECONDS)
+      with self._condition:
+         if self._isStopping:
+            # leave the batch in the spool, it will be replayed after the restart
+            return
+         self.statistics["retries"] += 1
+         self.tracer.warning("retrying batch for custom log %s in %d seconds" % (batch.customLog,
+                                                                                 backoffSecs))
+         batch.nextAttemptTime = monotonic() + backoffSecs
+         self._retryBatches.append(batch)
+         self._condition.notify_all()
+
+   # Send a single batch to Log Analytics and return the HTTP status code (None if there was no response)
+   def _send(self,
+             logAnalytics: AzureLogAnalytics,
+             batch: IngestionBatch) -> Optional[int]:
+      self.tracer.debug("sending batch of %d results (%d bytes) for custom log %s" % (len(batch.records),
+                                                                                     batch.size,
+                                                                                     batch.customLog))
+      statusCode = None
+      try:
+         statusCode = logAnalytics.ingestWithStatus(batch.customLog,
+                                                    batch.getBody(),
+                                                    batch.colTimeGenerated)
+      except Exception as e:
+         self.tracer.error("unhandled exception ingesting batch for custom log %s (%s)" % (batch.customLog, e), exc_info=True)
+      with self._condition:
+         self.statistics["requests"] += 1
+         if statusCode is None or not 200 <= statusCode < 300:
+            self.statistics["failedRequests"] += 1
+      return statusCode
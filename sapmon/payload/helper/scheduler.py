@@ -0,0 +1,127 @@
+# Python modules
+import heapq
+import itertools
+import logging
+import threading
+from time import time
+from typing import Dict, List
+
+###############################################################################
+
+# Priority queue of provider checks, ordered by the point in time each check is due next
+# Checks leave the queue while they are executing and are put back by the worker thread once done,
+# so the monitor loop only ever needs to look at the checks that are actually due
+class CheckScheduler:
+   tracer = None
+
+   def __init__(self,
+                tracer: logging.Logger):
+      self.tracer = tracer
+      self._heap = []
+      self._sequence = itertools.count()
+      self._checks = set()
+      self._condition = threading.Condition()
+      self._wakeUpRequested = False
+      self._counters = {
+         "queued": 0,
+         "rescheduled": 0,
+         "skippedDisabled": 0,
+         "skippedInFlight": 0,
+         "errors": 0
+      }
+
+   # Replace all scheduled checks (e.g. after a config refresh)
+   def reset(self,
+             checks: List) -> None:
+      with self._condition:
+         self._heap = []
+         self._checks = set(checks)
+         for check in checks:
+            self._push(check, check.getNextDueTime())
+         self.tracer.info("scheduler initialized with %d checks" % len(self._heap))
+         self._condition.notify_all()
+
+   # Replace the set of scheduled checks, but keep the queue position of checks that remain scheduled
+   # Checks that are executing are put back by reschedule() if they are still part of the new set
+   def update(self,
+              checks: List) -> None:
+      with self._condition:
+         newChecks = set(checks)
+         addedChecks = [check for check in checks if check not in self._checks]
+         self._heap = [entry for entry in self._heap if entry[2] in newChecks]
+         heapq.heapify(self._heap)
+         self._checks = newChecks
+         for check in addedChecks:
+            self._push(check, check.getNextDueTime())
+         self.tracer.info("scheduler updated with %d checks (%d added)" % (len(newChecks),
+                                                                           len(addedChecks)))
+         self._condition.notify_all()
+
+   # Put a check back into the queue, based on its own next due time
+   # Checks that are no longer part of the current configuration are silently dropped
+   def reschedule(self, check) -> None:
+      with self._condition:
+         if check not in self._checks:
+            return
+         self._push(check, check.getNextDueTime())
+         self._condition.notify_all()
+
+   # Put a check back into the queue, to be re-evaluated after a fixed delay
+   def postpone(self,
+                check,
+                delaySecs: float) -> None:
+      with self._condition:
+         if check not in self._checks:
+            return
+         self._push(check, time() + delaySecs)
+         self._condition.notify_all()
+
+   # Remove and return all checks whose due time has passed
+   def popDueChecks(self) -> List:
+      dueChecks = []
+      now = time()
+      with self._condition:
+         while self._heap and self._heap[0][0] <= now:
+            (_, _, check) = heapq.heappop(self._heap)
+            dueChecks.append(check)
+      return dueChecks
+
+   # Block until the next check is due, wakeUp() is called or maxWaitSecs have passed
+   def wait(self,
+            maxWaitSecs: float) -> None:
+      with self._condition:
+         if self._wakeUpRequested:
+            self._wakeUpRequested = False
+            return
+         timeout = maxWaitSecs
+         if self._heap:
+            timeout = min(timeout, self._heap[0][0] - time())
+         if timeout > 0:
+            self._condition.wait(timeout)
+         self._wakeUpRequested = False
+
+   # Interrupt a pending wait() (e.g. to pick up a config refresh immediately)
+   def wakeUp(self) -> None:
+      with self._condition:
+         self._wakeUpRequested = True
+         self._condition.notify_all()
+
+   # Count a scheduling decision
+   def incrementCounter(self,
+                        name: str) -> None:
+      with self._condition:
+         self._counters[name] = self._counters.get(name, 0) + 1
+
+   # Return a snapshot of all scheduling counters
+   def getCounters(self) -> Dict[str, int]:
+      with self._condition:
+         counters = dict(self._counters)
+         counters["scheduled"] = len(self._heap)
+      return counters
+
+   # Caller must hold self._condition
+   def _push(self,
+             check,
+             dueTime: float) -> None:
+      # The sequence number keeps ordering stable for equal due times (checks themselves are not comparable)
+      heapq.heappush(self._heap, (dueTime, next(self._sequence), check))
@@ -0,0 +1,139 @@
+# Python modules
+from binascii import hexlify
+from datetime import date, datetime
+import decimal
+from typing import Any, Callable, Dict, List, Optional
+
+# Payload modules
+from const import *
+from helper.tools import JsonEncoder
+
+# orjson is optional; without it, the standard json module is used
+try:
+   import orjson
+except ImportError:
+   orjson = None
+
+###############################################################################
+
+# Converters for the (non-JSON) value types returned by database drivers and RFC calls;
+# the output is identical to what JsonEncoder produces for these types
+VALUE_CONVERTERS = {
+   decimal.Decimal: float,
+   datetime: lambda v: datetime.strftime(v, TIME_FORMAT_JSON),
+   date: lambda v: datetime.strftime(v, TIME_FORMAT_JSON),
+   bytes: lambda v: "0x%s" % hexlify(v).decode("ascii").upper(),
+}
+
+# Encodes result records (dicts) into compact JSON, one record at a time
+# The converter of every column is determined once from the first non-null value of that column,
+# so the slow JSONEncoder.default() hook is only used for values whose type does not match their column
+class RecordSerializer:
+   def __init__(self,
+                constantFields: Optional[Dict[str, Any]] = None,
+                sortKeys: bool = True):
+      self.sortKeys = sortKeys
+      self._converters = {}
+      self._encoder = JsonEncoder(separators = (",", ":"),
+                                  sort_keys = sortKeys)
+      if orjson:
+         self._orjsonOptions = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+         if sortKeys:
+            self._orjsonOptions |= orjson.OPT_SORT_KEYS
+      # Fields that are identical for every record are encoded only once (without the closing brace)
+      self._recordPrefix = self._encode(constantFields)[:-1] if constantFields else "{"
+
+   # Return the compact JSON encoding of a single record, including the constant fields
+   def encodeRecord(self,
+                    record: Dict[str, Any]) -> str:
+      columns = self._encode(self.convertRecord(record))
+      if columns == "{}":
+         return self._recordPrefix + "}"
+      if self._recordPrefix == "{":
+         return columns
+      return self._recordPrefix + "," + columns[1:]
+
+   # Encode a list of records into a RecordBuffer
+   def serialize(self,
+                 records: Optional[List[Dict[str, Any]]],
+                 maxChunkBytes: int = RESULT_CHUNK_MAX_BYTES) -> "RecordBuffer":
+      buffer = RecordBuffer(maxChunkBytes)
+      for record in records or []:
+         buffer.addRecord(self.encodeRecord(record))
+      return buffer
+
+   # Return a copy of a record in which all values of known types have been converted to JSON types
+   def convertRecord(self,
+                     record: Dict[str, Any]) -> Dict[str, Any]:
+      converted = {}
+      for (column, value) in record.items():
+         if value is not None:
+            converter = self._getConverter(column, value)
+            if converter:
+               value = converter(value)
+         converted[column] = value
+      return converted
+
+   def _getConverter(self,
+                     column: str,
+                     value: Any) -> Optional[Callable[[Any], Any]]:
+      columnConverter = self._converters.get(column, None)
+      if columnConverter is None:
+         columnConverter = (type(value), VALUE_CONVERTERS.get(type(value), None))
+         self._converters[column] = columnConverter
+      (columnType, converter) = columnConverter
+      # Values of another type than the rest of the column are left to the encoder's default hook
+      return converter if type(value) is columnType else None
+
+   def _encode(self,
+               obj: Any) -> str:
+      if orjson:
+         try:
+            return orjson.dumps(obj,
+                                default = self._encoder.default,
+                                option = self._orjsonOptions).decode("utf-8")
+         except TypeError:
+            # orjson rejects some values the json module can encode (e.g. integers beyond 64 bit)
+            pass
+      return self._encoder.encode(obj)
+
+###############################################################################
+
+# Encoded records of a result, grouped into JSON arrays that each fit into a single ingestion request
+# The individual records are kept, so they can be handed over to customer analytics without parsing the arrays
+class RecordBuffer:
+   def __init__(self,
+                maxChunkBytes: int = RESULT_CHUNK_MAX_BYTES):
+      self.maxChunkBytes = maxChunkBytes
+      self.records = []
+      # Index of the first record of every chunk after the first one
+      self._chunkStarts = []
+      self._currentChunkSize = 2
+      self._chunks = None
+
+   def __len__(self) -> int:
+      return len(self.records)
+
+   # Add a single encoded record
+   def addRecord(self,
+                 record: str) -> None:
+      recordSize = len(record) if record.isascii() else len(record.encode("utf-8"))
+      if self.records and self._currentChunkSize + recordSize + 1 > self.maxChunkBytes:
+         self._chunkStarts.append(len(self.records))
+         self._currentChunkSize = 2
+      elif self._currentChunkSize > 2:
+         self._currentChunkSize += 1
+      self.records.append(record)
+      self._currentChunkSize += recordSize
+      self._chunks = None
+
+   # Return the records as JSON arrays that each fit into a single ingestion request
+   def getJsonChunks(self) -> List[str]:
+      if self._chunks is None:
+         bounds = [0] + self._chunkStarts + [len(self.records)]
+         self._chunks = ["[%s]" % ",".join(self.records[start:end]) for (start, end) in zip(bounds, bounds[1:])]
+      return self._chunks
+
+   # Return the records as a single JSON array
+   def getJsonString(self) -> str:
+      return "[%s]" % ",".join(self.records)
@@ -0,0 +1,230 @@
+# Python modules
+from collections import Counter
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Set, Tuple
+
+# Payload modules
+from const import *
+
+###############################################################################
+
+# Append-only, segment-based on-disk spool for check results that still need to be ingested
+# Each record is stored as a JSON header line followed by the (JSON-encoded) records themselves;
+# a segment file is deleted as soon as all of its records have been acknowledged
+class IngestionSpool:
+   tracer = None
+
+   def __init__(self,
+                tracer: logging.Logger,
+                path: str = PATH_SPOOL,
+                maxSegmentBytes: int = SPOOL_MAX_SEGMENT_BYTES,
+                maxSpoolBytes: int = SPOOL_MAX_SIZE_BYTES):
+      self.tracer = tracer
+      self.path = path
+      self.maxSegmentBytes = maxSegmentBytes
+      self.maxSpoolBytes = maxSpoolBytes
+      self.onEvict = None
+      self._lock = threading.Lock()
+      self._syncLock = threading.Lock()
+      self._activeSegmentId = None
+      self._activeFile = None
+      self._segmentSizes = {}
+      self._outstanding = Counter()
+      self._writtenSequence = 0
+      self._syncedSequence = 0
+      self.statistics = {
+         "appended": 0,
+         "syncs": 0,
+         "evictedSegments": 0
+      }
+
+   # Open the spool and return all records left over from a previous run,
+   # as (segmentId, customLog, colTimeGenerated, records) tuples
+   def open(self) -> List[Tuple[int, str, str, bytes]]:
+      os.makedirs(self.path, exist_ok = True)
+      replayRecords = []
+      with self._lock:
+         lastSegmentId = 0
+         for segmentId in self._listSegments():
+            lastSegmentId = segmentId
+            segmentRecords = self._readSegment(segmentId)
+            if not segmentRecords:
+               self._deleteSegment(segmentId)
+               continue
+            self._segmentSizes[segmentId] = os.path.getsize(self._getSegmentFileName(segmentId))
+            self._outstanding[segmentId] = len(segmentRecords)
+            replayRecords.extend(segmentRecords)
+         self._openSegment(lastSegmentId + 1)
+      if replayRecords:
+         self.tracer.info("replaying %d spooled results from %d segments" % (len(replayRecords),
+                                                                            len(self._outstanding)))
+      return replayRecords
+
+   # Sync and close the active segment; unacknowledged records will be replayed on the next open()
+   def close(self) -> None:
+      with self._syncLock, self._lock:
+         if self._activeFile:
+            self._closeActiveSegment()
+
+   # Durably append the records of one check result and return the segment they were written to
+   # Concurrent appends share a single fsync (group commit)
+   def append(self,
+              customLog: str,
+              colTimeGenerated: str,
+              records: bytes) -> int:
+      header = json.dumps({"customLog": customLog,
+                           "colTimeGenerated": colTimeGenerated,
+                           "length": len(records)}).encode("utf-8") + b"\n"
+      recordSize = len(header) + len(records) + 1
+      evictedSegmentIds = set()
+      with self._lock:
+         if self._segmentSizes[self._activeSegmentId] > 0 and \
+            self._segmentSizes[self._activeSegmentId] + recordSize > self.maxSegmentBytes:
+            self._closeActiveSegment()
+            self._openSegment(self._activeSegmentId + 1)
+         self._activeFile.write(header)
+         self._activeFile.write(records)
+         self._activeFile.write(b"\n")
+         segmentId = self._activeSegmentId
+         self._segmentSizes[segmentId] += recordSize
+         self._outstanding[segmentId] += 1
+         self._writtenSequence += 1
+         sequence = self._writtenSequence
+         self.statistics["appended"] += 1
+         evictedSegmentIds = self._enforceSizeLimit()
+      if evictedSegmentIds and self.onEvict:
+         self.onEvict(evictedSegmentIds)
+      self._sync(sequence)
+      return segmentId
+
+   # Mark records as ingested (or given up on); fully acknowledged segments are deleted
+   def acknowledge(self,
+                   segmentIds: List[int]) -> None:
+      with self._lock:
+         for (segmentId, count) in Counter(segmentIds).items():
+            if segmentId not in self._segmentSizes:
+               # record was never spooled, or its segment has already been evicted
+               continue
+            self._outstanding[segmentId] -= count
+            if self._outstanding[segmentId] <= 0 and segmentId != self._activeSegmentId:
+               self._deleteSegment(segmentId)
+
+   # Return a snapshot of the spool statistics
+   def getStatistics(self) -> Dict[str, int]:
+      with self._lock:
+         statistics = dict(self.statistics)
+         statistics["segments"] = len(self._segmentSizes)
+         statistics["spooledBytes"] = sum(self._segmentSizes.values())
+      return statistics
+
+   # Make sure all records up to the given sequence number are on disk
+   def _sync(self,
+             sequence: int) -> None:
+      with self._syncLock:
+         if self._syncedSequence >= sequence:
+            # another thread's fsync has already covered this record
+            return
+         with self._lock:
+            segmentFile = self._activeFile
+            if not segmentFile:
+               # spool has been closed
+               return
+            segmentFile.flush()
+            targetSequence = self._writtenSequence
+         try:
+            os.fsync(segmentFile.fileno())
+         except ValueError:
+            # segment has been sealed (and synced) in the meantime
+            pass
+         self._syncedSequence = targetSequence
+         with self._lock:
+            self.statistics["syncs"] += 1
+
+   # Delete the oldest sealed segments until the spool fits into its size limit
+   # Caller must hold self._lock
+   def _enforceSizeLimit(self) -> Set[int]:
+      evictedSegmentIds = set()
+      while sum(self._segmentSizes.values()) > self.maxSpoolBytes:
+         sealedSegmentIds = [s for s in self._segmentSizes if s != self._activeSegmentId]
+         if not sealedSegmentIds:
+            break
+         segmentId = min(sealedSegmentIds)
+         self.tracer.warning("spool exceeds %d bytes, evicting %d unsent results of segment %d" % (self.maxSpoolBytes,
+                                                                                                  self._outstanding[segmentId],
+                                                                                                  segmentId))
+         self._deleteSegment(segmentId)
+         self.statistics["evictedSegments"] += 1
+         evictedSegmentIds.add(segmentId)
+      return evictedSegmentIds
+
+   # Caller must hold self._lock
+   def _openSegment(self,
+                    segmentId: int) -> None:
+      self._activeSegmentId = segmentId
+      self._activeFile = open(self._getSegmentFileName(segmentId), "ab")
+      self._segmentSizes[segmentId] = 0
+
+   # Caller must hold self._lock
+   def _closeActiveSegment(self) -> None:
+      segmentId = self._activeSegmentId
+      self._activeFile.flush()
+      os.fsync(self._activeFile.fileno())
+      self._activeFile.close()
+      self._activeFile = None
+      if self._outstanding[segmentId] <= 0:
+         self._deleteSegment(segmentId)
+
+   # Caller must hold self._lock
+   def _deleteSegment(self,
+                      segmentId: int) -> None:
+      self._segmentSizes.pop(segmentId, None)
+      self._outstanding.pop(segmentId, None)
+      try:
+         os.remove(self._getSegmentFileName(segmentId))
+      except FileNotFoundError:
+         pass
+
+   # Return the ids of all segment files, oldest first
+   def _listSegments(self) -> List[int]:
+      segmentIds = []
+      for fileName in os.listdir(self.path):
+         (name, extension) = os.path.splitext(fileName)
+         if extension == SPOOL_SEGMENT_EXTENSION and name.isdigit():
+            segmentIds.append(int(name))
+      return sorted(segmentIds)
+
+   # Parse all complete records of a segment file (a torn record at the end is ignored)
+   def _readSegment(self,
+                    segmentId: int) -> List[Tuple[int, str, str, bytes]]:
+      segmentRecords = []
+      with open(self._getSegmentFileName(segmentId), "rb") as segmentFile:
+         content = segmentFile.read()
+      offset = 0
+      while offset < len(content):
+         headerEnd = content.find(b"\n", offset)
+         if headerEnd < 0:
+            break
+         try:
+            header = json.loads(content[offset:headerEnd].decode("utf-8"))
+            recordsEnd = headerEnd + 1 + header["length"]
+         except Exception as e:
+            self.tracer.error("corrupt record in spool segment %d at offset %d (%s)" % (segmentId,
+                                                                                       offset,
+                                                                                       e))
+            break
+         if recordsEnd >= len(content) or content[recordsEnd:recordsEnd + 1] != b"\n":
+            self.tracer.warning("ignoring incomplete record at the end of spool segment %d" % segmentId)
+            break
+         segmentRecords.append((segmentId,
+                                header["customLog"],
+                                header["colTimeGenerated"],
+                                content[headerEnd + 1:recordsEnd]))
+         offset = recordsEnd + 1
+      return segmentRecords
+
+   def _getSegmentFileName(self,
+                           segmentId: int) -> str:
+      return os.path.join(self.path, "%012d%s" % (segmentId, SPOOL_SEGMENT_EXTENSION))
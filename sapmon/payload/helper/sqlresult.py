@@ -0,0 +1,138 @@
+# Python modules
+from datetime import date, datetime
+import decimal
+import hashlib
+from typing import Any, Dict, Iterable, List
+
+# Payload modules
+from const import *
+from helper.serializer import RecordBuffer, RecordSerializer
+
+# xxHash is optional; without it, BLAKE2 is used
+try:
+   import xxhash
+except ImportError:
+   xxhash = None
+
+###############################################################################
+
+# Digest of a result set that is updated row by row
+# Every value is encoded together with its type (and length, where needed), so the digest does not
+# depend on how a driver happens to render a value as string
+class RowDigest:
+   FIELD_SEPARATOR = b"\x1f"
+   ROW_SEPARATOR = b"\x1e"
+
+   def __init__(self):
+      if xxhash:
+         self._hash = xxhash.xxh3_128()
+         self._prefix = "xxh3"
+      else:
+         self._hash = hashlib.blake2b(digest_size = 16)
+         self._prefix = "blake2b"
+
+   # Add a single row (sequence of column values)
+   def update(self,
+              row: Iterable) -> None:
+      update = self._hash.update
+      for value in row:
+         update(RowDigest._encodeValue(value))
+         update(RowDigest.FIELD_SEPARATOR)
+      update(RowDigest.ROW_SEPARATOR)
+
+   def hexdigest(self) -> str:
+      return "%s:%s" % (self._prefix, self._hash.hexdigest())
+
+   # Stable, type-tagged binary encoding of a single value
+   @staticmethod
+   def _encodeValue(value: Any) -> bytes:
+      if value is None:
+         return b"N"
+      if isinstance(value, bool):
+         return b"T" if value else b"F"
+      if isinstance(value, int):
+         return b"I%d" % value
+      if isinstance(value, float):
+         return b"R" + repr(value).encode("ascii")
+      if isinstance(value, decimal.Decimal):
+         return b"D" + str(value).encode("ascii")
+      if isinstance(value, datetime):
+         return b"t" + value.isoformat().encode("ascii")
+      if isinstance(value, date):
+         return b"d" + value.isoformat().encode("ascii")
+      if isinstance(value, (bytes, bytearray, memoryview)):
+         value = bytes(value)
+         return b"B%d:" % len(value) + value
+      if isinstance(value, str):
+         value = value.encode("utf-8")
+         return b"S%d:" % len(value) + value
+      value = repr(value).encode("utf-8")
+      return b"O%d:" % len(value) + value
+
+###############################################################################
+
+# Result of a SQL statement that is converted into compact JSON records while it is being fetched
+# Only the rows needed to update the check state (first and last row) are kept, unless keepRows is set,
+# so memory usage is bounded by the fetch batch size rather than by the size of the result set
+class SqlResult:
+   def __init__(self,
+                colIndex: Dict[str, int],
+                constantFields: Dict[str, Any],
+                includedColumns: List[str],
+                keepRows: bool = False,
+                maxChunkBytes: int = RESULT_CHUNK_MAX_BYTES):
+      self.colIndex = colIndex
+      self.rowCount = 0
+      self.firstRow = None
+      self.lastRow = None
+      self.rows = [] if keepRows else None
+      self.maxChunkBytes = maxChunkBytes
+      self._includedColumns = [(c, colIndex[c]) for c in includedColumns]
+      self._serializer = RecordSerializer(constantFields, sortKeys = False)
+      # Internal columns (such as the server timestamp) differ on every run and are not part of the digest
+      self._digestColumns = [(c, i) for (c, i) in colIndex.items() if not (c.startswith("_") or c == "DUMMY")]
+      self._digest = RowDigest()
+      # Columns are part of the digest, so a changed statement never yields the same digest
+      self._digest.update([c for (c, _) in self._digestColumns])
+      self._records = RecordBuffer(maxChunkBytes)
+
+   # Fetch all remaining rows of a cursor in batches
+   def fetchFrom(self,
+                 cursor,
+                 batchSize: int = SQL_FETCH_BATCH_SIZE) -> None:
+      while True:
+         rows = cursor.fetchmany(batchSize)
+         if not rows:
+            break
+         self.addRows(rows)
+
+   # Encode rows and add them to the result
+   def addRows(self,
+               rows: Iterable) -> None:
+      for row in rows:
+         if self.rowCount == 0:
+            self.firstRow = row
+         self.lastRow = row
+         self.rowCount += 1
+         if self.rows is not None:
+            self.rows.append(row)
+         self._digest.update([row[i] for (_, i) in self._digestColumns])
+         self._records.addRecord(self._serializer.encodeRecord({c: row[i] for (c, i) in self._includedColumns}))
+
+   # Return the result as JSON arrays that each fit into a single ingestion request
+   def getJsonChunks(self) -> List[str]:
+      return self._records.getJsonChunks()
+
+   # Return the result as a single JSON array
+   def getJsonString(self) -> str:
+      return self._records.getJsonString()
+
+   # Return the individually encoded records of the result
+   def getRecords(self) -> List[str]:
+      return self._records.records
+
+   # Return the digest of all rows of the result (None for an empty result)
+   def getHash(self) -> str:
+      if self.rowCount == 0:
+         return None
+      return self._digest.hexdigest()
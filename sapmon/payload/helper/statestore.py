@@ -0,0 +1,181 @@
+# Python modules
+import logging
+import sqlite3
+import threading
+from time import monotonic
+from typing import Dict
+
+# Payload modules
+from const import *
+from helper.tools import Singleton
+
+###############################################################################
+
+# Crash-safe store for the state of all provider instances and their checks (SQLite in WAL mode)
+# Every provider instance keeps one JSON value per key (global state and one per check); values are
+# only written if they differ from what has been written before, and writes of all worker threads are
+# coalesced and committed by a background writer in a single transaction
+class StateStore(metaclass=Singleton):
+   tracer = None
+
+   def __init__(self,
+                tracer: logging.Logger,
+                filename: str = FILENAME_STATE_DB,
+                flushIntervalSecs: float = STATE_FLUSH_INTERVAL_IN_SECONDS):
+      self.tracer = tracer
+      self.filename = filename
+      self.flushIntervalSecs = flushIntervalSecs
+      self._connection = sqlite3.connect(filename,
+                                         check_same_thread = False,
+                                         isolation_level = None)
+      self._connection.execute("PRAGMA journal_mode=WAL")
+      self._connection.execute("PRAGMA synchronous=NORMAL")
+      self._connection.execute("CREATE TABLE IF NOT EXISTS state ("
+                               "provider TEXT NOT NULL, "
+                               "key TEXT NOT NULL, "
+                               "value TEXT NOT NULL, "
+                               "PRIMARY KEY (provider, key))")
+      self._connectionLock = threading.Lock()
+      self._flushLock = threading.Lock()
+      self._condition = threading.Condition()
+      self._pending = {}
+      self._inFlight = {}
+      self._written = {}
+      self._writer = None
+      self._isStopping = False
+      self.statistics = {
+         "puts": 0,
+         "skippedClean": 0,
+         "flushes": 0,
+         "rowsWritten": 0
+      }
+
+   # Return all keys (and their JSON values) stored for a provider instance
+   def load(self,
+            provider: str) -> Dict[str, str]:
+      with self._connectionLock:
+         rows = self._connection.execute("SELECT key, value FROM state WHERE provider = ?",
+                                         (provider,)).fetchall()
+      values = {}
+      with self._condition:
+         for (key, value) in rows:
+            self._written[(provider, key)] = value
+            values[key] = value
+         # Writes that have not been flushed yet are more recent than what is in the database
+         for ((p, key), value) in self._pending.items():
+            if p == provider:
+               values[key] = value
+      return values
+
+   # Queue the JSON value of a single key for writing, unless it has not changed
+   def put(self,
+           provider: str,
+           key: str,
+           value: str) -> bool:
+      storeKey = (provider, key)
+      with self._condition:
+         self.statistics["puts"] += 1
+         if self._getLatestValue(storeKey) == value:
+            self.statistics["skippedClean"] += 1
+            return False
+         self._pending[storeKey] = value
+         self._startWriter()
+         self._condition.notify_all()
+      return True
+
+   # Remove all state of a provider instance
+   def deleteProvider(self,
+                      provider: str) -> None:
+      with self._condition:
+         for storeKey in [k for k in self._pending if k[0] == provider]:
+            del self._pending[storeKey]
+         for storeKey in [k for k in self._written if k[0] == provider]:
+            del self._written[storeKey]
+      with self._connectionLock:
+         self._connection.execute("DELETE FROM state WHERE provider = ?", (provider,))
+
+   # Write all pending values in a single transaction
+   def flush(self) -> None:
+      with self._flushLock:
+         with self._condition:
+            pending = self._pending
+            self._pending = {}
+            self._inFlight = pending
+         if pending:
+            self._writePending(pending)
+         with self._condition:
+            self._inFlight = {}
+
+   # Caller must hold self._flushLock
+   def _writePending(self,
+                     pending: Dict) -> None:
+      try:
+         with self._connectionLock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany("INSERT OR REPLACE INTO state (provider, key, value) VALUES (?, ?, ?)",
+                                         [(p, k, v) for ((p, k), v) in pending.items()])
+            self._connection.execute("COMMIT")
+      except Exception as e:
+         self.tracer.error("could not write state (%s)" % e, exc_info=True)
+         with self._connectionLock:
+            if self._connection.in_transaction:
+               self._connection.execute("ROLLBACK")
+         with self._condition:
+            # keep values for the next attempt, unless they have been superseded in the meantime
+            for (storeKey, value) in pending.items():
+               self._pending.setdefault(storeKey, value)
+         return
+      with self._condition:
+         self._written.update(pending)
+         self.statistics["flushes"] += 1
+         self.statistics["rowsWritten"] += len(pending)
+
+   # Flush all pending values and stop the background writer
+   def close(self) -> None:
+      with self._condition:
+         self._isStopping = True
+         self._condition.notify_all()
+         writer = self._writer
+      if writer:
+         writer.join()
+      self.flush()
+
+   # Return a snapshot of the state store statistics
+   def getStatistics(self) -> Dict[str, int]:
+      with self._condition:
+         statistics = dict(self.statistics)
+         statistics["pending"] = len(self._pending)
+      return statistics
+
+   # Return the most recent value of a key, whether it is still pending, being written or already written
+   # Caller must hold self._condition
+   def _getLatestValue(self,
+                       storeKey: tuple) -> str:
+      for values in (self._pending, self._inFlight, self._written):
+         if storeKey in values:
+            return values[storeKey]
+      return None
+
+   # Caller must hold self._condition
+   def _startWriter(self) -> None:
+      if self._writer or self._isStopping:
+         return
+      self._writer = threading.Thread(target = self._run,
+                                      name = "statestore",
+                                      daemon = True)
+      self._writer.start()
+
+   # Main loop of the background writer
+   def _run(self) -> None:
+      while True:
+         with self._condition:
+            while not self._pending and not self._isStopping:
+               self._condition.wait()
+            # Give other worker threads the chance to add their writes to the same transaction
+            deadline = monotonic() + self.flushIntervalSecs
+            while not self._isStopping and monotonic() < deadline:
+               self._condition.wait(deadline - monotonic())
+            if self._isStopping:
+               # close() takes care of the final flush
+               return
+         self.flush()
@@ -5,6 +5,7 @@ import http.client as http_client
 import json
 import logging
 import requests
+import threading
 from typing import Callable, Dict, Optional
 from binascii import hexlify
 from time import time
@@ -71,8 +72,22 @@ class JsonEncoder(json.JSONEncoder):
 
 ###############################################################################
 
+# Helper class to serialize provider state into JSON
+# datetime objects are tagged ({"$datetime": "<TIME_FORMAT_JSON>"}), so they can be decoded
+# without guessing which strings might be timestamps
+class StateJsonEncoder(JsonEncoder):
+   def default(self,
+               o: object) -> object:
+      if isinstance(o, (datetime, date)):
+         return {STATE_TAG_DATETIME: datetime.strftime(o, TIME_FORMAT_JSON)}
+      return super(StateJsonEncoder, self).default(o)
+
+###############################################################################
+
 # Helper class to de-serialize JSON into datetime and Decimal objects
 class JsonDecoder(json.JSONDecoder):
+   # Legacy decoding of untagged state (written by StateJsonEncoder's predecessor),
+   # which turns every string that can be parsed as TIME_FORMAT_JSON into a datetime
    def datetimeHook(jsonData: Dict[str, str]) -> Dict[str, str]:
       for (k, v) in jsonData.items():
          try:
@@ -81,14 +96,25 @@ class JsonDecoder(json.JSONDecoder):
             pass
       return jsonData
 
+   # Decode datetime objects tagged by StateJsonEncoder; all other values are returned as-is
+   def typedHook(jsonData: Dict[str, object]) -> object:
+      if len(jsonData) == 1 and STATE_TAG_DATETIME in jsonData:
+         # TIME_FORMAT_JSON is ISO 8601 with a literal "Z" suffix
+         return datetime.fromisoformat(jsonData[STATE_TAG_DATETIME][:-1])
+      return jsonData
+
 ###############################################################################
 
 # Helper class to implement singleton
+# (thread-safe, since singletons are also first used from worker threads)
 class Singleton(type):
    _instances = {}
+   _lock = threading.RLock()
    def __call__(cls, *args, **kwargs):
       if cls not in cls._instances:
-         cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+         with Singleton._lock:
+            if cls not in cls._instances:
+               cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
       return cls._instances[cls]
 
 ###############################################################################
@@ -9,10 +9,11 @@ import json
 import logging
 import logging.config
 import traceback
-from typing import Callable, Dict, Optional
+from typing import Callable, Dict, List, Optional
 
 # Payload modules
 from const import *
+from helper.analyticsqueue import BatchedQueueStorageHandler
 from helper.azure import *
 
 # Formats a log/trace payload as JSON-formatted string
@@ -182,14 +183,15 @@ class tracing:
                                                 ctx.vmInstance["subscriptionId"],
                                                 ctx.vmInstance["resourceGroupName"])
            storageKey = tracing.getAccessKeys(tracer, ctx)
-           customerMetricsLogHandler = QueueStorageHandler(account_name = storageAccount.accountName,
-                                                           account_key = storageKey,
-                                                           protocol = "https",
-                                                           queue = queueName)
+           customerMetricsLogHandler = BatchedQueueStorageHandler(tracer,
+                                                                  accountName = storageAccount.accountName,
+                                                                  accountKey = storageKey,
+                                                                  queue = queueName)
        except Exception as e:
            tracer.error("could not add handler for the storage queue logging (%s) " % e)
            return
 
+       ctx.analyticsHandler = customerMetricsLogHandler
        logger = logging.getLogger("customerMetricsLogger")
        logger.addHandler(customerMetricsLogHandler)
        return logger
@@ -200,15 +202,24 @@ class tracing:
                                ctx,
                                customLog: str,
                                resultJson: str) -> None:
-      tracer.info("sending customer analytics")
       results = json.loads(resultJson)
-      for result in results:
-         metrics = {
-            "Type": customLog,
-            "Data": result,
-         }
-         j = json.dumps(metrics)
-         ctx.analyticsTracer.debug(j)
+      tracing.ingestCustomerAnalyticsRecords(tracer,
+                                             ctx,
+                                             customLog,
+                                             [json.dumps(result) for result in results])
+      return
+
+   # Ingest already encoded result records into customer analytics
+   # Every record is embedded into the message as it is, without parsing it again
+   @staticmethod
+   def ingestCustomerAnalyticsRecords(tracer: logging.Logger,
+                                      ctx,
+                                      customLog: str,
+                                      records: List[str]) -> None:
+      tracer.info("sending customer analytics")
+      messagePrefix = "{\"Type\": %s, \"Data\": " % json.dumps(customLog)
+      for record in records:
+         ctx.analyticsTracer.debug(messagePrefix + record + "}")
       return
 
    # Fetches the storage access keys from keyvault or directly from storage account
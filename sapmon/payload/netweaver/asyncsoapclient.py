@@ -0,0 +1,147 @@
+# Python modules
+import logging
+from threading import Lock
+from time import time
+
+# SOAP Client modules
+import httpx
+from zeep import AsyncClient
+from zeep.transports import AsyncTransport
+
+# Payload modules
+from helper.tools import *
+from netweaver.soapclient import NetWeaverSoapClient, SOAP_API_TIMEOUT_SECS
+from netweaver.soapeventloop import SoapEventLoop
+
+# maximum number of concurrent HTTP connections to all sapstartsrv endpoints (shared by all asynchronous SOAP clients)
+SOAP_ASYNC_MAX_CONNECTIONS = 200
+
+########
+# asynchronous implementation for the NetWeaverSoapClientBase abstract class.
+# SOAP API calls are executed on the shared SOAP event loop over a single, shared HTTP connection pool, so
+# in-flight calls do not hold a thread each.  The synchronous API methods of the base interface block the
+# calling thread until the call has completed; coroutine versions with the same names are available via .aio
+########
+class NetWeaverAsyncSoapClient(NetWeaverSoapClient):
+
+    # static class variable for the HTTP client shared by all asynchronous SOAP clients
+    _httpClient = None
+    _httpClientLock = Lock()
+
+    def __init__(self,
+                 tracer: logging.Logger,
+                 logTag: str,
+                 sapSid: str, 
+                 sapHostName: str,
+                 sapSubdomain: str,
+                 httpProtocol: str,
+                 httpPort: int):
+        super().__init__(tracer=tracer,
+                         logTag=logTag,
+                         sapSid=sapSid,
+                         sapHostName=sapHostName,
+                         sapSubdomain=sapSubdomain,
+                         httpProtocol=httpProtocol,
+                         httpPort=httpPort)
+        self.aio = NetWeaverAsyncSoapApi(self)
+
+    ##########
+    # private member methods
+    ##########
+
+    """
+    private method to initialize internal asynchronous SOAP API client and return the initialized client object, 
+    or throw if initialization fails (the WSDL itself is still fetched synchronously)
+    """
+    def _initSoapClient(self, logTag: str) -> AsyncClient:
+        self.tracer.info("%s begin initialize async SOAP client for wsdl: %s", logTag, self.wsdlUrl)
+
+        startTime = time()
+        try:
+            transport = AsyncTransport(client=NetWeaverAsyncSoapClient._getHttpClient(),
+                                       cache=self._getProbedWsdlCache(),
+                                       verify_ssl=False,
+                                       timeout=SOAP_API_TIMEOUT_SECS,
+                                       operation_timeout=SOAP_API_TIMEOUT_SECS)
+            client = AsyncClient(self.wsdlUrl, transport=transport)
+            self.tracer.info("%s initialize async SOAP client SUCCESS for wsdl: %s [%d ms]",
+                             logTag, self.wsdlUrl, TimeUtils.getElapsedMilliseconds(startTime))
+            return client
+        except Exception as e:
+            self.tracer.error("%s initialize async SOAP client ERROR for wsdl: %s [%d ms] %s",
+                              logTag, self.wsdlUrl, TimeUtils.getElapsedMilliseconds(startTime), e, exc_info=True)
+            raise e
+
+    """
+    synchronous SOAP API call, executed on the shared SOAP event loop
+    """
+    def _callSoapApi(self, apiName: str, logTag: str) -> str:
+        return SoapEventLoop().run(self._callSoapApiAsync(apiName, logTag))
+
+    """
+    verify against wsdl that the specified SOAP API is defined for the current client, 
+    and if so we will attempt to call it and return the result
+    """
+    async def _callSoapApiAsync(self, apiName: str, logTag: str) -> str:
+        if (not self._isSoapApiDefined(apiName)):
+            raise Exception("%s SOAP API not defined: %s, wsdl: %s", logTag, apiName, self.wsdlUrl)
+
+        self.tracer.info("%s SOAP API executing: %s, wsdl: %s", logTag, apiName, self.wsdlUrl)
+
+        startTime = time()
+        try:
+            method = getattr(self.client.service, apiName)
+            result = await method()
+            self.tracer.info("%s SOAP API success for %s, wsdl: %s [%d ms]",
+                             logTag, apiName, self.wsdlUrl, TimeUtils.getElapsedMilliseconds(startTime))
+
+            return result
+        except Exception as e:
+            self.tracer.error("%s SOAP API error for %s, wsdl: %s [%d ms] %s",
+                              logTag, apiName, self.wsdlUrl, TimeUtils.getElapsedMilliseconds(startTime), e, exc_info=True)
+            raise e
+
+    """
+    return the HTTP client shared by all asynchronous SOAP clients, creating it on first use
+    """
+    @staticmethod
+    def _getHttpClient() -> httpx.AsyncClient:
+        with NetWeaverAsyncSoapClient._httpClientLock:
+            if not NetWeaverAsyncSoapClient._httpClient:
+                NetWeaverAsyncSoapClient._httpClient = httpx.AsyncClient(verify=False,
+                                                                         timeout=SOAP_API_TIMEOUT_SECS,
+                                                                         limits=httpx.Limits(max_connections=SOAP_ASYNC_MAX_CONNECTIONS))
+        return NetWeaverAsyncSoapClient._httpClient
+
+########
+# coroutine versions of the NetWeaverSoapClientBase API methods of an asynchronous SOAP client;
+# these have to be awaited on the shared SOAP event loop
+########
+class NetWeaverAsyncSoapApi:
+
+    def __init__(self, soapClient: NetWeaverAsyncSoapClient):
+        self.soapClient = soapClient
+
+    async def getSystemInstanceList(self, logTag: str) -> list:
+        result = await self.soapClient._callSoapApiAsync('GetSystemInstanceList', logTag)
+        return NetWeaverSoapClient._parseResults(result)
+
+    async def getProcessList(self, logTag: str) -> list:
+        result = await self.soapClient._callSoapApiAsync('GetProcessList', logTag)
+        return NetWeaverSoapClient._parseResults(result)
+
+    async def getAbapWorkerProcessTable(self, logTag: str) -> list:
+        result = await self.soapClient._callSoapApiAsync('ABAPGetWPTable', logTag)
+        return NetWeaverSoapClient._parseResults(result)
+
+    async def getQueueStatistic(self, logTag: str) -> list:
+        result = await self.soapClient._callSoapApiAsync('GetQueueStatistic', logTag)
+        return NetWeaverSoapClient._parseResults(result)
+
+    async def getEnqueueServerStatistic(self, logTag: str) -> list:
+        result = await self.soapClient._callSoapApiAsync('EnqGetStatistic', logTag)
+        return NetWeaverSoapClient._parseResult(result)
+
+    async def getEnvironment(self, logTag: str) -> list:
+        result = await self.soapClient._callSoapApiAsync('GetEnvironment', logTag)
+        return NetWeaverSoapClient._parseResults(result)
@@ -0,0 +1,70 @@
+# Python modules
+from collections import deque
+from concurrent.futures import Executor, Future
+from threading import Lock
+from typing import Callable
+
+##########
+# runs calls on a shared executor with at most maxConcurrency of them executing at the same time.
+# calls beyond the limit wait in this queue instead of occupying (and blocking) a thread of the shared executor,
+# so a single key (e.g. SID) with many calls can never starve the calls of other keys.
+# a call that is cancelled while it is still queued is never started
+##########
+class LimitedFanOutQueue:
+
+    def __init__(self, executor: Executor, maxConcurrency: int):
+        self.executor = executor
+        self.maxConcurrency = maxConcurrency
+        self._lock = Lock()
+        self._pending = deque()
+        self._running = 0
+
+    """
+    queue a call and return a future for its result
+    """
+    def submit(self, func: Callable, *args) -> Future:
+        future = Future()
+        with self._lock:
+            if self._running >= self.maxConcurrency:
+                self._pending.append((future, func, args))
+                return future
+            self._running += 1
+        future.set_running_or_notify_cancel()
+        self._execute(future, func, args)
+        return future
+
+    """
+    number of calls that are currently executing and that are waiting to be executed
+    """
+    def getCounts(self) -> tuple:
+        with self._lock:
+            return self._running, len(self._pending)
+
+    def _execute(self, future: Future, func: Callable, args: tuple) -> None:
+        try:
+            self.executor.submit(self._run, future, func, args)
+        except Exception as e:
+            future.set_exception(e)
+            self._startNext()
+
+    def _run(self, future: Future, func: Callable, args: tuple) -> None:
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._startNext()
+
+    """
+    hand the slot of a finished call to the next queued call that has not been cancelled in the meantime
+    """
+    def _startNext(self) -> None:
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running -= 1
+                    return
+                (future, func, args) = self._pending.popleft()
+            if future.set_running_or_notify_cancel():
+                self._execute(future, func, args)
+                return
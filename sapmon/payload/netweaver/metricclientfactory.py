@@ -6,11 +6,17 @@ import logging
 from typing import Callable, Dict, List, Optional
 
 # Payload modules
+from helper.cache import TtlCache
+from helper.endpointhealth import EndpointHealthRegistry
 from helper.tools import *
 
-# soap client cache expiration, after which amount of time both successful + failed soap client instantiation attempts will be refreshed
+# soap client cache expiration, after which amount of time successful soap client instantiation attempts will be refreshed
+# (failed attempts are not cached, the endpoint is backed off by the EndpointHealthRegistry instead)
 SOAP_CLIENT_CACHE_EXPIRATIION = timedelta(minutes=10)
 
+# maximum number of cached soap clients (one per host, protocol and port)
+SOAP_CLIENT_CACHE_MAX_ENTRIES = 1000
+
 ##########
 # Abstract base class to represent interface for querying Server/System time from SAP system
 ##########
@@ -101,7 +107,8 @@ class NetWeaverMetricClient(ABC):
                        lastRunTime: datetime,
                        minimumRunIntervalSecs: int,
                        serverTimeZone: timezone,
-                       logTag: str) -> tuple:
+                       logTag: str,
+                       alignmentSecs: int = None) -> tuple:
         pass
 
     # query sap instance to get current server time
@@ -192,7 +199,44 @@ class MetricClientFactory:
 
     # static class variable to keep cache of all successfully initialized SOAP metric clients 
     # using a lookup key of the WSDL url.
-    _soapClientCache= {}
+    _soapClientCache = TtlCache("soapClients",
+                                ttlSecs=SOAP_CLIENT_CACHE_EXPIRATIION.total_seconds(),
+                                maxEntries=SOAP_CLIENT_CACHE_MAX_ENTRIES)
+
+    # static class variables to control whether SOAP clients are created with the asynchronous implementation;
+    # it is only used if enabled in the global config (see setAsyncSoapClientEnabled()) and its dependencies
+    # (zeep AsyncClient and httpx) are available
+    useAsyncSoapClient = False
+    _asyncSoapClientClass = None
+    _isAsyncSoapClientAvailable = None
+
+    """
+    enable or disable the asynchronous SOAP client implementation (e.g. after a config refresh); cached clients
+    of the other implementation are dropped, so every check uses clients that match its execution mode
+    """
+    @staticmethod
+    def setAsyncSoapClientEnabled(enabled: bool) -> None:
+        if MetricClientFactory.useAsyncSoapClient == enabled:
+            return
+        MetricClientFactory.useAsyncSoapClient = enabled
+        MetricClientFactory._soapClientCache.clear()
+
+    """
+    return flag indicating whether SOAP clients are created with the asynchronous implementation,
+    so the SOAP API calls of a check can be executed on the shared SOAP event loop without using threads
+    """
+    @staticmethod
+    def isAsyncSoapClientEnabled() -> bool:
+        if not MetricClientFactory.useAsyncSoapClient:
+            return False
+        if MetricClientFactory._isAsyncSoapClientAvailable is None:
+            try:
+                from netweaver.asyncsoapclient import NetWeaverAsyncSoapClient
+                MetricClientFactory._asyncSoapClientClass = NetWeaverAsyncSoapClient
+                MetricClientFactory._isAsyncSoapClientAvailable = True
+            except ImportError:
+                MetricClientFactory._isAsyncSoapClientAvailable = False
+        return MetricClientFactory._isAsyncSoapClientAvailable
 
     @staticmethod
     def getMetricClient(tracer: logging.Logger, 
@@ -275,9 +319,9 @@ class MetricClientFactory:
     """
     attempt to initialize SOAP client for SAP hostname using a specific http protocol and port.
     This will involve fetching the SOAP WSDL from the remote host via http call, which is then used define
-    the client APIs available.  If we have a previously cached attempt to initialize the a SOAP client
-    for this WSDL, and it is within TTL, then go ahead and return the cached client 
-    (if success, or throw exception if last attempt failed)
+    the client APIs available.  If we have a previously cached SOAP client for this WSDL, and it is within TTL,
+    then go ahead and return the cached client.  If initialization for this WSDL has recently failed, throw right
+    away until the exponential backoff of the endpoint has expired
     The client cache significantly reduces the # of off-box calls we have to make, since fetching the WSDL 
     for ever API call would result in 2x the outgoing request load.
     """
@@ -289,29 +333,25 @@ class MetricClientFactory:
                                           sapSubdomain: str,
                                           httpProtocol: str,
                                           httpPort: int,
-                                          useCache: bool = True) -> NetWeaverSoapClientBase:
+                                          useCache: bool = True,
+                                          checkEndpointHealth: bool = True) -> NetWeaverSoapClientBase:
         from netweaver.soapclient import NetWeaverSoapClient
 
         wsdl = NetWeaverSoapClient._getFullyQualifiedWsdl(sapHostName, sapSubdomain, httpProtocol, httpPort)
 
-        # see if we have SOAP client we can use for this specific hostname + port, since instantiating
-        # a new SOAP client involves making off box call to fetch WSDL so we try to avoid doing that more often than needed
-        if (useCache and wsdl in MetricClientFactory._soapClientCache):
-            cacheEntry = MetricClientFactory._soapClientCache[wsdl]
-            # only return cached SOAP client if the cache TTL has not expired
-            if (cacheEntry['expirationDateTime'] > datetime.utcnow()):
-                if (cacheEntry['client']):
-                    # return cached SOAP client
-                    return cacheEntry['client']
-                else:
-                    # cached soap client was not initialized successfully, so throw
-                    raise Exception("%s cached NetWeaverSoapClient failure for wsdl: %s", logTag, wsdl)
-
         # no valid cached client was found, so try to fetch WSDL for this specific host and port
-        startTime = time()
-        client = None
-        try:
-            client = NetWeaverSoapClient(tracer=tracer,
+        def createClient() -> NetWeaverSoapClientBase:
+            # skip hosts and ports that have recently failed until their backoff has expired, unless the caller
+            # has already checked the endpoint health itself
+            endpointHealth = EndpointHealthRegistry(tracer)
+            if checkEndpointHealth and not endpointHealth.isAvailable(wsdl):
+                raise Exception("%s skipping NetWeaverSoapClient initialization for unavailable wsdl: %s" % (logTag, wsdl))
+
+            startTime = time()
+            try:
+                # choose the asynchronous SOAP client implementation if it is available
+                soapClientClass = MetricClientFactory._asyncSoapClientClass if MetricClientFactory.isAsyncSoapClientEnabled() else NetWeaverSoapClient
+                client = soapClientClass(tracer=tracer,
                                          logTag=logTag,
                                          sapSid=sapSid,
                                          sapHostName=sapHostName,
@@ -319,19 +359,27 @@ class MetricClientFactory:
                                          httpProtocol=httpProtocol,
                                          httpPort=httpPort)
 
-            tracer.info("%s success initializing NetWeaverSoapClient for wsdl: %s [%d ms]",
-                         logTag, wsdl, TimeUtils.getElapsedMilliseconds(startTime))
-            return client
-        except Exception as ex:
-            tracer.error("%s error initializing NetWeaverSoapClient for wsdl: %s, [%d ms] %s", 
-                         logTag, wsdl, TimeUtils.getElapsedMilliseconds(startTime), ex, exc_info=True)
-            raise
-        finally:
-            # cache soap client result, whether success or failure
-            MetricClientFactory._soapClientCache[wsdl] = { 
-                                                            'client': client, 
-                                                            'expirationDateTime': datetime.utcnow() + SOAP_CLIENT_CACHE_EXPIRATIION 
-                                                         }
+                tracer.info("%s success initializing %s for wsdl: %s [%d ms]",
+                             logTag, soapClientClass.__name__, wsdl, TimeUtils.getElapsedMilliseconds(startTime))
+                # client initialization always makes a request to the host (at least a HEAD request if the WSDL
+                # is cached), so this reflects that the endpoint is actually reachable
+                endpointHealth.recordSuccess(wsdl)
+                return client
+            except Exception as ex:
+                tracer.error("%s error initializing NetWeaverSoapClient for wsdl: %s, [%d ms] %s", 
+                             logTag, wsdl, TimeUtils.getElapsedMilliseconds(startTime), ex, exc_info=True)
+                endpointHealth.recordFailure(wsdl)
+                raise
+
+        # see if we have SOAP client we can use for this specific hostname + port, since instantiating
+        # a new SOAP client involves making off box call to fetch WSDL so we try to avoid doing that more often than needed;
+        # concurrent requests for the same WSDL share a single initialization attempt
+        # (only successfully initialized soap clients are cached, failed attempts are governed by the endpoint backoff instead)
+        if useCache:
+            return MetricClientFactory._soapClientCache.getOrLoad(wsdl, createClient)
+        client = createClient()
+        MetricClientFactory._soapClientCache.put(wsdl, client)
+        return client
             
     """
     factory method to create a SAP Server Time client based on Message Server HTTP client implementation
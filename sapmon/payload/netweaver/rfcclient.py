@@ -5,23 +5,37 @@ import pytz
 import logging
 import re
 import time
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta, time, tzinfo, timezone
-from pandas import DataFrame
-from typing import Dict, List
-import pandas
+from typing import Dict, Iterator, List
 
 # SAP modules
 from pyrfc import Connection, ABAPApplicationError, ABAPRuntimeError, LogonError, CommunicationError
 
 # abstract base class module
 from netweaver.metricclientfactory import NetWeaverMetricClient
+from netweaver.rfcconnectionpool import RfcConnectionPool
+from helper.endpointhealth import EndpointHealthRegistry
 from helper.tools import JsonEncoder
 from netweaver.swncsharedcache import SwncRfcSharedCache
+from netweaver.swnctable import SwncSnapshotTable
 
 # enforce maximum query window size so that we don't accidentally query SAP for huge
 # data sets after periods of prolonged downtime/inactivity
 MAX_QUERY_LOOKBACK_WINDOW = timedelta(minutes=15)
 
+# RFC_READ_TABLE and /SAPDS/RFC_READ_TABLE2 results are read in pages of this many rows (ROWCOUNT / ROWSKIPS),
+# up to a maximum number of rows per check run so that huge tables can never exhaust the memory of the collector
+RFC_READ_TABLE_PAGE_SIZE = 5000
+RFC_READ_TABLE_MAX_ROWS = 100000
+RFC_READ_TABLE_DELIMITER = ';'
+
+# maximum length of a single line in the OPTIONS (where clause) table of RFC_READ_TABLE
+RFC_READ_TABLE_OPTIONS_LINE_LENGTH = 72
+
+# output tables that contain the rows of RFC_READ_TABLE (DATA) and /SAPDS/RFC_READ_TABLE2 (TBLOUT*, depending on row width)
+RFC_READ_TABLE_DATA_TABLES = ['DATA', 'TBLOUT128', 'TBLOUT512', 'TBLOUT2048', 'TBLOUT8192', 'TBLOUT30000']
+
 # known SWNC Workload metric results task id -> text mappings
 SAP_TASK_TYPE_MAPPINGS = {
     b'\x01': 'DIALOG',
@@ -125,18 +139,29 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
     used to fill in historical data in those cases, but at same time enforce maximum query window
     to ensure we do not query SAP for huge result sets.
     Also enforce time range logic that ensures start/end time are always the same calendar 'day',
-    since that is how SAP stores SMON analysis results
+    since that is how SAP stores SMON analysis results.
+    If alignmentSecs is given, the window end is truncated to a multiple of alignmentSecs since midnight,
+    so that checks of the same SID running at (about) the same time ask for identical query windows
+    and can share a single result (see SwncRfcSharedCache)
     """
     def getQueryWindow(self, 
                        lastRunServerTime: datetime,
                        minimumRunIntervalSecs: int,
                        serverTimeZone: timezone,
-                       logTag: str) -> tuple:
+                       logTag: str,
+                       alignmentSecs: int = None) -> tuple:
 
         # always start with assumption that query window will work backwards from current system time
         # pass serverTimeZone to calculate UTCOffset based on time zone
         currentServerTime = self.getServerTime(serverTimeZone, logTag)
 
+        if alignmentSecs:
+            secondsSinceMidnight = currentServerTime.hour * 3600 + currentServerTime.minute * 60 + currentServerTime.second
+            alignedServerTime = currentServerTime.replace(microsecond=0) - timedelta(seconds=secondsSinceMidnight % alignmentSecs)
+            # never align the window end before the start of the window, in that case keep the exact server time
+            if lastRunServerTime is None or alignedServerTime > lastRunServerTime:
+                currentServerTime = alignedServerTime
+
         # usually a query window will end with the current SAP system time and will have a
         # lookback duration of the minimum check run interval (in seconds)
         # Since SAP requirement is that start and end time must occur on the same calendar day, 
@@ -285,18 +310,14 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                                endDateTime: datetime,
                                logTag: str) -> str:
         self.tracer.info("[%s] executing RFC SWNC_GET_WORKLOAD_SNAPSHOT check", logTag)
-        with self._getMessageServerConnection() as connection:
-            snapshotResult = self._rfcGetSwncSnapshot(connection,
-                                                              startDateTime=startDateTime, 
-                                                              endDateTime=endDateTime,
-                                                              logTag=logTag)
+        snapshotResult = self._rfcGetSwncSnapshot(startDateTime=startDateTime,
+                                                  endDateTime=endDateTime,
+                                                  logTag=logTag)
 
-            parsedResult = self._parseSwncWorkloadSnapshotResult(snapshotResult, logTag=logTag)
+        parsedResult = self._parseSwncWorkloadSnapshotResult(snapshotResult, logTag=logTag)
 
-            # add additional common metric properties
-            self._decorateSwncMetrics(parsedResult, queryWindowEnd=endDateTime)
-
-            return parsedResult
+        # add additional common metric properties
+        return parsedResult.toRecords(self._getSwncMetricProperties(queryWindowEnd=endDateTime))
 
     """
     fetch SWNC_GET_WORKLOAD_SNAPSHOT data, calculate aggregate Memory metrics and return as json string
@@ -306,17 +327,13 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                                endDateTime: datetime,
                                logTag: str) -> str:
         self.tracer.info("[%s] executing RFC SWNC_GET_WORKLOAD_SNAPSHOT check for memory metrics", logTag)
-        with self._getMessageServerConnection() as connection:
-            snapshotResult = self._rfcGetSwncSnapshot(connection,
-                                                            startDateTime=startDateTime, 
-                                                            endDateTime=endDateTime,
-                                                            logTag=logTag)
-            parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "MEMORY", logTag=logTag)
-
-            # add additional common metric properties
-            self._decorateSwncMetrics(parsedResult, queryWindowEnd=endDateTime)
+        snapshotResult = self._rfcGetSwncSnapshot(startDateTime=startDateTime,
+                                                  endDateTime=endDateTime,
+                                                  logTag=logTag)
+        parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "MEMORY", logTag=logTag)
 
-            return parsedResult
+        # add additional common metric properties
+        return parsedResult.toRecords(self._getSwncMetricProperties(queryWindowEnd=endDateTime))
 
     """
     fetch SWNC_GET_WORKLOAD_SNAPSHOT data, calculate aggregate Transaction metrics and return as json string
@@ -326,17 +343,13 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                                endDateTime: datetime,
                                logTag: str) -> str:
         self.tracer.info("[%s] executing RFC SWNC_GET_WORKLOAD_SNAPSHOT check for transaction metrics", logTag)
-        with self._getMessageServerConnection() as connection:
-            snapshotResult = self._rfcGetSwncSnapshot(connection,
-                                                            startDateTime=startDateTime, 
-                                                            endDateTime=endDateTime,
-                                                            logTag=logTag)
-            parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "USERTCODE", logTag=logTag)
+        snapshotResult = self._rfcGetSwncSnapshot(startDateTime=startDateTime,
+                                                  endDateTime=endDateTime,
+                                                  logTag=logTag)
+        parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "USERTCODE", logTag=logTag)
 
-            # add additional common metric properties
-            self._decorateSwncMetrics(parsedResult, queryWindowEnd=endDateTime)
-
-            return parsedResult
+        # add additional common metric properties
+        return parsedResult.toRecords(self._getSwncMetricProperties(queryWindowEnd=endDateTime))
 
     """
     fetch SWNC_GET_WORKLOAD_SNAPSHOT data, calculate aggregate User metrics and return as json string
@@ -346,17 +359,13 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                                endDateTime: datetime,
                                logTag: str) -> str:
         self.tracer.info("[%s] executing RFC SWNC_GET_WORKLOAD_SNAPSHOT check for user metrics", logTag)
-        with self._getMessageServerConnection() as connection:
-            snapshotResult = self._rfcGetSwncSnapshot(connection,
-                                                            startDateTime=startDateTime, 
-                                                            endDateTime=endDateTime,
-                                                            logTag=logTag)
-            parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "USERWORKLOAD", logTag=logTag)
-
-            # add additional common metric properties
-            self._decorateSwncMetrics(parsedResult, queryWindowEnd=endDateTime)
+        snapshotResult = self._rfcGetSwncSnapshot(startDateTime=startDateTime,
+                                                  endDateTime=endDateTime,
+                                                  logTag=logTag)
+        parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "USERWORKLOAD", logTag=logTag)
 
-            return parsedResult
+        # add additional common metric properties
+        return parsedResult.toRecords(self._getSwncMetricProperties(queryWindowEnd=endDateTime))
     
     """
     fetch SWNC_GET_WORKLOAD_SNAPSHOT data, calculate aggregate RFC Usage metrics and return as json string
@@ -366,17 +375,13 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                                endDateTime: datetime,
                                logTag: str) -> str:
         self.tracer.info("[%s] executing RFC SWNC_GET_WORKLOAD_SNAPSHOT check for RFC usage metrics", logTag)
-        with self._getMessageServerConnection() as connection:
-            snapshotResult = self._rfcGetSwncSnapshot(connection,
-                                                            startDateTime=startDateTime, 
-                                                            endDateTime=endDateTime,
-                                                            logTag=logTag)
-            parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "RFCCLNT", logTag=logTag)
-
-            # add additional common metric properties
-            self._decorateSwncMetrics(parsedResult, queryWindowEnd=endDateTime)
+        snapshotResult = self._rfcGetSwncSnapshot(startDateTime=startDateTime,
+                                                  endDateTime=endDateTime,
+                                                  logTag=logTag)
+        parsedResult = self._parseSwncSnapshotResult(snapshotResult, tableName = "RFCCLNT", logTag=logTag)
 
-            return parsedResult
+        # add additional common metric properties
+        return parsedResult.toRecords(self._getSwncMetricProperties(queryWindowEnd=endDateTime))
 
     """
     fetch all /SDF/GET_DUMP_LOG metric data and return as a single json string
@@ -425,9 +430,9 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
         parsedResult = []
         rfcName = 'RFC_READ_TABLE'
         with self._getMessageServerConnection() as connection:
-            rawResult = self._rfcGetFailedUpdates(connection, logTag=logTag)
+            rawResult = self._rfcReadTable(connection, rfcName, 'VBHDR', logTag=logTag)
             if rawResult != None and len(rawResult) > 0:
-                parsedResult = self._parseFailedUpdatesResult(rfcName, rawResult, logTag=logTag)
+                parsedResult = rawResult
                 # add additional common metric properties
                 self._decorateFailedUpdatesMetrics(parsedResult)
             return parsedResult
@@ -518,9 +523,9 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
         parsedResult = []
 
         with self._getMessageServerConnection() as connection:
-            rawResult = self._rfcChangeTransportandTransactionalRfcMetrics(connection, startDateTime, endDateTime, rfcName, sapQueryTable, optionsColumn,  logTag=logTag)
+            rawResult = self._rfcChangeTransportandTransactionalRfcMetrics(connection, startDateTime, endDateTime, rfcName, sapQueryTable, optionsColumn, logTag=logTag)
             if rawResult != None and len(rawResult) > 0:
-                parsedResult = self._parseChangeAndTransportResult(rfcName, rawResult, logTag)
+                parsedResult = rawResult
                 # add additional common metric properties
                 self._decorateChangeTransportandTransactionalRfcMetrics(parsedResult, optionsColumn, rfcTime)
             return parsedResult
@@ -539,9 +544,11 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
         self.tracer.info("[%s] executing RFC %s check", logTag, rfcName)
         parsedResult = []
         with self._getMessageServerConnection() as connection:
-            rawResult = self._rfcChangeTransportandTransactionalRfcMetrics(connection, startDateTime, endDateTime, rfcName, sapQueryTable, optionsColumn, logTag=logTag)
+            # only failed tRFC calls are of interest, so let SAP filter them instead of transferring the whole table
+            rawResult = self._rfcChangeTransportandTransactionalRfcMetrics(connection, startDateTime, endDateTime, rfcName, sapQueryTable, optionsColumn,
+                                                                           filterOptions=["AND ARFCSTATE = 'SYSFAIL'"], logTag=logTag)
             if rawResult != None and len(rawResult) > 0:
-                parsedResult = self._parseTransactionalRfcResult(rfcName, rawResult, logTag)
+                parsedResult = self._parseTransactionalRfcResult(rawResult)
                 # add additional common metric properties
                 self._decorateChangeTransportandTransactionalRfcMetrics(parsedResult, optionsColumn, rfcTime)
             return parsedResult
@@ -559,21 +566,68 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
         else:
             return self.sapHostName
     
+    """
+    check out a pooled rfc message server connection to sap for exclusive use within a with block,
+    so that consecutive checks of the same SAP system reuse the same logon.
+    connections that failed with a communication or ABAP runtime error are closed instead of being reused
+    """
+    @contextmanager
+    def _getMessageServerConnection(self) -> Iterator[Connection]:
+        pool = RfcConnectionPool(self.tracer)
+        pooled = pool.acquire(self._getConnectionPoolKey(), self._openMessageServerConnection)
+        discard = False
+        try:
+            yield pooled.connection
+        except (CommunicationError, ABAPRuntimeError):
+            discard = True
+            raise
+        except Exception:
+            # connection is most likely still fine, but verify that before it is used again
+            pooled.needsPing = True
+            raise
+        finally:
+            pool.release(pooled, discard=discard)
+
+    """
+    key of the connection pool shared by all clients logging on to the same SAP system with the same credentials
+    """
+    def _getConnectionPoolKey(self) -> tuple:
+        passwordHash = hashlib.sha256(str(self.sapPassword).encode("utf-8")).hexdigest()
+        return (self.sapSid,
+                self.fqdn,
+                self.msserv,
+                self.sapLogonGroup,
+                self.sapClient,
+                self.sapUsername,
+                passwordHash)
+
     """
     establish rfc message server connection to sap.
     """
-    def _getMessageServerConnection(self) -> Connection:
+    def _openMessageServerConnection(self) -> Connection:
+        # skip the message server if it has recently been unreachable, until its backoff has expired
+        endpointHealth = EndpointHealthRegistry(self.tracer)
+        endpoint = EndpointHealthRegistry.getEndpointName("rfc", self.fqdn, self.msserv)
+        if not endpointHealth.isAvailable(endpoint):
+            raise Exception("skipping RFC connection to unavailable message server %s" % endpoint)
+
         # Direct application server logon:  ashost, sysnr
         # load balancing logon:  mshost, msserv, sysid, group
-        connection = Connection(#ashost=self.fqdn, 
-                                sysnr=self.sapSysNr, 
-                                mshost=self.fqdn,
-                                Group=self.sapLogonGroup,
-                                msserv=self.msserv,
-                                ssid=self.sapSid,
-                                client=self.sapClient, 
-                                user=self.sapUsername, 
-                                passwd=self.sapPassword)
+        try:
+            connection = Connection(#ashost=self.fqdn, 
+                                    sysnr=self.sapSysNr, 
+                                    mshost=self.fqdn,
+                                    Group=self.sapLogonGroup,
+                                    msserv=self.msserv,
+                                    ssid=self.sapSid,
+                                    client=self.sapClient, 
+                                    user=self.sapUsername, 
+                                    passwd=self.sapPassword)
+        except CommunicationError:
+            # only network failures count against the endpoint, logon errors are configuration issues
+            endpointHealth.recordFailure(endpoint)
+            raise
+        endpointHealth.recordSuccess(endpoint)
         return connection
             
     """
@@ -788,11 +842,10 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
     """
     call RFC SWNC_GET_WORKLOAD_SNAPSHOT and return result records
     """
-    def _rfcGetSwncSnapshot(self, 
-                                    connection: Connection, 
-                                    startDateTime: datetime,
-                                    endDateTime: datetime,
-                                    logTag: str):
+    def _rfcGetSwncSnapshot(self,
+                            startDateTime: datetime,
+                            endDateTime: datetime,
+                            logTag: str):
         rfcName = 'SWNC_GET_WORKLOAD_SNAPSHOT'
 
         self.tracer.info(("[%s] invoking rfc %s for hostname=%s with read_start_date=%s, read_start_time=%s, "
@@ -811,7 +864,7 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                                                                         logTag=logTag, 
                                                                         sapSid=self.sapSid, 
                                                                         rfcName=rfcName,
-                                                                        connection=connection, 
+                                                                        getConnection=self._getMessageServerConnection,
                                                                         startDateTime=startDateTime,
                                                                         endDateTime=endDateTime,
                                                                         useSWNCCache=True)
@@ -842,111 +895,16 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
     """
     parse results from SWNC_GET_WORKLOAD_SNAPSHOT and enrich with additional calculated ST03 properties
     """
-    def _parseSwncWorkloadSnapshotResult(self, result, logTag:str):
-        rfcName = 'SWNC_GET_WORKLOAD_SNAPSHOT'
-        if result is None:
-            raise ValueError("empty result received for rfc %s from hostname: %s"
-                             % (rfcName, self.sapHostName))
-        
-        def GetKeyValue(dictionary, key):
-            if key not in dictionary:
-                raise ValueError("Result received for rfc %s from hostname: %s does not contain key: %s" 
-                                 % (rfcName, self.sapHostName, key))
-            return dictionary[key]
-
-        records = GetKeyValue(result, 'TASKTIMES')
-        server_result_records = GetKeyValue(result, 'SERVER_RECS_RETURN_ERRORS')
-        processed_results = list()
-
-        if self._isRFCRecordEmpty(rfcName, records, server_result_records, logTag=logTag):
-            return processed_results
-
-        for record in records:
-            # try to map task type hex code to more descriptive task name to make more readable, but
-            # if we can't find a mapping then just echo the taskTypeId
-            taskTypeId = GetKeyValue(record, 'TASKTYPE')
-            taskTypeText = (SAP_TASK_TYPE_MAPPINGS[taskTypeId] 
-                                if taskTypeId in SAP_TASK_TYPE_MAPPINGS 
-                                else taskTypeId)
-
-            processed_result = {
-                "Task Type": taskTypeId,
-                "Task Type Name": taskTypeText,
-                "Total Steps": GetKeyValue(record, 'COUNT'),
-                "Total Response Time": GetKeyValue(record, 'RESPTI'),
-                "Total Processing Time": GetKeyValue(record, 'PROCTI'),
-                "Total CPU Time": GetKeyValue(record, 'CPUTI'),
-                "Total Queue Time": GetKeyValue(record, 'QUEUETI'),
-                "Total Roll Wait Time": GetKeyValue(record, 'ROLLWAITTI'),
-                "Total GUI Steps": GetKeyValue(record, 'GUICNT'),
-                "Total GUI Time": GetKeyValue(record, 'GUITIME'),
-                "Total GUI Net Time": GetKeyValue(record, 'GUINETTIME'),
-                "Total DB Time": GetKeyValue(record, 'READSEQTI') + GetKeyValue(record, 'CHNGTI') + GetKeyValue(record, 'READDIRTI'),
-                "Total DB Dir Read Time": GetKeyValue(record, 'READDIRTI'),
-                "Total DB Seq Read Time": GetKeyValue(record, 'READSEQTI'),
-                "Total DB Chg Time": GetKeyValue(record, 'CHNGTI'),
-                "Total DB Proc Time": GetKeyValue(record, 'DBP_TIME'),
-                "Total DB Proc Steps": GetKeyValue(record, 'DBP_COUNT'),
-                "Total DB Dir Read Steps": GetKeyValue(record, 'READDIRCNT'),
-                "Total DB Seq Read Steps": GetKeyValue(record, 'READSEQCNT'),
-                "Total DB Change Steps": GetKeyValue(record, 'CHNGCNT'),
-                "PHYREADCNT": GetKeyValue(record, 'PHYREADCNT'),
-                "PHYCHNGREC": GetKeyValue(record, 'PHYCHNGREC'),
-                "PHYCALLS": GetKeyValue(record, 'PHYCALLS'),
-            }
-
-            # ST03 - Average response time across all steps
-            if (GetKeyValue(record, 'COUNT') != 0):
-                processed_result['ST03_Avg_Resp_Time'] = GetKeyValue(record, 'RESPTI') / GetKeyValue(record, 'COUNT')
-            else:
-                processed_result['ST03_Avg_Resp_Time'] = 0.0
-
-            # ST03 - CPU Time, Processing Time, Queue, Roll Wait and DB times as % of Response Time
-            if (GetKeyValue(record, 'RESPTI') != 0):
-                processed_result['ST03_CPU_Time'] = GetKeyValue(record, 'CPUTI') / GetKeyValue(record, 'RESPTI')
-                processed_result['ST03_Processing_Time'] = GetKeyValue(record, 'PROCTI') / GetKeyValue(record, 'RESPTI')
-                processed_result['ST03_DB_Time'] = processed_result['Total DB Time'] / GetKeyValue(record, 'RESPTI')
-                processed_result['ST03_Queue_Time'] = GetKeyValue(record, 'QUEUETI') / GetKeyValue(record, 'RESPTI')
-                processed_result['ST03_RollWait_Time'] = GetKeyValue(record, 'ROLLWAITTI') / GetKeyValue(record, 'RESPTI')
-            else:
-                processed_result['ST03_CPU_Time'] = 0.0
-                processed_result['ST03_Processing_Time'] = 0.0
-                processed_result['ST03_DB_Time'] = 0.0
-                processed_result['ST03_Queue_Time'] = 0.0
-                processed_result['ST03_RollWait_Time'] = 0.0
-            
-            # ST03 - Average DB direct read latency
-            if (GetKeyValue(record, 'READDIRCNT') != 0):
-                processed_result['ST03_Avg_DB_Dir_Time'] = GetKeyValue(record, 'READDIRTI') / GetKeyValue(record, 'READDIRCNT')
-            else:
-                processed_result['ST03_Avg_DB_Dir_Time'] = 0.0
-
-            # ST03 - Average DB sequential read latency
-            if (GetKeyValue(record, 'READSEQCNT') != 0):
-                processed_result['ST03_Avg_DB_Seq_Time'] = GetKeyValue(record, 'READSEQTI') / GetKeyValue(record, 'READSEQCNT')
-            else:
-                processed_result['ST03_Avg_DB_Seq_Time'] = 0.0
-
-            # ST03 - Average DB change latency
-            if (GetKeyValue(record, 'CHNGCNT') != 0):
-                processed_result['ST03_Avg_DB_Change_Time'] = GetKeyValue(record, 'CHNGTI') / GetKeyValue(record, 'CHNGCNT')
-            else:
-                processed_result['ST03_Avg_DB_Change_Time'] = 0.0
-        
-            # ST03 - Average DB Procedure latency
-            if (GetKeyValue(record, 'DBP_COUNT') != 0):
-                processed_result['ST03_Avg_DB_Procedure_Time'] = GetKeyValue(record, 'DBP_TIME') / GetKeyValue(record, 'DBP_COUNT')
-            else:
-                processed_result['ST03_Avg_DB_Procedure_Time'] = 0.0
-            
-            processed_results.append(processed_result)
-
-        return processed_results
+    def _parseSwncWorkloadSnapshotResult(self, result, logTag:str) -> SwncSnapshotTable:
+        table = self._parseSwncSnapshotResult(result, tableName = "TASKTIMES", logTag=logTag)
+        if len(table) == 0:
+            return table
+        return table.toWorkloadMetrics(SAP_TASK_TYPE_MAPPINGS)
 
     """
     parse results from SWNC_GET_WORKLOAD_SNAPSHOT Memory, Transaction, User Workload, RFC Usge Table properties
     """
-    def _parseSwncSnapshotResult(self, result, tableName, logTag:str,):
+    def _parseSwncSnapshotResult(self, result, tableName, logTag:str) -> SwncSnapshotTable:
         rfcName = 'SWNC_GET_WORKLOAD_SNAPSHOT'
         # this if statement checks if the result returned from the SWNC RFC Call are not None
         # The value error is raised if it is None, and it means that SAP System exception has occured.
@@ -961,30 +919,26 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
 
         records = GetKeyValue(result, tableName)
         server_result_records = GetKeyValue(result, 'SERVER_RECS_RETURN_ERRORS')
-        processed_results = list()
 
         if self._isRFCRecordEmpty(rfcName, records, server_result_records, logTag=logTag):
-            return processed_results
-        
-        for record in records:
-            processed_results.append(record)
-        return processed_results
+            return SwncSnapshotTable(rfcName, self.sapHostName, [])
+
+        # the snapshot result is shared with the other SWNC checks of this SID, so its records are never modified here
+        return SwncSnapshotTable(rfcName, self.sapHostName, records)
 
     """
-    take parsed SWNC result set and decorate each record with additional fixed set of 
-    properties needed for metrics records
+    fixed set of properties added to each SWNC metrics record
     """
-    def _decorateSwncMetrics(self, records: list, queryWindowEnd: datetime) -> None:
-        currentTimestamp = datetime.now(timezone.utc)
-
-        for record in records:
-            # swnc workload metrics are aggregated across the SID, so no need to include hostname/instance/subdomain dimensions
-            record['timestamp'] = currentTimestamp
-            queryWindowEnd = queryWindowEnd.replace(tzinfo=self.tzinfo)
+    def _getSwncMetricProperties(self, queryWindowEnd: datetime) -> Dict:
+        # swnc workload metrics are aggregated across the SID, so no need to include hostname/instance/subdomain dimensions
+        queryWindowEnd = queryWindowEnd.replace(tzinfo=self.tzinfo)
+        return {
+            'timestamp': datetime.now(timezone.utc),
             # utc offset is applied to queryWindowEnd 
-            record['serverTimestamp'] = queryWindowEnd.astimezone(pytz.UTC)
-            record['SID'] = self.sapSid
-            record['client'] = self.sapClient
+            'serverTimestamp': queryWindowEnd.astimezone(pytz.UTC),
+            'SID': self.sapSid,
+            'client': self.sapClient
+        }
 
     """
     make common RFC call for GET_DUMP_LOG & GET_SYS_LOG and return result records
@@ -1067,20 +1021,11 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
     name returned by SAP in a different table
     """
     def _renameColumnNames(self, records: list, colNames) -> list:
-       dataframe = DataFrame (records,columns=['E2E_DATE','E2E_TIME','E2E_USER','E2E_SEVERITY','E2E_HOST',
-                                        'FIELD1','FIELD2','FIELD3','FIELD4','FIELD5','FIELD6','FIELD7',
-                                        'FIELD8','FIELD9'])
-       dataframe.rename(columns = {"FIELD1": colNames["FIELD1"],
-                            "FIELD2": colNames["FIELD2"],
-                            "FIELD3": colNames["FIELD3"],
-                            "FIELD4": colNames["FIELD4"],
-                            "FIELD5": colNames["FIELD5"],
-                            "FIELD6": colNames["FIELD6"],
-                            "FIELD7": colNames["FIELD7"],
-                            "FIELD8": colNames["FIELD8"],
-                            "FIELD9": colNames["FIELD9"]},
-                             inplace=True, errors='raise')
-       return dataframe.to_dict('records')
+       columns = ['E2E_DATE','E2E_TIME','E2E_USER','E2E_SEVERITY','E2E_HOST',
+                  'FIELD1','FIELD2','FIELD3','FIELD4','FIELD5','FIELD6','FIELD7',
+                  'FIELD8','FIELD9']
+       names = [colNames[column] if column.startswith('FIELD') else column for column in columns]
+       return [{name: record.get(column) for (name, column) in zip(names, columns)} for record in records]
 
     """
     common method take parsed result set and decorate each record with additional fixed set of 
@@ -1216,21 +1161,48 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
 
     
     """
-    call RFC RFC_READ_TABLE and return result records
-    """
-    def _rfcGetFailedUpdates(self, connection: Connection, logTag: str):
-        rfcName = 'RFC_READ_TABLE'
-
-        self.tracer.info(("[%s] invoking rfc %s for hostname=%s with CALL_MODE = 2"),
-                         logTag, 
-                         rfcName, 
-                         self.sapHostName)
+    read rows of an SAP table through RFC_READ_TABLE or /SAPDS/RFC_READ_TABLE2 and return them as list of dicts.
+    the where clause (options) and list of columns (fields, all columns if not given) are evaluated by SAP, rows are
+    fetched in pages of RFC_READ_TABLE_PAGE_SIZE and every row is split into its columns based on the FIELDS metadata
+    """
+    def _rfcReadTable(self,
+                      connection: Connection,
+                      rfcName: str,
+                      sapQueryTable: str,
+                      fields: List[str] = None,
+                      options: List[str] = None,
+                      logTag: str = None) -> List[Dict]:
+        self.tracer.info(("[%s] invoking rfc %s with rfctable %s for hostname=%s for client %s, fields=%s, options=%s"),
+                         logTag,
+                         rfcName,
+                         sapQueryTable,
+                         self.sapHostName,
+                         self.sapClient,
+                         fields,
+                         options)
 
+        records = []
         try:
-            faileupdates_result = connection.call(rfcName,
-                                                  QUERY_TABLE = 'VBHDR',
-                                                  DELIMITER = ';')
-            return faileupdates_result
+            while len(records) < RFC_READ_TABLE_MAX_ROWS:
+                result = connection.call(rfcName,
+                                         QUERY_TABLE = sapQueryTable,
+                                         DELIMITER = RFC_READ_TABLE_DELIMITER,
+                                         FIELDS = [{'FIELDNAME': field} for field in (fields or [])],
+                                         OPTIONS = self._getReadTableOptions(options),
+                                         ROWCOUNT = RFC_READ_TABLE_PAGE_SIZE,
+                                         ROWSKIPS = len(records))
+                rows = self._parseReadTableResult(rfcName, result)
+                records.extend(rows)
+                if len(rows) < RFC_READ_TABLE_PAGE_SIZE:
+                    break
+            else:
+                self.tracer.warning("[%s] rfc %s for table %s from hostname: %s returned more than %d rows, ignoring the remaining rows",
+                                    logTag, rfcName, sapQueryTable, self.sapHostName, RFC_READ_TABLE_MAX_ROWS)
+
+            self.tracer.info("[%s] rfc %s returned %d records of table %s from hostname: %s",
+                             logTag, rfcName, len(records), sapQueryTable, self.sapHostName)
+            return records
+
         except CommunicationError as e:
             self.tracer.error("[%s] communication error for rfc %s with hostname: %s (%s)",
                               logTag, rfcName, self.sapHostName, e, exc_info=True)
@@ -1240,81 +1212,81 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
             if e.key == "TABLE_WITHOUT_DATA":
                 self.tracer.info("[%s] Exception raised for rfc %s with hostname: %s (%s)",
                             logTag, rfcName, self.sapHostName, e.key, exc_info=True)
-                return []
+                return records
             elif e.key == "TABLE_NOT_AVAILABLE":
                 self.tracer.error("[%s] Exception raised for rfc %s with hostname: %s (%s)",
                             logTag, rfcName, self.sapHostName, e, exc_info=True)
+            elif e.key == "NOT_AUTHORIZED":
+                self.tracer.error("[%s] Exception raised for rfc %s with hostname: %s (%s). Update the roles in SAP System using role file from %s",
+                            logTag, rfcName, self.sapHostName, e, self.rolesFileURL, exc_info=True)
+            else:
+                self.tracer.error("[%s] Exception raised for rfc %s with hostname: %s (%s)",
+                            logTag, rfcName, self.sapHostName, e, exc_info=True)
 
         except ABAPRuntimeError as e:
             self.tracer.error("[%s] Runtime error for rfc %s with hostname: %s (%s). Update the roles in SAP System using role file %s",
                               logTag, rfcName, self.sapHostName, e, self.rolesFileURL, exc_info=True)
 
-
         except Exception as e:
-            self.tracer.error("[%s] Error occured for rfc %s with hostname: %s (%s)", 
+            self.tracer.error("[%s] Error occured for rfc %s with hostname: %s (%s)",
                               logTag, rfcName, self.sapHostName, e, exc_info=True)
 
         return None
 
     """
-    parse results from RFC_READ_TABLE and enrich with additional calculated Failed Updates properties
+    split where clause conditions into lines of the OPTIONS table, which are concatenated again by SAP
+    """
+    def _getReadTableOptions(self, options: List[str]) -> List[Dict[str, str]]:
+        lines = []
+        for condition in (options or []):
+            line = ''
+            for word in condition.split(' '):
+                if line and len(line) + len(word) + 1 > RFC_READ_TABLE_OPTIONS_LINE_LENGTH:
+                    lines.append({'TEXT': line})
+                    line = ''
+                line = (line + ' ' + word) if line else word
+            if line:
+                lines.append({'TEXT': line})
+        return lines
+
+    """
+    parse one page of RFC_READ_TABLE or /SAPDS/RFC_READ_TABLE2 results into a list of dicts, using the
+    offset and length of every column in FIELDS to extract the values from each WA row; values are kept as stripped
+    strings regardless of their ABAP data type, so the Log Analytics columns (and consumers of the values) are unchanged
+    Sample Raw Row : {'WA': '3DA7EF6910480030E00611BB5179B775;001;'}
     """
-    def _parseFailedUpdatesResult(self, rfcName, result, logTag):
+    def _parseReadTableResult(self, rfcName: str, result) -> List[Dict]:
         if result is None:
             raise ValueError("empty result received for rfc %s from hostname: %s"
                              % (rfcName, self.sapHostName))
-        
-        def GetKeyValue(dictionary, key):
-            if key not in dictionary:
-                raise ValueError("Result received for rfc %s from hostname: %s does not contain key: %s" 
-                                 % (rfcName, self.sapHostName, key))
-            return dictionary[key]
-
-        colNames = None
-        processedResult = None
-        if 'FIELDS' in result:
-            # create new dictionary with only values from filterList if filter dictionary exists.
-            records = GetKeyValue(result, 'FIELDS')
-            colNames = [ sub['FIELDNAME'] for sub in records]
-            self.tracer.info("[%s] rfc %s returned %d records from hostname: %s",
-                             logTag, rfcName, len(colNames), self.sapHostName)
-        else:
+        if 'FIELDS' not in result:
             raise ValueError("%s result does not contain FIELDS key from hostname: %s" % (rfcName, self.sapHostName))
-    
-        if 'DATA' in result:
-            # create new dictionary with only values from filterList if filter dictionary exists.
-            dataResult = result['DATA']
-            self.tracer.info("[%s] rfc %s returned %d records from hostname: %s",
-                             logTag, rfcName, len(dataResult), self.sapHostName)
-            processedResult = self._processDataResults(dataResult, colNames)
-        else:
-            raise ValueError("%s result does not contain DATA key from hostname: %s" % (rfcName, self.sapHostName))        
-        return processedResult
 
-    """
-    Function to parse the raw data result we get back into SAP and extract the column values mapping to the FEILDS table
-    Sample Raw Result : "{'WA': '3DA7EF6910480030E00611BB5179B775;001;'}"
-    """
-    def _processDataResults(self, result, colNames):
-        processedDataList = list()
-        processedResult = None
-        if result != None and len(result) > 0:
-            # parse through each row returned in the result
-            for record in result:
-                # extract just the data part belonging to the FEILDS column by split string function
-                processedResult = str(record).split(":")
-                if processedResult != None and len(processedResult) > 0:
-                    # Remove additional characters e.g {, }, '
-                    processedResult = processedResult[1].replace("'","").replace("}","")
-                    # Remove the empty characters in the string using strip function and then split the string to
-                    # extract each value as a different column value
-                    processedResult = [x.strip() for x in processedResult.split(';')]
-                    # colNames - contains the name of the key and processedResult contains the values
-                    # failedUpdateDic - dict with key and values
-                    failedUpdateDic = dict(zip(colNames, processedResult))
-                    processedDataList.append(failedUpdateDic)
-        return processedDataList
-    
+        dataTables = [table for table in RFC_READ_TABLE_DATA_TABLES if table in result]
+        if len(dataTables) == 0:
+            raise ValueError("%s result does not contain DATA key from hostname: %s" % (rfcName, self.sapHostName))
+        # only the output table matching the width of the selected columns is filled
+        rows = next((result[table] for table in dataTables if len(result[table]) > 0), [])
+
+        columns = []
+        for field in result['FIELDS']:
+            offset = int(field['OFFSET']) if field.get('OFFSET', '') != '' else None
+            length = int(field['LENGTH']) if field.get('LENGTH', '') != '' else None
+            columns.append((field['FIELDNAME'], offset, length))
+
+        # fall back to splitting by the delimiter if SAP did not return the position of every column
+        useOffsets = all(offset is not None and length is not None for (_, offset, length) in columns)
+
+        records = []
+        for row in rows:
+            wa = row['WA']
+            if useOffsets:
+                values = [wa[offset:offset + length] for (_, offset, length) in columns]
+            else:
+                values = wa.split(RFC_READ_TABLE_DELIMITER)
+            records.append({name: value.strip() for ((name, _, _), value) in zip(columns, values)})
+        return records
+
     """
     RFC call for BAPI_XBP_JOB_SELECT and return result records
     """
@@ -1443,8 +1415,9 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                              % (rfcName, self.sapHostName))
         processed_results = list()
         records = result[tableName]
+        # copy records since the snapshot result is shared with the other SWNC checks of this SID
         for record in records:
-            processed_results.append(record)
+            processed_results.append(dict(record))
         return processed_results
 
     """
@@ -1531,39 +1504,6 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
             record['subdomain'] = self.sapSubdomain
             record['timestamp'] = currentTimestamp
 
-    """
-    parse results from /SAPDS/RFC_READ_TABLE2 and enrich with additional properties
-    """
-    def _parseChangeAndTransportResult(self, rfcName, result, logTag):
-        if result is None:
-            raise ValueError("%s empty result received for /SAPDS/RFC_READ_TABLE2 RFC from hostname: %s"
-                             % (logTag, self.sapHostName))
-        processed_results = list()
-        def GetKeyValue(dictionary, key):
-            if key not in dictionary:
-                raise ValueError("Result received for rfc %s from hostname: %s does not contain key: %s" 
-                                 % (rfcName, self.sapHostName, key))
-            return dictionary[key]
-
-        col_names = None
-        if 'FIELDS' in result:
-            # get column names for the table from FIELDS key in result.
-            col_name_records = GetKeyValue(result, 'FIELDS')
-            col_names = [ record['FIELDNAME'] for record in col_name_records]
-        else:
-            raise ValueError("%s result does not contain FIELDS key from hostname: %s" % (rfcName, self.sapHostName))
-
-        if 'TBLOUT128' in result:
-            # this table consists of all the records for change and transport system
-            data_results = GetKeyValue(result, 'TBLOUT128')
-            for record in data_results:
-                data_result = [rec.strip() for rec in record['WA'].split(";")]
-                processed_results.append(dict(zip(col_names, data_result)))
-        else:
-            raise ValueError("%s result does not contain TBLOUT128 key from hostname: %s" % (rfcName, self.sapHostName))     
-
-        return processed_results
-
     """
     call RFC /SAPDS/RFC_READ_TABLE2 and return all change & transport system and and return Transactional Rfc mertics.
     """
@@ -1574,93 +1514,32 @@ class NetWeaverRfcClient(NetWeaverMetricClient):
                                      rfcName: str,
                                      sapQueryTable: str,
                                      optionsColumn: str,
-                                     logTag: str):
-        self.tracer.info(("[%s] invoking rfc %s with rfctable %s for hostname=%s for client %s"),
-                         logTag, 
-                         rfcName, 
-                         sapQueryTable,
-                         self.sapHostName,
-                         self.sapClient)
-
-        try:
-            # passing Query table name as ARFCSSTATE for Transactional RFC and Change and Transport RFC E070
-            # and OPTIONS table as a input parameter to the RFC call which accepts input in the following format
-            # ARFCDATUM BETWEEN '20211013' AND '20211023' for Transactional RFC 
-            # AS4DATE BETWEEN '20211010' AND '20211015' for Change and ransport RFC
-            options_table = (optionsColumn + ' BETWEEN \'%s\' AND \'%s\''% ("".join(str(startDateTime.date()).split("-")), "".join(str(endDateTime.date()).split("-"))))
-            transactionalrfc_records = connection.call(rfcName,
-                                                  QUERY_TABLE = sapQueryTable,
-                                                  DELIMITER = ';',
-                                                  OPTIONS = [options_table])
-            return transactionalrfc_records
-
-        except ABAPApplicationError as e:
-            # handle NO DATA FOUND exception to return an empty list
-            if e.key == "TABLE_WITHOUT_DATA":
-                self.tracer.info("[%s] Exception raised for rfc %s with hostname: %s (%s)",
-                            logTag, rfcName, self.sapHostName, e.key, exc_info=True)
-                return []
-            elif e.key == "TABLE_NOT_AVAILABLE":
-                self.tracer.error("[%s] Exception raised for rfc %s with hostname: %s (%s)",
-                            logTag, rfcName, self.sapHostName, e, exc_info=True)
-            elif e.key == "NOT_AUTHORIZED":
-                self.tracer.error("[%s] Exception raised for rfc %s with hostname: %s (%s). Update the roles in SAP System using role file from %s",
-                            logTag, rfcName, self.sapHostName, e, self.rolesFileURL, exc_info=True)
-
-        except ABAPRuntimeError as e:
-            self.tracer.error("[%s] Runtime error for rfc %s with hostname: %s (%s).",
-                              logTag, rfcName, self.sapHostName, e, exc_info=True)
-        except Exception as e:
-            self.tracer.error("[%s] Error occured for rfc %s with hostname: %s (%s)", 
-                              logTag, rfcName, self.sapHostName, e, exc_info=True)
-
-        return None
-    
-    """
-    parse results from /SAPDS/RFC_READ_TABLE2 and enrich with additional properties
-    """
-    def _parseTransactionalRfcResult(self, rfcName, result, logTag):
-        if result is None:
-            raise ValueError("%s empty result received for /SAPDS/RFC_READ_TABLE2 RFC from hostname: %s"
-                             % (logTag, self.sapHostName))
-        processed_results = list()
-        def GetKeyValue(dictionary, key):
-            if key not in dictionary:
-                raise ValueError("Result received for rfc %s from hostname: %s does not contain key: %s" 
-                                 % (rfcName, self.sapHostName, key))
-            return dictionary[key]
-
-        col_names = None
-        if 'FIELDS' in result:
-            # get column names for the table from FIELDS key in result.
-            col_name_records = GetKeyValue(result, 'FIELDS')
-            col_names = [ record['FIELDNAME'] for record in col_name_records]
-        else:
-            raise ValueError("%s result does not contain FIELDS key from hostname: %s" % (rfcName, self.sapHostName))
-
-        if 'TBLOUT2048' in result:
-            # output table that consists of records for transactional RFC
-            data_results = GetKeyValue(result, 'TBLOUT2048')
-            index = 0
-            for record in data_results:
-                data_result = [rec.strip() for rec in record['WA'].split(";")]
-                # filter data result to extract SYSFAIL only from tRFC errors
-                if 'SYSFAIL' in data_result:
-                    processed_results.append(dict(zip(col_names, data_result)))
-                    # parse result row for RFC servername as 'RSTRFCTQ' as the row is
-                    # returned with information on hostanme, client name and SID:
-                    # original data string:-
-                    # RSTRFCTQ                                001                                                                                                  
-                    # SAPTSTGTMCI_GMT_10                        20211018150437      
-                    # 00000005                                E
-                    # row has a value 
-                    processed_results[index]["ARFCRESERV"] = processed_results[index]["ARFCRESERV"].split(" ")[0]
-                    index += 1
-
-        else:
-            raise ValueError("%s result does not contain TBLOUT2048 key from hostname: %s" % (rfcName, self.sapHostName))     
-
-        return processed_results
+                                     filterOptions: List[str] = None,
+                                     logTag: str = None):
+        # passing Query table name as ARFCSSTATE for Transactional RFC and Change and Transport RFC E070
+        # and OPTIONS table as a input parameter to the RFC call which accepts input in the following format
+        # ARFCDATUM BETWEEN '20211013' AND '20211023' for Transactional RFC 
+        # AS4DATE BETWEEN '20211010' AND '20211015' for Change and ransport RFC
+        options = ["%s BETWEEN '%s' AND '%s'" % (optionsColumn,
+                                                 startDateTime.strftime('%Y%m%d'),
+                                                 endDateTime.strftime('%Y%m%d'))]
+        options.extend(filterOptions or [])
+        return self._rfcReadTable(connection, rfcName, sapQueryTable, options=options, logTag=logTag)
+
+    """
+    enrich /SAPDS/RFC_READ_TABLE2 records of failed transactional RFC calls with additional properties
+    """
+    def _parseTransactionalRfcResult(self, records: List[Dict]) -> List[Dict]:
+        for record in records:
+            # parse result row for RFC servername as 'RSTRFCTQ' as the row is
+            # returned with information on hostanme, client name and SID:
+            # original data string:-
+            # RSTRFCTQ                                001                                                                                                  
+            # SAPTSTGTMCI_GMT_10                        20211018150437      
+            # 00000005                                E
+            # row has a value 
+            record["ARFCRESERV"] = record["ARFCRESERV"].split(" ")[0]
+        return records
     
     """
     take parsed /SAPDS/RFC_READ_TABLE2 result set and decorate each record with additional fixed set of 
@@ -0,0 +1,182 @@
+# Python modules
+import logging
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable
+
+# Payload modules
+from helper.tools import *
+
+# maximum number of pooled RFC connections per SAP system (pool key), additional concurrent
+# callers get a temporary connection that is closed again after use
+RFC_POOL_MAX_CONNECTIONS_PER_SID = 4
+
+# pooled connections are closed and re-opened once they are older than this
+RFC_POOL_MAX_CONNECTION_AGE_SECS = 3600
+
+# idle connections are closed once they have not been used for this long
+RFC_POOL_MAX_IDLE_SECS = 900
+
+# idle connections are pinged before reuse once they have not been used for this long
+RFC_POOL_PING_IDLE_SECS = 60
+
+##########
+# single RFC connection owned by the pool; pyrfc connections are not thread-safe,
+# so a connection is only ever used by the thread holding its lock
+##########
+class PooledRfcConnection:
+
+    def __init__(self,
+                 key: Hashable,
+                 connection: Any,
+                 isPooled: bool = True):
+        self.key = key
+        self.connection = connection
+        self.isPooled = isPooled
+        self.lock = Lock()
+        self.createdTime = monotonic()
+        self.lastUsedTime = self.createdTime
+        self.needsPing = False
+
+    """
+    true if the connection has exceeded its maximum age or has not been used for too long
+    """
+    def isExpired(self, now: float) -> bool:
+        return ((now - self.createdTime) > RFC_POOL_MAX_CONNECTION_AGE_SECS or
+                (now - self.lastUsedTime) > RFC_POOL_MAX_IDLE_SECS)
+
+##########
+# pool of long-lived RFC connections shared by all SAP NetWeaver providers and checks, keyed by SAP system
+# (so SID, message server and logon parameters), to avoid a full load-balanced logon for every single RFC check
+##########
+class RfcConnectionPool(metaclass=Singleton):
+
+    def __init__(self, tracer: logging.Logger):
+        self.tracer = tracer
+        self._lock = Lock()
+        self._connections = {}
+        self.statistics = {
+            "acquired": 0,
+            "reused": 0,
+            "opened": 0,
+            "overflow": 0,
+            "pingFailures": 0,
+            "discarded": 0,
+            "expired": 0
+        }
+
+    """
+    check out a connection for the given pool key for exclusive use by the calling thread,
+    opening a new connection with openConnection() if no healthy pooled connection is available.
+    every acquired connection must be handed back with release()
+    """
+    def acquire(self,
+                key: Hashable,
+                openConnection: Callable[[], Any]) -> PooledRfcConnection:
+        expired = []
+        pooled = None
+        with self._lock:
+            self.statistics["acquired"] += 1
+            now = monotonic()
+            connections = self._connections.setdefault(key, [])
+            for candidate in list(connections):
+                if not candidate.lock.acquire(blocking=False):
+                    continue
+                if candidate.isExpired(now):
+                    connections.remove(candidate)
+                    expired.append(candidate)
+                    self.statistics["expired"] += 1
+                    continue
+                pooled = candidate
+                break
+
+        for connection in expired:
+            self._close(connection)
+
+        if pooled:
+            if not pooled.needsPing and (monotonic() - pooled.lastUsedTime) <= RFC_POOL_PING_IDLE_SECS:
+                self._countReuse()
+                return pooled
+            try:
+                pooled.connection.ping()
+                pooled.needsPing = False
+                self._countReuse()
+                return pooled
+            except Exception as e:
+                self.tracer.info("pooled RFC connection for %s failed liveness ping, reconnecting (%s)", key, e)
+                with self._lock:
+                    self.statistics["pingFailures"] += 1
+                self._discard(pooled)
+
+        # open the connection outside of the pool lock since a logon can take several seconds
+        connection = openConnection()
+        with self._lock:
+            self.statistics["opened"] += 1
+            connections = self._connections.setdefault(key, [])
+            isPooled = len(connections) < RFC_POOL_MAX_CONNECTIONS_PER_SID
+            pooled = PooledRfcConnection(key, connection, isPooled=isPooled)
+            pooled.lock.acquire()
+            if isPooled:
+                connections.append(pooled)
+            else:
+                self.statistics["overflow"] += 1
+        return pooled
+
+    """
+    hand back a connection acquired from the pool; connections that are broken (discard),
+    expired or exceed the pool size are closed instead of being kept for reuse
+    """
+    def release(self,
+                pooled: PooledRfcConnection,
+                discard: bool = False) -> None:
+        pooled.lastUsedTime = monotonic()
+        if discard or not pooled.isPooled or pooled.isExpired(pooled.lastUsedTime):
+            self._discard(pooled)
+            return
+        pooled.lock.release()
+
+    """
+    close all pooled connections that are currently not in use
+    """
+    def closeAll(self) -> None:
+        idle = []
+        with self._lock:
+            for connections in self._connections.values():
+                for pooled in list(connections):
+                    if pooled.lock.acquire(blocking=False):
+                        connections.remove(pooled)
+                        idle.append(pooled)
+        for pooled in idle:
+            self._close(pooled)
+
+    """
+    return a snapshot of the pool statistics
+    """
+    def getStatistics(self) -> Dict[str, int]:
+        with self._lock:
+            statistics = dict(self.statistics)
+            statistics["pooled"] = sum(len(connections) for connections in self._connections.values())
+            statistics["inUse"] = sum(1 for connections in self._connections.values()
+                                      for pooled in connections if pooled.lock.locked())
+        return statistics
+
+    def _countReuse(self) -> None:
+        with self._lock:
+            self.statistics["reused"] += 1
+
+    """
+    remove a connection held by the calling thread from the pool and close it
+    """
+    def _discard(self, pooled: PooledRfcConnection) -> None:
+        with self._lock:
+            connections = self._connections.get(pooled.key, [])
+            if pooled in connections:
+                connections.remove(pooled)
+                self.statistics["discarded"] += 1
+        self._close(pooled)
+
+    def _close(self, pooled: PooledRfcConnection) -> None:
+        try:
+            pooled.connection.close()
+        except Exception as e:
+            self.tracer.debug("error closing RFC connection for %s (%s)", pooled.key, e)
@@ -18,6 +18,7 @@ from zeep.exceptions import Fault
 # Payload modules
 from helper.tools import *
 from netweaver.metricclientfactory import NetWeaverSoapClientBase
+from netweaver.wsdlcache import WsdlDiskCache
 
 # Suppress SSLError warning due to missing SAP server certificate
 import urllib3
@@ -194,7 +195,7 @@ class NetWeaverSoapClient(NetWeaverSoapClientBase):
         try:
             session = Session()
             session.verify = False
-            client = Client(self.wsdlUrl, transport=Transport(session=session, timeout=SOAP_API_TIMEOUT_SECS, operation_timeout=SOAP_API_TIMEOUT_SECS))
+            client = Client(self.wsdlUrl, transport=Transport(session=session, cache=self._getProbedWsdlCache(), timeout=SOAP_API_TIMEOUT_SECS, operation_timeout=SOAP_API_TIMEOUT_SECS))
             self.tracer.info("%s initialize SOAP client SUCCESS for wsdl: %s [%d ms]",
                              logTag, self.wsdlUrl, TimeUtils.getElapsedMilliseconds(startTime))
             return client
@@ -203,6 +204,29 @@ class NetWeaverSoapClient(NetWeaverSoapClientBase):
                               logTag, self.wsdlUrl, TimeUtils.getElapsedMilliseconds(startTime), e, exc_info=True)
             raise e
 
+    """
+    return the persistent WSDL cache, so the client can be initialized without fetching the WSDL from the remote host;
+    if the cache cannot be used, the WSDL is always fetched
+    """
+    def _getWsdlCache(self) -> WsdlDiskCache:
+        try:
+            return WsdlDiskCache(self.tracer)
+        except Exception as e:
+            self.tracer.warning("unable to use wsdl cache, fetching wsdl: %s (%s)", self.wsdlUrl, e)
+            return None
+
+    """
+    return the persistent WSDL cache, so the client is initialized from the cached WSDL (which is revalidated in the
+    background by the cache itself). a cached WSDL would allow the client to be created without contacting the host
+    at all, so the host is probed first, and a host that cannot be reached fails client initialization as if there
+    was no cache (e.g. to fall back from https to http)
+    """
+    def _getProbedWsdlCache(self) -> WsdlDiskCache:
+        cache = self._getWsdlCache()
+        if cache:
+            cache.probe(self.wsdlUrl)
+        return cache
+
     """
     reflect against internal SOAP API client and return flag indicating if specified API name exists
     """
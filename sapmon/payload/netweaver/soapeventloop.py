@@ -0,0 +1,38 @@
+# Python modules
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Awaitable
+
+# Payload modules
+from helper.tools import Singleton
+
+##########
+# single asyncio event loop, running on a background thread, that is shared by all asynchronous SOAP clients
+# and by the SOAP API fan-out; any thread can schedule coroutines on it
+##########
+class SoapEventLoop(metaclass=Singleton):
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run,
+                                        name="soap-eventloop",
+                                        daemon=True)
+        self._thread.start()
+
+    """
+    schedule a coroutine on the shared event loop and return a (thread-safe) future for its result
+    """
+    def submit(self, coroutine: Awaitable) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    """
+    run a coroutine on the shared event loop and block the calling thread until it has completed
+    (must not be called from the event loop thread itself)
+    """
+    def run(self, coroutine: Awaitable, timeoutSecs: float = None) -> Any:
+        return self.submit(coroutine).result(timeoutSecs)
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
@@ -1,53 +1,63 @@
 # Payload modules
 from const import *
+from helper.cache import TtlCache
 from helper.context import *
 from helper.tools import *
 
 import logging
 from datetime import datetime
+from typing import Callable
 from pyrfc import Connection, CommunicationError
 
-# wait time in between attempts to make an RFC call to SWNC_GET_WORKLOAD_SNAPSHOT and fetch records
+# how long a SWNC_GET_WORKLOAD_SNAPSHOT result can be reused by other checks asking for the same query window
 CACHE_EXPIRATION_PERIOD = timedelta(minutes=5)
 
+# maximum number of cached SWNC_GET_WORKLOAD_SNAPSHOT results
+CACHE_MAX_ENTRIES = 100
+
 class SwncRfcSharedCache:
-    # static / class variables to enforce only one SWNC_GET_WORKLOAD_SNAPSHOT rfc call attempt
-    # across all SWNC_GET_WORKLOAD_SNAPSHOT RFC function calls spread across particular SID of SAP Netweaver provider
-    _swncRecordsCache= {}
+    # static / class variables to enforce only one SWNC_GET_WORKLOAD_SNAPSHOT rfc call
+    # per SID and query window across all SWNC checks of SAP Netweaver providers;
+    # concurrent callers for the same key wait for the in-flight call and share its result
+    _swncRecordsCache = TtlCache("swncRecords",
+                                 ttlSecs=CACHE_EXPIRATION_PERIOD.total_seconds(),
+                                 maxEntries=CACHE_MAX_ENTRIES)
 
+    """
+    return SWNC_GET_WORKLOAD_SNAPSHOT result for the given SID and query window, invoking the rfc
+    at most once for all concurrent and subsequent callers asking for the same window.
+    getConnection is only called (and the connection only opened) if the rfc actually needs to be invoked
+    """
     @staticmethod
     def getSWNCRecordsForSID(tracer: logging.Logger,
-                                          logTag: str, 
-                                          sapSid: str, 
-                                          rfcName: str,
-                                          connection: Connection, 
-                                          startDateTime: datetime,
-                                          endDateTime: datetime,
-                                          useSWNCCache: bool
-                                          ):
-        if (useSWNCCache and sapSid in SwncRfcSharedCache._swncRecordsCache):
-            cacheEntry = SwncRfcSharedCache._swncRecordsCache[sapSid]
-            if (cacheEntry['expirationDateTime'] > datetime.utcnow()):
-                if (cacheEntry['swnc_records']):
-                    return cacheEntry['swnc_records']
-        swnc_result = None
-        try:
-            tracer.info("%s executing RFC SWNC_GET_WORKLOAD_SNAPSHOT check for SID: %s",
-                         logTag, sapSid)
-            swnc_result = connection.call(rfcName, 
-                                        READ_START_DATE=startDateTime.date(), 
-                                        READ_START_TIME=startDateTime.time(), 
-                                        READ_END_DATE=endDateTime.date(), 
-                                        READ_END_TIME=endDateTime.time())
-            return swnc_result
-        except CommunicationError as e:
-            tracer.error("[%s] communication error for rfc %s with SID: %s (%s)",
-                              logTag, rfcName, sapSid, e, exc_info=True)
-            raise
-        except Exception as e:
-            tracer.error("[%s] Error occured for rfc %s with SID: %s (%s)", 
-                              logTag, rfcName, sapSid, e, exc_info=True)
-            raise
-        finally:
-            if swnc_result:
-                SwncRfcSharedCache._swncRecordsCache[sapSid] = { 'swnc_records': swnc_result, 'expirationDateTime': datetime.utcnow() + CACHE_EXPIRATION_PERIOD }
\ No newline at end of file
+                             logTag: str,
+                             sapSid: str,
+                             rfcName: str,
+                             getConnection: Callable[[], Connection],
+                             startDateTime: datetime,
+                             endDateTime: datetime,
+                             useSWNCCache: bool):
+        def callRfc():
+            tracer.info("%s executing RFC SWNC_GET_WORKLOAD_SNAPSHOT check for SID: %s, window: [%s, %s]",
+                        logTag, sapSid, startDateTime, endDateTime)
+            try:
+                with getConnection() as connection:
+                    return connection.call(rfcName,
+                                           READ_START_DATE=startDateTime.date(),
+                                           READ_START_TIME=startDateTime.time(),
+                                           READ_END_DATE=endDateTime.date(),
+                                           READ_END_TIME=endDateTime.time())
+            except CommunicationError as e:
+                tracer.error("[%s] communication error for rfc %s with SID: %s (%s)",
+                             logTag, rfcName, sapSid, e, exc_info=True)
+                raise
+            except Exception as e:
+                tracer.error("[%s] Error occured for rfc %s with SID: %s (%s)",
+                             logTag, rfcName, sapSid, e, exc_info=True)
+                raise
+
+        if not useSWNCCache:
+            return callRfc()
+
+        # failed calls are never cached, so the next check will retry the rfc
+        return SwncRfcSharedCache._swncRecordsCache.getOrLoad((sapSid, startDateTime, endDateTime), callRfc)
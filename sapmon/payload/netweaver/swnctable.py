@@ -0,0 +1,131 @@
+# Python modules
+from typing import Any, Dict, List
+import numpy
+from pandas import DataFrame
+
+# TASKTIMES columns of SWNC_GET_WORKLOAD_SNAPSHOT that are returned as workload metrics (metric name -> TASKTIMES column)
+SWNC_WORKLOAD_COLUMNS = {
+    "Total Steps": "COUNT",
+    "Total Response Time": "RESPTI",
+    "Total Processing Time": "PROCTI",
+    "Total CPU Time": "CPUTI",
+    "Total Queue Time": "QUEUETI",
+    "Total Roll Wait Time": "ROLLWAITTI",
+    "Total GUI Steps": "GUICNT",
+    "Total GUI Time": "GUITIME",
+    "Total GUI Net Time": "GUINETTIME",
+    "Total DB Dir Read Time": "READDIRTI",
+    "Total DB Seq Read Time": "READSEQTI",
+    "Total DB Chg Time": "CHNGTI",
+    "Total DB Proc Time": "DBP_TIME",
+    "Total DB Proc Steps": "DBP_COUNT",
+    "Total DB Dir Read Steps": "READDIRCNT",
+    "Total DB Seq Read Steps": "READSEQCNT",
+    "Total DB Change Steps": "CHNGCNT",
+    "PHYREADCNT": "PHYREADCNT",
+    "PHYCHNGREC": "PHYCHNGREC",
+    "PHYCALLS": "PHYCALLS",
+}
+
+# ST03 ratios calculated for every task type (metric name -> numerator, denominator), 0.0 if the denominator is 0
+SWNC_ST03_RATIOS = {
+    "ST03_Avg_Resp_Time": ("Total Response Time", "Total Steps"),
+    "ST03_CPU_Time": ("Total CPU Time", "Total Response Time"),
+    "ST03_Processing_Time": ("Total Processing Time", "Total Response Time"),
+    "ST03_DB_Time": ("Total DB Time", "Total Response Time"),
+    "ST03_Queue_Time": ("Total Queue Time", "Total Response Time"),
+    "ST03_RollWait_Time": ("Total Roll Wait Time", "Total Response Time"),
+    "ST03_Avg_DB_Dir_Time": ("Total DB Dir Read Time", "Total DB Dir Read Steps"),
+    "ST03_Avg_DB_Seq_Time": ("Total DB Seq Read Time", "Total DB Seq Read Steps"),
+    "ST03_Avg_DB_Change_Time": ("Total DB Chg Time", "Total DB Change Steps"),
+    "ST03_Avg_DB_Procedure_Time": ("Total DB Proc Time", "Total DB Proc Steps"),
+}
+
+##########
+# one table of a SWNC_GET_WORKLOAD_SNAPSHOT result (TASKTIMES, MEMORY, USERTCODE, ...)
+# tables that are passed through unchanged keep the RFC records as they are; only tables that are calculated on
+# (TASKTIMES) are loaded into typed columns, all calculations are done on whole columns, and metric records
+# are only built again by toRecords() when the result is serialized
+##########
+class SwncSnapshotTable:
+
+    def __init__(self,
+                 rfcName: str,
+                 hostname: str,
+                 records: List[Dict[str, Any]]):
+        self.rfcName = rfcName
+        self.hostname = hostname
+        self.records = records
+        # columnar copy of the records, only created once a calculation needs it
+        self.frame = None
+
+    """
+    number of rows of the table
+    """
+    def __len__(self) -> int:
+        if self.frame is not None:
+            return len(self.frame.index)
+        return len(self.records)
+
+    """
+    raise an error if any of the given columns was not returned by SAP
+    """
+    def requireColumns(self, columns: List[str]) -> None:
+        frame = self._getFrame()
+        for column in columns:
+            if column not in frame.columns:
+                raise ValueError("Result received for rfc %s from hostname: %s does not contain key: %s"
+                                 % (self.rfcName, self.hostname, column))
+
+    """
+    divide two columns element-wise, with 0.0 wherever the denominator is 0
+    """
+    @staticmethod
+    def safeDivide(numerator, denominator) -> numpy.ndarray:
+        numerator = numpy.asarray(numerator, dtype=numpy.float64)
+        denominator = numpy.asarray(denominator, dtype=numpy.float64)
+        result = numpy.zeros(len(numerator), dtype=numpy.float64)
+        numpy.divide(numerator, denominator, out=result, where=(denominator != 0))
+        return result
+
+    """
+    turn the TASKTIMES table into workload metrics per task type, enriched with the ST03 ratios
+    """
+    def toWorkloadMetrics(self, taskTypeMappings: Dict[bytes, str]) -> "SwncSnapshotTable":
+        self.requireColumns(["TASKTYPE"] + list(SWNC_WORKLOAD_COLUMNS.values()))
+        source = self._getFrame()
+        metrics = DataFrame(index=source.index)
+
+        # try to map task type hex code to more descriptive task name to make more readable, but
+        # if we can't find a mapping then just echo the taskTypeId
+        metrics["Task Type"] = source["TASKTYPE"]
+        metrics["Task Type Name"] = source["TASKTYPE"].map(lambda taskTypeId: taskTypeMappings.get(taskTypeId, taskTypeId))
+        for (metricName, column) in SWNC_WORKLOAD_COLUMNS.items():
+            metrics[metricName] = source[column]
+        metrics["Total DB Time"] = source["READSEQTI"] + source["CHNGTI"] + source["READDIRTI"]
+
+        for (metricName, (numerator, denominator)) in SWNC_ST03_RATIOS.items():
+            metrics[metricName] = SwncSnapshotTable.safeDivide(metrics[numerator], metrics[denominator])
+
+        self.frame = metrics
+        return self
+
+    """
+    build one metric record per row, adding the given properties (that are the same for all rows) to each record;
+    the records of a table without calculations are copied as they are (the snapshot result may be shared with
+    other checks), so keys that are missing in some rows stay missing instead of becoming NaN
+    """
+    def toRecords(self, properties: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        if self.frame is None:
+            records = [dict(record) for record in self.records]
+        else:
+            records = self.frame.to_dict("records")
+        if properties:
+            for record in records:
+                record.update(properties)
+        return records
+
+    def _getFrame(self) -> DataFrame:
+        if self.frame is None:
+            self.frame = DataFrame.from_records(self.records) if len(self.records) > 0 else DataFrame()
+        return self.frame
@@ -0,0 +1,183 @@
+# Python modules
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+from threading import Lock
+from time import time
+import requests
+
+# SOAP Client modules
+from zeep.cache import Base
+
+# Payload modules
+from const import *
+from helper.tools import *
+
+# cached documents older than this are revalidated against the remote host in the background
+WSDL_CACHE_REVALIDATE_SECS = 3600
+
+# timeout to use for revalidating a cached document
+WSDL_CACHE_REVALIDATE_TIMEOUT_SECS = 5
+
+# timeout to use for checking that the host of a cached document is reachable
+WSDL_CACHE_PROBE_TIMEOUT_SECS = 2
+
+FILENAME_WSDL_CACHE_INDEX = "index.json"
+
+##########
+# persistent, content-addressed cache for the WSDL and schema documents loaded by zeep
+# every document is stored once per content hash (all instances of the same SAP release share the same WSDL), and the index maps
+# each document URL (so protocol, host and port) to the hash of its last known content and its HTTP validators.
+# cached documents are always served locally; once they are older than WSDL_CACHE_REVALIDATE_SECS, they are revalidated
+# in the background with a conditional request. SOAP client initialization only probes the host of a cached WSDL with
+# a HEAD request (see probe()), so it still verifies that the host is reachable without downloading the WSDL again
+##########
+class WsdlDiskCache(Base, metaclass=Singleton):
+
+    def __init__(self,
+                 tracer: logging.Logger,
+                 path: str = PATH_WSDL_CACHE,
+                 revalidateSecs: int = WSDL_CACHE_REVALIDATE_SECS):
+        self.tracer = tracer
+        self.path = path
+        self.revalidateSecs = revalidateSecs
+        self._lock = Lock()
+        self._revalidating = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="wsdlcache")
+        os.makedirs(self.path, exist_ok=True)
+        self._index = self._readIndex()
+
+    """
+    zeep cache interface: store a document that has been loaded from the remote host
+    (zeep does not pass on the response headers, so HTTP validators already known for the same content are kept)
+    """
+    def add(self, url: str, content: bytes) -> None:
+        with self._lock:
+            entry = self._index.get(url, None)
+            if entry and entry['sha256'] == hashlib.sha256(content).hexdigest():
+                self._store(url, content, entry.get('etag', None), entry.get('lastModified', None))
+            else:
+                self._store(url, content, None, None)
+
+    """
+    if a document is cached, check that its remote host can still be reached over the protocol and port of the URL
+    with a HEAD request; any HTTP response counts, since only the connection matters. raises if the host cannot be
+    reached. documents that are not cached are not probed, since zeep fetches them from the host anyway
+    """
+    def probe(self, url: str, timeoutSecs: int = WSDL_CACHE_PROBE_TIMEOUT_SECS) -> None:
+        with self._lock:
+            if url not in self._index:
+                return
+        requests.head(url, verify=False, timeout=timeoutSecs, allow_redirects=False)
+
+    """
+    zeep cache interface: return the cached document for a URL (None if not cached), and trigger background
+    revalidation if the cached document is stale
+    """
+    def get(self, url: str) -> bytes:
+        with self._lock:
+            entry = self._index.get(url, None)
+            if not entry:
+                return None
+            try:
+                with open(self._getBlobFileName(entry['sha256']), "rb") as blobFile:
+                    content = blobFile.read()
+            except FileNotFoundError:
+                del self._index[url]
+                return None
+            if entry['validatedTime'] + self.revalidateSecs <= time() and url not in self._revalidating:
+                self._revalidating.add(url)
+                self._executor.submit(self._revalidate, url, dict(entry))
+        return content
+
+    """
+    (conditionally) fetch a document and update the cache if it has changed; returns whether the content has changed
+    """
+    def _fetch(self, url: str, entry: dict, timeoutSecs: int) -> bool:
+        startTime = time()
+        headers = {}
+        if entry.get('etag', None):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('lastModified', None):
+            headers['If-Modified-Since'] = entry['lastModified']
+        response = requests.get(url, headers=headers, verify=False, timeout=timeoutSecs)
+        if response.status_code == 304 and entry:
+            with self._lock:
+                if url in self._index:
+                    self._index[url]['validatedTime'] = time()
+                    self._writeIndex()
+            isChanged = False
+        else:
+            response.raise_for_status()
+            with self._lock:
+                isChanged = hashlib.sha256(response.content).hexdigest() != entry.get('sha256', None)
+                self._store(url, response.content, response.headers.get('ETag', None), response.headers.get('Last-Modified', None))
+        self.tracer.info("fetched wsdl document %s (changed=%s, status=%d) [%d ms]",
+                         url, isChanged, response.status_code, TimeUtils.getElapsedMilliseconds(startTime))
+        return isChanged
+
+    """
+    conditionally re-fetch a cached document in the background and update the cache if it has changed
+    """
+    def _revalidate(self, url: str, entry: dict) -> None:
+        startTime = time()
+        try:
+            self._fetch(url, entry, WSDL_CACHE_REVALIDATE_TIMEOUT_SECS)
+        except Exception as e:
+            # keep serving the cached document; the next lookup will try again once it is stale
+            self.tracer.warning("could not revalidate cached wsdl document %s [%d ms] %s",
+                                url, TimeUtils.getElapsedMilliseconds(startTime), e)
+        finally:
+            with self._lock:
+                self._revalidating.discard(url)
+
+    # Caller must hold self._lock
+    def _store(self, url: str, content: bytes, etag: str, lastModified: str) -> None:
+        sha256 = hashlib.sha256(content).hexdigest()
+        blobFileName = self._getBlobFileName(sha256)
+        if not os.path.exists(blobFileName):
+            self._writeFile(blobFileName, content)
+        previousEntry = self._index.get(url, None)
+        self._index[url] = {
+            'sha256': sha256,
+            'etag': etag,
+            'lastModified': lastModified,
+            'validatedTime': time()
+        }
+        self._writeIndex()
+        # remove the previous content once no other document refers to it anymore
+        if previousEntry and previousEntry['sha256'] != sha256 and \
+           not any(e['sha256'] == previousEntry['sha256'] for e in self._index.values()):
+            try:
+                os.remove(self._getBlobFileName(previousEntry['sha256']))
+            except FileNotFoundError:
+                pass
+
+    def _readIndex(self) -> dict:
+        try:
+            with open(os.path.join(self.path, FILENAME_WSDL_CACHE_INDEX), "r") as indexFile:
+                return json.load(indexFile)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.tracer.warning("could not read wsdl cache index, starting with an empty cache (%s)", e)
+            return {}
+
+    # Caller must hold self._lock
+    def _writeIndex(self) -> None:
+        self._writeFile(os.path.join(self.path, FILENAME_WSDL_CACHE_INDEX),
+                        json.dumps(self._index).encode("utf-8"))
+
+    # write a file atomically, so a crash never leaves a truncated document or index behind
+    def _writeFile(self, fileName: str, content: bytes) -> None:
+        tempFileName = "%s.tmp" % fileName
+        with open(tempFileName, "wb") as tempFile:
+            tempFile.write(content)
+            tempFile.flush()
+            os.fsync(tempFile.fileno())
+        os.replace(tempFileName, fileName)
+
+    def _getBlobFileName(self, sha256: str) -> str:
+        return os.path.join(self.path, "%s.xml" % sha256)
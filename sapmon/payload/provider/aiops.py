@@ -203,7 +203,8 @@ class AIOpsProviderCheck(ProviderCheck):
         """Compile the Azure resources from global state and get RH events for those resources.
         """
         self.lastResult = []
-        self.pollingState = self.state.get(POLLING_STATE, {})
+        # Work on a copy, the state itself is only replaced once the check has completed (copy-on-write)
+        self.pollingState = dict(self.state.get(POLLING_STATE, {}))
 
         # Get resources for which AIOps is enabled.
         resources = self.__compileAIOpsEnabledResources()
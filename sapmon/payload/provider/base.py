@@ -4,12 +4,15 @@ from datetime import date, datetime, timedelta, timezone
 import json
 import logging
 from retry.api import retry_call
+import threading
 from time import time
-from typing import Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
 
 # Payload modules
 from const import *
+from helper.content import ContentRegistry
 from helper.context import *
+from helper.statestore import StateStore
 from helper.tools import *
 
 ###############################################################################
@@ -25,7 +28,10 @@ class ProviderInstance(ABC):
    metadata = {}
    checks = []
    state = {}
+   stateLock = None
    retrySettings = {}
+   # Fingerprint of the configuration this instance has been created from (see loadConfig)
+   configHash = None
    
    def __init__(self,
                 tracer: logging.Logger,
@@ -42,6 +48,12 @@ class ProviderInstance(ABC):
       self.providerType = providerInstance["type"]
       self.fullName = "%s/%s" % (self.providerType, self.name)
       self.state = {}
+      # Guards read-modify-write sequences on the global state; nested values are replaced, never modified in place
+      self.stateLock = threading.RLock()
+      self._stateVersion = 0
+      self._writtenStateVersion = 0
+      self._writeLock = threading.Lock()
+      self._isRetired = False
       self.retrySettings = retrySettings
       if not self.parseProperties():
          raise ValueError("failed to parse properties of the provider instance")
@@ -54,12 +66,10 @@ class ProviderInstance(ABC):
       from helper.providerfactory import ProviderFactory
 
       self.tracer.info("[%s] initializing content for provider instance" % self.fullName)
+      # Content files are parsed once per process and shared by all instances of the same provider type
+      filename = os.path.join(PATH_CONTENT, "%s.json" % self.providerType)
       try:
-         filename = os.path.join(PATH_CONTENT, "%s.json" % self.providerType)
-         self.tracer.debug("filename=%s" % filename)
-         with open(filename, "r") as file:
-            data = file.read()
-         jsonData = json.loads(data, object_hook=JsonDecoder.datetimeHook)
+         checks = ContentRegistry.getCheckDefinitions(self.tracer, self.providerType)
       except FileNotFoundError as e:
          self.tracer.warning("[%s] content file %s does not exist" % (self.fullName,
                                                                       filename))
@@ -70,8 +80,7 @@ class ProviderInstance(ABC):
                                                                          e))
          return False
 
-      # Parse and instantiate the individual checks of the provider
-      checks = jsonData.get("checks", [])
+      # Instantiate the individual checks of the provider
       self.checks = []
       for checkOptions in checks:
          try:
@@ -89,22 +98,107 @@ class ProviderInstance(ABC):
                                                                                               e))
       return True
 
-   # Read most recent, provider-specific state from state file
+   # Read most recent, provider-specific state from the state store
    def readState(self) -> bool:
-      self.tracer.info("[%s] reading state file for provider instance" % self.fullName)
-      jsonData = {}
+      self.tracer.info("[%s] reading state for provider instance" % self.fullName)
 
-      # Parse JSON for all check states of this provider
       try:
-         filename = os.path.join(PATH_STATE, "%s.state" % self.name)
-         self.tracer.debug("[%s] filename=%s" % (self.fullName,
-                                                 filename))
+         storedValues = StateStore(self.tracer).load(self.name)
+         if not storedValues:
+            # Nothing in the state store yet; fall back to a state file written by a previous version
+            return self._migrateStateFile()
+         jsonData = {
+            "global": {},
+            "checks": {}
+         }
+         # State written before datetime objects were tagged needs the (slow) legacy decoding once
+         isTyped = storedValues.get(STATE_KEY_FORMAT, None) == str(STATE_FORMAT_TYPED)
+         objectHook = JsonDecoder.typedHook if isTyped else JsonDecoder.datetimeHook
+         for (key, value) in storedValues.items():
+            decodedValue = json.loads(value, object_hook=objectHook)
+            if key == STATE_KEY_GLOBAL:
+               jsonData["global"] = decodedValue
+            elif key.startswith(STATE_KEY_CHECK_PREFIX):
+               jsonData["checks"][key[len(STATE_KEY_CHECK_PREFIX):]] = decodedValue
+      except Exception as e:
+         self.tracer.error("[%s] could not read state (%s)" % (self.fullName,
+                                                              e))
+         return False
+
+      self._applyState(jsonData)
+      if not isTyped:
+         self.tracer.info("[%s] converting state of provider instance to typed format" % self.fullName)
+         self.writeState()
+      self.tracer.info("[%s] successfully read state for provider instance" % self.fullName)
+      return True
+
+   # Write current state for this provider and its checks into the state store
+   # Only the global state and the state of the given check (or of all checks) is considered;
+   # values that have not changed since they have last been written are skipped by the store
+   # Checks of the same provider run (and write state) concurrently, so everything is serialized from snapshots
+   def writeState(self,
+                  check: "ProviderCheck" = None) -> bool:
+      self.tracer.info("[%s] writing state for provider instance" % self.fullName)
+      checks = [check] if check else list(self.checks)
+      try:
+         (stateVersion, globalState) = self.getStateSnapshot()
+         globalJson = json.dumps(globalState, sort_keys=True, cls=StateJsonEncoder)
+         checkJsons = [(c.name, json.dumps(c.getStateSnapshot(), sort_keys=True, cls=StateJsonEncoder)) for c in checks]
+         stateStore = StateStore(self.tracer)
+         with self._writeLock:
+            if self._isRetired:
+               # The state now belongs to the instance that has replaced this one
+               self.tracer.info("[%s] not writing state of retired provider instance" % self.fullName)
+               return False
+            # Never let a snapshot overwrite a more recent one written by another thread in the meantime
+            if stateVersion > self._writtenStateVersion:
+               stateStore.put(self.name,
+                              STATE_KEY_GLOBAL,
+                              globalJson)
+               self._writtenStateVersion = stateVersion
+            for (checkName, checkJson) in checkJsons:
+               stateStore.put(self.name,
+                              STATE_KEY_CHECK_PREFIX + checkName,
+                              checkJson)
+            # Queued last, so the format marker is never flushed before the values it describes
+            stateStore.put(self.name,
+                           STATE_KEY_FORMAT,
+                           str(STATE_FORMAT_TYPED))
+      except Exception as e:
+         self.tracer.error("[%s] could not write state (%s)" % (self.fullName,
+                                                               e))
+         return False
+
+      self.tracer.info("[%s] successfully queued state for provider instance" % self.fullName)
+      return True
+
+   # Stop writing state for this instance, since it is about to be replaced (or removed)
+   # Once this returns, no write of this instance is in progress anymore, so a replacement can safely read the state
+   def retire(self) -> None:
+      with self._writeLock:
+         self._isRetired = True
+
+   # Release the resources held by this instance (e.g. connections)
+   # Called once the instance has been replaced or removed and none of its checks is running anymore
+   def close(self) -> None:
+      self.retire()
+
+   # Return a consistent (shallow) copy of the global state, together with a version number
+   # that increases with every snapshot
+   def getStateSnapshot(self) -> Tuple[int, Dict]:
+      with self.stateLock:
+         self._stateVersion += 1
+         return (self._stateVersion, dict(self.state))
+
+   # Import the state file of a previous version (<name>.state) into the state store
+   def _migrateStateFile(self) -> bool:
+      filename = os.path.join(PATH_STATE, "%s.state" % self.name)
+      try:
          with open(filename, "r") as file:
             data = file.read()
          jsonData = json.loads(data, object_hook=JsonDecoder.datetimeHook)
       except FileNotFoundError as e:
-         self.tracer.warning("[%s] state file %s does not exist" % (self.fullName,
-                                                                    filename))
+         self.tracer.warning("[%s] no state found for provider instance" % self.fullName)
          return False
       except Exception as e:
          self.tracer.error("[%s] could not read state file %s (%s)" % (self.fullName,
@@ -112,8 +206,18 @@ class ProviderInstance(ABC):
                                                                        e))
          return False
 
+      self.tracer.info("[%s] migrating state file %s into state store" % (self.fullName,
+                                                                          filename))
+      self._applyState(jsonData)
+      self.writeState()
+      return True
+
+   # Update global state and the states of all checks from the (decoded) state of this provider instance
+   def _applyState(self,
+                   jsonData: Dict) -> None:
       # Update global state for this provider
-      self.state = jsonData.get("global", {})
+      with self.stateLock:
+         self.state = jsonData.get("global", {})
       self.tracer.debug("[%s] global state=%s" % (self.fullName, str(self.state)))
 
       # Update state for each individual check of this provider
@@ -126,39 +230,6 @@ class ProviderInstance(ABC):
          if saveIsEnabled is not None:
             check.state["isEnabled"] = saveIsEnabled
          self.tracer.debug("[%s] check state=%s" % (check.fullName, str(check.state)))
-      self.tracer.info("[%s] successfully read state file for provider instance" % self.fullName)
-      return True
-
-   # Write current state for this provider and its checks into state file
-   def writeState(self) -> bool:
-      self.tracer.info("[%s] writing state file for provider instance" % self.fullName)
-
-      # Initialize JSON object with global state
-      jsonData = {
-         "global": self.state
-      }
-
-      # Build dictionary with states for all checks of this provider and insert it into JSON object
-      checkStates = {}
-      for check in self.checks:
-         checkStates[check.name] = check.state
-      jsonData["checks"] = checkStates
-
-      # Write JSON object into state file
-      try:
-         filename = os.path.join(PATH_STATE, "%s.state" % self.name)
-         self.tracer.debug("[%s] filename=%s" % (self.fullName,
-                                                 filename))
-         with open(filename, "w") as file:
-            json.dump(jsonData, file, indent=3, cls=JsonEncoder)
-      except Exception as e:
-         self.tracer.error("[%s] could not write state file %s (%s)" % (self.fullName,
-                                                                        filename,
-                                                                        e))
-         return False
-
-      self.tracer.info("[%s] successfully wrote state file for provider instance" % self.fullName)
-      return True
 
    # Provider-specific validation logic (e.g. establish HANA connection)
    @abstractmethod
@@ -172,6 +243,17 @@ class ProviderInstance(ABC):
 
 ###############################################################################
 
+# Action of a check, with its method and retry settings resolved when the check is instantiated
+class CompiledAction(NamedTuple):
+   methodName: str
+   method: Optional[Callable]
+   parameters: Mapping[str, Any]
+   tries: int
+   delay: float
+   backoff: float
+
+###############################################################################
+
 # Base class for a check as part of a monitoring provider
 class ProviderCheck(ABC):
    providerInstance = None
@@ -180,6 +262,8 @@ class ProviderCheck(ABC):
    customLog = None
    frequencySecs = None
    includeInCustomerAnalytics = False
+   ingestOnChangeOnly = False
+   maxSilenceSecs = None
    actions = []
    state = {}
    fullName = None
@@ -194,14 +278,19 @@ class ProviderCheck(ABC):
                 frequencySecs: int,
                 actions: List[str],
                 includeInCustomerAnalytics: bool = False,
-                enabled: bool = True):
+                enabled: bool = True,
+                ingestOnChangeOnly: bool = False,
+                maxSilenceSecs: int = INGEST_ON_CHANGE_MAX_SILENCE_IN_SECONDS):
       self.providerInstance = providerInstance
       self.name = name
       self.description = description
       self.customLog = customLog
       self.frequencySecs = frequencySecs
       self.includeInCustomerAnalytics = includeInCustomerAnalytics
+      self.ingestOnChangeOnly = ingestOnChangeOnly
+      self.maxSilenceSecs = maxSilenceSecs
       self.actions = actions
+      self.compiledActions = self._compileActions(actions)
       self.state = {
          "isEnabled": enabled,
          "lastRunLocal": None
@@ -211,6 +300,23 @@ class ProviderCheck(ABC):
       self.duration = 0
       self.success = False
       self.checkMessage = None
+      # Set by checks that can tell whether their last result is identical to the previous one
+      self.resultUnchanged = False
+
+   # Resolve the method, parameters and retry settings of every action once, rather than on every run
+   def _compileActions(self,
+                       actions: List[Dict]) -> Tuple[CompiledAction, ...]:
+      retrySettings = self.providerInstance.retrySettings
+      compiledActions = []
+      for action in actions:
+         methodName = METHODNAME_ACTION % action["type"]
+         compiledActions.append(CompiledAction(methodName = methodName,
+                                               method = getattr(self, methodName, None),
+                                               parameters = action.get("parameters", {}),
+                                               tries = action.get("retries", retrySettings["retries"]),
+                                               delay = action.get("delayInSeconds", retrySettings["delayInSeconds"]),
+                                               backoff = action.get("backoffMultiplier", retrySettings["backoffMultiplier"])))
+      return tuple(compiledActions)
 
    # Return check name for locking
    def getLockName(self) -> str:
@@ -222,32 +328,33 @@ class ProviderCheck(ABC):
          return False
       return True
 
-   # Determine if this check is due to be executed
-   def isDue(self) -> bool:
+   # Determine the point in time (seconds since epoch) at which this check is due to be executed next
+   # (shared by isDue() and the check scheduler)
+   def getNextDueTime(self) -> float:
       # lastRunLocal = last execution time on collector VM
       # lastRunServer (used in provider) = last execution time on (HANA) server
       lastRunLocal = self.state.get("lastRunLocal", None)
-      self.tracer.debug("[%s] lastRunLocal=%s; frequencySecs=%d; currentLocal=%s" % (self.fullName,
-                                                                                     lastRunLocal,
-                                                                                     self.frequencySecs,
-                                                                                     datetime.utcnow()))
-
-      if lastRunLocal:
-         # want to support timezone naive and aware datetime comparision
-         # default to utc datetime value without actual utc time zone attribute
-         utcTime = datetime.utcnow()
-         if lastRunLocal.tzinfo:
-            # if lastRunLocal is time zone aware, then use utc datetime that has timezone populated
-            utcTime = datetime.now(timezone.utc)
-         if (lastRunLocal + timedelta(seconds = self.frequencySecs) > utcTime):
-            return False
-      
-      return True
+      if not lastRunLocal:
+         return 0.0
+
+      # want to support timezone naive and aware datetime comparision
+      # timezone naive values are utc datetime values without actual utc time zone attribute
+      if not lastRunLocal.tzinfo:
+         lastRunLocal = lastRunLocal.replace(tzinfo = timezone.utc)
+      return lastRunLocal.timestamp() + self.frequencySecs
+
+   # Determine if this check is due to be executed
+   def isDue(self) -> bool:
+      return self.isDueWithin(0)
 
+   # Determine if this check is due to be executed within the next few seconds
+   def isDueWithin(self,
+                   seconds: float) -> bool:
+      return self.getNextDueTime() <= time() + seconds
 
    # Method that gets called when this check is executed
-   # Returns a JSON-formatted string that can be ingested into Log Analytics
-   def run(self) -> str:      
+   # Returns a list of JSON-formatted strings that can each be ingested into Log Analytics
+   def run(self) -> List[str]:      
       startTime = time()
       
       # ensure lastRunTime is initialized at start of run method, rather than require all action methods to initialize it themselves
@@ -258,21 +365,20 @@ class ProviderCheck(ABC):
       try:
          self.duration = 0
          self.success = False
+         self.resultUnchanged = False
          self.tracer.info("[%s] executing all actions of check" % self.fullName)
          self.tracer.debug("[%s] actions=%s" % (self.fullName,
                                                 self.actions))
-         for action in self.actions:
-            methodName = METHODNAME_ACTION % action["type"]
-            parameters = action.get("parameters", {})
+         for action in self.compiledActions:
+            methodName = action.methodName
             self.tracer.debug("[%s] calling action %s" % (self.fullName,
                                                          methodName))
-            method = getattr(self, methodName)
-            tries = action.get("retries", self.providerInstance.retrySettings["retries"])
-            delay = action.get("delayInSeconds", self.providerInstance.retrySettings["delayInSeconds"])
-            backoff = action.get("backoffMultiplier", self.providerInstance.retrySettings["backoffMultiplier"])
+            if action.method is None:
+               raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__,
+                                                                           methodName))
 
             try :
-               retry_call(method, fkwargs=parameters, tries=tries, delay=delay, backoff=backoff, logger=self.tracer)
+               retry_call(action.method, fkwargs=action.parameters, tries=action.tries, delay=action.delay, backoff=action.backoff, logger=self.tracer)
                self.success = True
             except Exception as e:
                self.tracer.error("[%s] error executing action %s, Exception %s, skipping remaining actions" % (self.fullName,
@@ -284,13 +390,46 @@ class ProviderCheck(ABC):
       finally:
          self.duration = TimeUtils.getElapsedMilliseconds(startTime)      
 
-      return self.generateJsonString()
+      return self.generateJsonChunks()
+
+   # Determine if the result of the last run has to be ingested
+   # With ingestOnChangeOnly, a result that is identical to the previous one is ingested again by the last run
+   # before maxSilenceSecs have passed since the last ingestion, so there is never a longer gap in the data
+   # (a check that runs less often than maxSilenceSecs ingests every result)
+   def isIngestionRequired(self) -> bool:
+      if not self.ingestOnChangeOnly or not self.resultUnchanged:
+         return True
+      lastIngestedLocal = self.state.get("lastIngestedLocal", None)
+      if not isinstance(lastIngestedLocal, datetime):
+         return True
+      secondsSinceIngestion = (datetime.utcnow() - lastIngestedLocal).total_seconds()
+      return secondsSinceIngestion + self.frequencySecs > self.maxSilenceSecs
+
+   # Remember when the result of this check has last been handed over for ingestion
+   def markIngested(self) -> None:
+      self.state["lastIngestedLocal"] = datetime.utcnow()
+
+   # Return a consistent (shallow) copy of the check state
+   # The state of a check is only modified by the thread running the check, but may be serialized by others;
+   # copying a dict is atomic, and nested values are replaced rather than modified in place
+   def getStateSnapshot(self) -> Dict:
+      return dict(self.state)
 
    # Method to generate a JSON object that can be ingested into Log Analytics
    @abstractmethod
    def generateJsonString(self) -> str:
       return
 
+   # Method to generate the result as one or more JSON arrays that can be ingested separately
+   # (checks with large results can override this to avoid building one huge string)
+   def generateJsonChunks(self) -> List[str]:
+      return [self.generateJsonString()]
+
+   # Method to return the result of the last run as individually encoded JSON records, if the check has them;
+   # customer analytics uses these records as they are, rather than parsing the result JSON again
+   def getResultRecords(self) -> Optional[List[str]]:
+      return None
+
    # Method that gets called when the internal state is updated
    @abstractmethod
    def updateState(self):
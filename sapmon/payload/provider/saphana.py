@@ -1,17 +1,20 @@
 # Python modules
-import hashlib
 import json
 import logging
 import re
+import threading
 import time
+from time import monotonic
 
 # Payload modules
 from const import *
 from helper.azure import *
 from helper.context import *
+from helper.endpointhealth import EndpointHealthRegistry
+from helper.sqlresult import SqlResult
 from helper.tools import *
 from provider.base import ProviderInstance, ProviderCheck
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
 
 # SAP HANA modules
 from hdbcli import dbapi
@@ -30,6 +33,135 @@ RETRY_RETRIES = 3
 RETRY_DELAY_SECS   = 1
 RETRY_BACKOFF_MULTIPLIER = 2
 
+# Connection pool settings
+POOL_MAX_CONNECTIONS        = 4
+POOL_ACQUIRE_TIMEOUT_SECS   = 60
+POOL_VALIDATE_IDLE_SECS     = 30
+POOL_MAX_IDLE_SECS          = 600
+
+# Grouped collection settings
+GROUP_PREFETCH_WINDOW_SECS  = 15
+GROUP_PREFETCH_MAX_AGE_SECS = 30
+
+###############################################################################
+
+# Raised by HanaConnectionPool.acquire() if no connection slot became free in time
+# (says nothing about the health of the HANA host itself)
+class HanaPoolTimeoutError(Exception):
+   pass
+
+# Bounded, thread-safe pool of warm HANA connections of one provider instance, kept per host
+# Connections are validated before they are handed out and dropped after any error;
+# reset() discards all connections (e.g. after the active host or role has changed)
+class HanaConnectionPool:
+   tracer = None
+
+   def __init__(self,
+                tracer: logging.Logger,
+                connect: Callable[[str], pyhdbcli.Connection],
+                maxConnections: int = POOL_MAX_CONNECTIONS,
+                validateIdleSecs: int = POOL_VALIDATE_IDLE_SECS,
+                maxIdleSecs: int = POOL_MAX_IDLE_SECS):
+      self.tracer = tracer
+      self.connect = connect
+      self.maxConnections = maxConnections
+      self.validateIdleSecs = validateIdleSecs
+      self.maxIdleSecs = maxIdleSecs
+      self._lock = threading.Lock()
+      self._slots = threading.BoundedSemaphore(maxConnections)
+      self._idleConnections = {}
+      self._generations = {}
+      self._generation = 0
+
+   # Return a working connection to the given host, either from the pool or newly established
+   def acquire(self,
+               host: str,
+               timeoutSecs: int = POOL_ACQUIRE_TIMEOUT_SECS) -> pyhdbcli.Connection:
+      if not self._slots.acquire(timeout = timeoutSecs):
+         raise HanaPoolTimeoutError("timed out waiting for a free HANA connection to %s" % host)
+      try:
+         with self._lock:
+            generation = self._generation
+         connection = self._takeIdleConnection(host)
+         if not connection:
+            self.tracer.debug("establishing new pooled HANA connection to %s" % host)
+            connection = self.connect(host)
+            if not connection.isconnected():
+               self._close(connection)
+               raise Exception("HANA connection to %s could not be established" % host)
+      except Exception:
+         self._slots.release()
+         raise
+      with self._lock:
+         self._generations[id(connection)] = generation
+      return connection
+
+   # Hand a connection back to the pool; broken or outdated connections are closed instead
+   def release(self,
+               connection: pyhdbcli.Connection,
+               host: str,
+               discard: bool = False) -> None:
+      try:
+         with self._lock:
+            generation = self._generations.pop(id(connection), None)
+            idleCount = sum(len(c) for c in self._idleConnections.values())
+            keep = not discard and generation == self._generation and idleCount < self.maxConnections
+            if keep:
+               self._idleConnections.setdefault(host, []).append((connection, monotonic()))
+         if not keep:
+            self._close(connection)
+      finally:
+         self._slots.release()
+
+   # Close all idle connections and make sure connections currently in use are not returned to the pool
+   def reset(self) -> None:
+      with self._lock:
+         self._generation += 1
+         idleConnections = [c for l in self._idleConnections.values() for (c, _) in l]
+         self._idleConnections = {}
+      self.tracer.info("resetting HANA connection pool (closing %d idle connections)" % len(idleConnections))
+      for connection in idleConnections:
+         self._close(connection)
+
+   # Pop the most recently used idle connection to a host that is still healthy
+   def _takeIdleConnection(self,
+                           host: str) -> pyhdbcli.Connection:
+      while True:
+         with self._lock:
+            idleConnections = self._idleConnections.get(host, None)
+            if not idleConnections:
+               return None
+            (connection, lastUsed) = idleConnections.pop()
+         idleSecs = monotonic() - lastUsed
+         if idleSecs <= self.maxIdleSecs and self._isHealthy(connection, ping = idleSecs > self.validateIdleSecs):
+            return connection
+         self.tracer.debug("dropping stale pooled HANA connection to %s" % host)
+         self._close(connection)
+
+   # Check whether a connection is still usable; only connections that have been idle for a while
+   # get a round trip to the server
+   def _isHealthy(self,
+                  connection: pyhdbcli.Connection,
+                  ping: bool) -> bool:
+      try:
+         if not connection.isconnected():
+            return False
+         if ping:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1 FROM DUMMY")
+            cursor.close()
+      except Exception as e:
+         self.tracer.debug("pooled HANA connection failed validation (%s)" % e)
+         return False
+      return True
+
+   def _close(self,
+              connection: pyhdbcli.Connection) -> None:
+      try:
+         connection.close()
+      except Exception as e:
+         self.tracer.debug("could not close HANA connection (%s)" % e)
+
 ###############################################################################
 
 class saphanaProviderInstance(ProviderInstance):
@@ -37,6 +169,8 @@ class saphanaProviderInstance(ProviderInstance):
    hanaDbSqlPort = None
    hanaDbUsername = None
    hanaDbPassword = None
+   groupedCollection = True
+   connectionPool = None
 
    def __init__(self,
                 tracer: logging.Logger,
@@ -58,6 +192,17 @@ class saphanaProviderInstance(ProviderInstance):
                        skipContent,
                        **kwargs)
 
+      self.connectionPool = HanaConnectionPool(tracer,
+                                               lambda host: self._establishHanaConnectionToHost(hostname = host))
+      self._collectionLocks = {}
+      self._collectionLocksLock = threading.Lock()
+      self._prefetchedResults = {}
+
+   # Close all pooled HANA connections of this instance
+   def close(self) -> None:
+      super().close()
+      self.connectionPool.reset()
+
    # Parse provider properties and fetch DB password from KeyVault, if necessary
    def parseProperties(self):
       self.hanaHostname = self.providerProperties.get("hanaHostname", None)
@@ -68,6 +213,7 @@ class saphanaProviderInstance(ProviderInstance):
       if not self.hanaDbSqlPort:
          self.tracer.error("[%s] hanaDbSqlPort cannot be empty" % self.fullName)
          return False
+      self.groupedCollection = self.providerProperties.get("groupedCollection", True)
       self.hanaDbUsername = self.providerProperties.get("hanaDbUsername", None)
       if not self.hanaDbUsername:
          self.tracer.error("[%s] hanaDbUsername cannot be empty" % self.fullName)
@@ -142,6 +288,74 @@ class saphanaProviderInstance(ProviderInstance):
          return False
       return True
 
+   # Return the SQL result of a check, collected together with all other checks of the same frequency
+   # that are (about to be) due: their statements are run back-to-back on a single connection and their
+   # results are kept until these checks run themselves
+   def collectSqlResult(self,
+                        check: ProviderCheck,
+                        preparedSql: str) -> Tuple[SqlResult, datetime]:
+      with self._getCollectionLock(check.frequencySecs):
+         prefetchedResult = self._prefetchedResults.pop(check.name, None)
+         if prefetchedResult:
+            (sql, collectedTime, result) = prefetchedResult
+            # A different statement means the state of the check has moved on since the result was collected
+            if sql == preparedSql and self._isPrefetchedResultFresh(prefetchedResult):
+               self.tracer.info("[%s] using result from grouped collection at %s" % (check.fullName,
+                                                                                     collectedTime))
+               return (result, collectedTime)
+
+         groupStatements = self._prepareGroupStatements(check)
+         self.tracer.info("[%s] collecting SQL results for %d checks in one cycle" % (check.fullName,
+                                                                                      len(groupStatements) + 1))
+         collectedTime = datetime.utcnow()
+         results = check._executeSqlStatements([(check, preparedSql, check.colTimeGenerated)] + groupStatements)
+         for ((member, sql, _), result) in zip(groupStatements, results[1:]):
+            if isinstance(result, Exception):
+               # the member check will run (and report) its own statement
+               continue
+            self._prefetchedResults[member.name] = (sql, collectedTime, result)
+         return (results[0], collectedTime)
+
+   # Caller must hold the collection lock of the check's frequency
+   def _prepareGroupStatements(self,
+                               check: ProviderCheck) -> List[Tuple[ProviderCheck, str, str]]:
+      windowSecs = min(GROUP_PREFETCH_WINDOW_SECS, check.frequencySecs / 2)
+      groupStatements = []
+      for member in self.checks:
+         if member is check or member.frequencySecs != check.frequencySecs:
+            continue
+         if member.name in self._prefetchedResults and self._isPrefetchedResultFresh(self._prefetchedResults[member.name]):
+            continue
+         # Checks that are currently running update their own state and must not be collected for
+         if member.getLockName() in self.ctx.checkLockSet or not member.isEnabled() or not member.isDueWithin(windowSecs):
+            continue
+         sqlActions = [a for a in member.actions if a["type"] == "ExecuteSql"]
+         if len(sqlActions) != 1:
+            continue
+         parameters = sqlActions[0].get("parameters", {})
+         try:
+            preparedSql = member._prepareSql(parameters["sql"],
+                                             parameters.get("isTimeSeries", False),
+                                             parameters.get("initialTimespanSecs", 60))
+         except Exception as e:
+            self.tracer.warning("[%s] could not prepare SQL statement for grouped collection (%s)" % (member.fullName,
+                                                                                                      e))
+            continue
+         if preparedSql:
+            colTimeGenerated = COL_TIMESERIES_UTC if parameters.get("isTimeSeries", False) else COL_SERVER_UTC
+            groupStatements.append((member, preparedSql, colTimeGenerated))
+      return groupStatements
+
+   @staticmethod
+   def _isPrefetchedResultFresh(prefetchedResult: Tuple) -> bool:
+      collectedTime = prefetchedResult[1]
+      return (datetime.utcnow() - collectedTime).total_seconds() <= GROUP_PREFETCH_MAX_AGE_SECS
+
+   def _getCollectionLock(self,
+                          frequencySecs: int) -> threading.Lock:
+      with self._collectionLocksLock:
+         return self._collectionLocks.setdefault(frequencySecs, threading.Lock())
+
    def _establishHanaConnectionToHost(self,
                                       hostname: str = None,
                                       port: int = None,
@@ -169,32 +383,52 @@ class saphanaProviderCheck(ProviderCheck):
                 **kwargs):
       return super().__init__(provider, **kwargs)
 
-   # Obtain one working HANA connection (client-side failover logic)
+   # Obtain one working HANA connection from the pool (client-side failover logic)
+   # The connection has to be handed back via connectionPool.release()
    def _getHanaConnection(self):
       self.tracer.info("[%s] establishing connection with HANA instance" % self.fullName)
 
       # Check if HANA host config has been retrieved from DB yet
-      if "hostConfig" not in self.providerInstance.state:
+      # (read it only once, since other checks of this provider may replace or remove it concurrently)
+      hostConfig = self.providerInstance.state.get("hostConfig", None)
+      if hostConfig is None:
          # Host config has not been retrieved yet; our only candidate is the one provided by user
          self.tracer.debug("[%s] no host config has been persisted yet, using user-provided host" % self.fullName)
          hostsToTry = [self.providerInstance.hanaHostname]
       else:
          # Host config has already been retrieved; rank the hosts to compile a list of hosts to try
          self.tracer.debug("[%s] host config has been persisted to provider, deriving prioritized host list" % self.fullName)
-         hostConfig = self.providerInstance.state["hostConfig"]
          hostsToTry = [h["ip"] if h.get("ip", None) else h["host"] for h in hostConfig]
 
       # Iterate through the prioritized list of hosts to try
       cursor = None
       self.tracer.debug("[%s] hostsToTry=%s" % (self.fullName, hostsToTry))
+      connectionPool = self.providerInstance.connectionPool
+      endpointHealth = EndpointHealthRegistry(self.tracer)
       for host in hostsToTry:
+         # Skip nodes that have recently failed until their backoff has expired
+         endpoint = EndpointHealthRegistry.getEndpointName("hana", host, self.providerInstance.hanaDbSqlPort)
+         if not endpointHealth.isAvailable(endpoint):
+            self.tracer.info("[%s] skipping unavailable HANA node %s:%d" % (self.fullName,
+                                                                           host,
+                                                                           self.providerInstance.hanaDbSqlPort))
+            continue
          try:
-            connection = self.providerInstance._establishHanaConnectionToHost(hostname = host)
-            # Validate that we're indeed connected
-            if connection.isconnected():
+            # Pooled connections are validated before they are handed out
+            connection = connectionPool.acquire(host)
+            try:
                cursor = connection.cursor()
-               break
+            except Exception:
+               connectionPool.release(connection, host, discard = True)
+               raise
+            endpointHealth.recordSuccess(endpoint)
+            break
+         except HanaPoolTimeoutError as e:
+            # All connection slots of this provider instance are in use, so trying other nodes would not help either
+            self.tracer.error("[%s] %s" % (self.fullName, e))
+            return (None, None, None)
          except Exception as e:
+            endpointHealth.recordFailure(endpoint)
             self.tracer.warning("[%s] could not connect to HANA node %s:%d (%s)" % (self.fullName,
                                                                                     host,
                                                                                     self.providerInstance.hanaDbSqlPort,
@@ -206,27 +440,44 @@ class saphanaProviderCheck(ProviderCheck):
       # Our last chance: Forget HANA's current host config and try out the original user config
       self.tracer.error("[%s] unable to connect to any HANA node (hosts to try=%s)" % (self.fullName,
                                                                                        hostsToTry))
+      endpoint = EndpointHealthRegistry.getEndpointName("hana", self.providerInstance.hanaHostname, self.providerInstance.hanaDbSqlPort)
+      if not endpointHealth.isAvailable(endpoint):
+         self.tracer.error("[%s] %s:%d from user config is unavailable as well" % (self.fullName,
+                                                                                   self.providerInstance.hanaHostname,
+                                                                                   self.providerInstance.hanaDbSqlPort))
+         return (None, None, None)
       self.tracer.info("[%s] trying with connection from user config" % self.fullName)
+      connection = None
       try:
-         connection = self.providerInstance._establishHanaConnectionToHost(hostname = self.providerInstance.hanaHostname)
-         if connection.isconnected():
+         connectionPool.reset()
+         connection = connectionPool.acquire(self.providerInstance.hanaHostname)
+         if connection:
             cursor = connection.cursor()
+            endpointHealth.recordSuccess(endpoint)
             self.tracer.info("[%s] connection %s:%d from user config worked; forgetting host config" % (self.fullName,
                                                                                                         self.providerInstance.hanaHostname,
                                                                                                         self.providerInstance.hanaDbSqlPort))
             # Give up and remove current host config, so a "fresh" host config will be pulled next time
             # This is for HA/DR scenarios where customers connected against a vIP and a failover just happened
-            self.providerInstance.state.pop("hostConfig")
+            self.providerInstance.state.pop("hostConfig", None)
             # Update internal state
             if not self.updateState():
                raise Exception("Failed to update state")
-            # Return (temporary) connection from user config
+            # Return connection from user config
             return (connection, cursor, self.providerInstance.hanaHostname)
+      except HanaPoolTimeoutError as e:
+         self.tracer.error("[%s] %s" % (self.fullName, e))
       except Exception as e:
+         if not cursor:
+            endpointHealth.recordFailure(endpoint)
          self.tracer.error("[%s] %s:%d from user config is also unreachable (%s)" % (self.fullName,
                                                                                      self.providerInstance.hanaHostname,
                                                                                      self.providerInstance.hanaDbSqlPort,
                                                                                      e))
+         if connection:
+            connectionPool.release(connection,
+                                   self.providerInstance.hanaHostname,
+                                   discard = True)
       return (None, None, None)
 
    # Prepare the SQL statement based on the check-specific query
@@ -274,76 +525,72 @@ class saphanaProviderCheck(ProviderCheck):
       # Return the finished SQL statement
       return preparedSql
 
-   # Calculate the MD5 hash of a result set
-   def _calculateResultHash(self,
-                            resultRows: List[List[str]]) -> str:
-      self.tracer.info("[%s] calculating hash of SQL query result" % self.fullName)
-      if len(resultRows) == 0:
-         self.tracer.debug("[%s] result set is empty" % self.fullName)
-         return None
-      resultHash = None
-      try:
-         resultHash = hashlib.md5(str(resultRows).encode("utf-8")).hexdigest()
-         self.tracer.debug("resultHash=%s" % resultHash)
-      except Exception as e:
-         self.tracer.error("[%s] could not calculate result hash (%s)" % (self.fullName,
-                                                                          e))
-      return resultHash
+   # Create an empty result for a statement of this check, given the columns it returns
+   def _createSqlResult(self,
+                        colIndex: Dict[str, int],
+                        colTimeGenerated: str) -> SqlResult:
+      # Unless it's the column mapped to TimeGenerated, remove internal fields
+      includedColumns = [c for c in colIndex.keys() if c == colTimeGenerated or not (c.startswith("_") or c == "DUMMY")]
+      constantFields = {
+         "SAPMON_VERSION": PAYLOAD_VERSION,
+         "PROVIDER_INSTANCE": self.providerInstance.name,
+         "METADATA": self.providerInstance.metadata
+      }
+      # The host config parser needs all rows of the result
+      keepRows = any(a["type"] == "ParseHostConfig" for a in self.actions)
+      return SqlResult(colIndex,
+                       constantFields,
+                       includedColumns,
+                       keepRows = keepRows)
 
    # Generate a JSON-encoded string with the last query result
    # This string will be ingested into Log Analytics and Customer Analytics
    def generateJsonString(self) -> str:
-      self.tracer.info("[%s] converting SQL query result set into JSON format" % self.fullName)
-      logData = []
-
-      # Only loop through the result if there is one
-      if self.lastResult:
-         (colIndex, resultRows) = self.lastResult
-         # Iterate through all rows of the last query result
-         for r in resultRows:
-            logItem = {
-               "SAPMON_VERSION": PAYLOAD_VERSION,
-               "PROVIDER_INSTANCE": self.providerInstance.name,
-               "METADATA": self.providerInstance.metadata
-            }
-            for c in colIndex.keys():
-               # Unless it's the column mapped to TimeGenerated, remove internal fields
-               if c != self.colTimeGenerated and (c.startswith("_") or c == "DUMMY"):
-                  continue
-               logItem[c] = r[colIndex[c]]
-            logData.append(logItem)
-
-      # Convert temporary dictionary into JSON string
-      try:
-         resultJsonString = json.dumps(logData, sort_keys=True, indent=4, cls=JsonEncoder)
-         self.tracer.debug("[%s] resultJson=%s" % (self.fullName,
-                                                   str(resultJsonString)))
-      except Exception as e:
-         self.tracer.error("[%s] could not format logItem=%s into JSON (%s)" % (self.fullName,
-                                                                                logItem,
-                                                                                e))
-      return resultJsonString
+      if not self.lastResult:
+         return "[]"
+      return self.lastResult.getJsonString()
+
+   # Return the last query result as (compact) JSON arrays that each fit into one ingestion request
+   # The result has already been encoded while it was fetched
+   def generateJsonChunks(self) -> List[str]:
+      if not self.lastResult:
+         return ["[]"]
+      resultJsonChunks = self.lastResult.getJsonChunks()
+      self.tracer.debug("[%s] %d result rows in %d JSON chunks" % (self.fullName,
+                                                                  self.lastResult.rowCount,
+                                                                  len(resultJsonChunks)))
+      return resultJsonChunks
+
+   # Return the records of the last query result, as they have been encoded while fetching
+   def getResultRecords(self) -> Optional[List[str]]:
+      if not self.lastResult:
+         return []
+      return self.lastResult.getRecords()
 
    # Update the internal state of this check (including last run times)
    def updateState(self) -> bool:
       self.tracer.info("[%s] updating internal state" % self.fullName)
-      (colIndex, resultRows) = self.lastResult
+      result = self.lastResult
+      colIndex = result.colIndex
 
       # Always store lastRunLocal; if the check result doesn't have it, use current time
-      if COL_LOCAL_UTC in colIndex:
-         lastRunLocal = resultRows[0][colIndex[COL_LOCAL_UTC]]
+      if COL_LOCAL_UTC in colIndex and result.rowCount > 0:
+         lastRunLocal = result.firstRow[colIndex[COL_LOCAL_UTC]]
       else:
          lastRunLocal = datetime.utcnow()
       self.state["lastRunLocal"] = lastRunLocal
 
       # Only store lastRunServer if we have it in the check result; consider time-series queries
-      if len(resultRows) > 0:
+      if result.rowCount > 0:
          if COL_TIMESERIES_UTC in colIndex:
-            self.state["lastRunServer"] = resultRows[-1][colIndex[COL_TIMESERIES_UTC]]
+            self.state["lastRunServer"] = result.lastRow[colIndex[COL_TIMESERIES_UTC]]
          elif COL_SERVER_UTC in colIndex:
-            self.state["lastRunServer"] = resultRows[0][colIndex[COL_SERVER_UTC]]
+            self.state["lastRunServer"] = result.firstRow[colIndex[COL_SERVER_UTC]]
 
-      self.state["lastResultHash"] = self._calculateResultHash(resultRows)
+      # Remember whether the result is identical to the one of the previous run
+      resultHash = result.getHash()
+      self.resultUnchanged = resultHash is not None and resultHash == self.state.get("lastResultHash", None)
+      self.state["lastResultHash"] = resultHash
       self.tracer.info("[%s] internal state successfully updated" % self.fullName)
       return True
 
@@ -357,11 +604,6 @@ class saphanaProviderCheck(ProviderCheck):
       # Marking which column will be used for TimeGenerated
       self.colTimeGenerated = COL_TIMESERIES_UTC if isTimeSeries else COL_SERVER_UTC
 
-      # Find and connect to HANA server
-      (connection, cursor, host) = self._getHanaConnection()
-      if not connection:
-         raise Exception("Unable to get HANA connection")
-
       # Prepare SQL statement
       preparedSql = self._prepareSql(sql,
                                      isTimeSeries,
@@ -369,37 +611,71 @@ class saphanaProviderCheck(ProviderCheck):
       if not preparedSql:
          raise Exception("Unable to prepare SQL statement")
 
-      # Execute SQL statement
-      self.tracer.debug("[%s] executing SQL statement %s" % (self.fullName,
-                                                             preparedSql))
-      cursor.execute(preparedSql)
-      colIndex = {col[0] : idx for idx, col in enumerate(cursor.description)}
-      resultRows = cursor.fetchall()
-
-      self.lastResult = (colIndex, resultRows)
-      self.tracer.debug("[%s] lastResult.colIndex=%s" % (self.fullName,
-                                                         colIndex))
-      self.tracer.debug("[%s] lastResult.resultRows=%s " % (self.fullName,
-                                                            resultRows))
+      # Execute SQL statement, either together with the other checks of the same frequency or on its own
+      collectedTime = None
+      if self.providerInstance.groupedCollection:
+         (self.lastResult, collectedTime) = self.providerInstance.collectSqlResult(self, preparedSql)
+      else:
+         self.lastResult = self._executeSqlStatements([(self, preparedSql, self.colTimeGenerated)])[0]
+      self.tracer.debug("[%s] lastResult.colIndex=%s, rowCount=%d" % (self.fullName,
+                                                                     self.lastResult.colIndex,
+                                                                     self.lastResult.rowCount))
 
       # Update internal state
       if not self.updateState():
          raise Exception("Failed to update state")
-
-      # Disconnect from HANA server to avoid memory leaks
-      self.tracer.debug("[%s] closing HANA connection" % self.fullName)
-      connection.close()
+      if collectedTime and COL_LOCAL_UTC not in self.lastResult.colIndex:
+         # Keep all checks of a collection group on the same schedule
+         self.state["lastRunLocal"] = collectedTime
 
       self.tracer.info("[%s] successfully ran SQL for check" % self.fullName)
 
+   # Run one or more prepared SQL statements (of this or other checks) back-to-back on a single HANA connection
+   # Takes (check, preparedSql, colTimeGenerated) and returns one result per statement; the first statement
+   # has to succeed, for any subsequent statement that fails, the exception is returned instead
+   def _executeSqlStatements(self,
+                             statements: List[Tuple[ProviderCheck, str, str]]) -> List:
+      # Find and connect to HANA server
+      (connection, cursor, host) = self._getHanaConnection()
+      if not connection:
+         raise Exception("Unable to get HANA connection")
+
+      results = []
+      discardConnection = True
+      try:
+         for (check, preparedSql, colTimeGenerated) in statements:
+            self.tracer.debug("[%s] executing SQL statement %s" % (check.fullName,
+                                                                   preparedSql))
+            try:
+               cursor.execute(preparedSql)
+               colIndex = {col[0] : idx for idx, col in enumerate(cursor.description)}
+               # Rows are fetched in batches and encoded right away
+               result = check._createSqlResult(colIndex, colTimeGenerated)
+               result.fetchFrom(cursor)
+               results.append(result)
+            except Exception as e:
+               if not results:
+                  raise
+               self.tracer.warning("[%s] grouped SQL statement failed (%s)" % (self.fullName,
+                                                                               e))
+               results.append(e)
+         cursor.close()
+         discardConnection = any(isinstance(r, Exception) for r in results)
+      finally:
+         # Hand the connection back to the pool (connections that ran into an error are dropped)
+         self.tracer.debug("[%s] releasing HANA connection" % self.fullName)
+         self.providerInstance.connectionPool.release(connection,
+                                                      host,
+                                                      discard = discardConnection)
+      return results
+
    # Parse result of the query against M_LANDSCAPE_HOST_CONFIGURATION and store it internally
    def _actionParseHostConfig(self) -> None:
       self.tracer.info("[%s] parsing HANA host configuration and storing it in provider state" % self.fullName)
 
       # Iterate through the results and store a mini version in the global provider state
       hosts = []
-      (colIndex, resultRows) = self.lastResult
-      for r in resultRows:
+      for r in self.lastResult.rows:
          host = {
             "host": r["HOST"],
             "ip": r["IP"],
@@ -407,7 +683,12 @@ class saphanaProviderCheck(ProviderCheck):
             "role": r["INDEXSERVER_ACTUAL_ROLE"]
             }
          hosts.append(host)
-      self.providerInstance.state["hostConfig"] = hosts
+      with self.providerInstance.stateLock:
+         if hosts != self.providerInstance.state.get("hostConfig", None):
+            # Active host or role has changed (e.g. after a takeover), so pooled connections may point to the wrong node
+            self.tracer.info("[%s] HANA host configuration has changed, rebuilding connection pool" % self.fullName)
+            self.providerInstance.connectionPool.reset()
+         self.providerInstance.state["hostConfig"] = hosts
       self.tracer.debug("hosts=%s" % hosts)
 
    # Probe SQL Connection to all nodes in HANA landscape
@@ -423,11 +704,11 @@ class saphanaProviderCheck(ProviderCheck):
       self.colTimeGenerated = COL_LOCAL_UTC
 
       # This check requires the HANA host configuration to be run first
-      if "hostConfig" not in self.providerInstance.state:
+      hostConfig = self.providerInstance.state.get("hostConfig", None)
+      if hostConfig is None:
          raise Exception("HANA host config check has not been executed yet")
 
       # Iterate through all hosts (alphabetical order) from the host config
-      hostConfig = self.providerInstance.state["hostConfig"]
       hostsToProbe = [h["host"] for h in hostConfig]
       probeResults = []
       for host in sorted(hostsToProbe):
@@ -494,15 +775,16 @@ class saphanaProviderCheck(ProviderCheck):
       # Store complete probing result internally and update state
       self.tracer.debug("[%s] probeResults=%s" % (self.fullName,
                                                   probeResults))
-      self.lastResult = (
+      self.lastResult = self._createSqlResult(
             {
                COL_LOCAL_UTC: 0,
                "HOST": 1,
                "SUCCESS": 2,
                "LATENCY_MS": 3,
             },
-            probeResults
+            self.colTimeGenerated
          )
+      self.lastResult.addRows(probeResults)
 
       # Update internal state
       if not self.updateState():
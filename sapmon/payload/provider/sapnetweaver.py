@@ -1,4 +1,7 @@
 # Python modules
+import asyncio
+import concurrent.futures
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
 import logging
 from datetime import datetime, timedelta, timezone
@@ -13,13 +16,18 @@ from aiops.aiopshelper import *
 from aiops.aiopshelperfactory import *
 from const import *
 from helper.azure import AzureStorageAccount
+from helper.cache import TtlCache
 from helper.context import *
+from helper.endpointhealth import EndpointHealthRegistry
+from helper.serializer import RecordBuffer, RecordSerializer
 from helper.tools import *
 from provider.base import ProviderInstance, ProviderCheck
 from netweaver.metricclientfactory import NetWeaverMetricClient, NetWeaverSoapClientBase, ServerTimeClientBase, MetricClientFactory
 from netweaver.rfcsdkinstaller import PATH_RFC_SDK_INSTALL, SapRfcSdkInstaller
 from netweaver.soapclient import NetWeaverSoapClient
 from netweaver.soapclientvalidator import SoapClientValidator
+from netweaver.soapeventloop import SoapEventLoop
+from netweaver.fanoutqueue import LimitedFanOutQueue
 from typing import Dict
 
 # Suppress SSLError warning due to missing SAP server certificate
@@ -33,12 +41,28 @@ MINIMUM_RFC_INSTALL_RETRY_INTERVAL = timedelta(minutes=30)
 # SAPServerTimezone cache expiration time
 SERVER_TIMEZONE_CACHE_EXPIRATIION = timedelta(seconds=60)
 
+# SOAP API calls to the instances of an SAP system are fanned out to a dedicated thread pool shared by all
+# SAP NetWeaver providers, with a limit on concurrent calls per SID and an overall deadline per check run
+SOAP_FANOUT_MAX_WORKERS = 32
+SOAP_FANOUT_MAX_CONCURRENCY_PER_SID = 8
+SOAP_FANOUT_DEADLINE_SECS = 45
+
+# SWNC query windows end on a multiple of this interval since midnight (server time), so that the SWNC checks
+# of a SID that become due in the same tick ask for the same window and share one SWNC_GET_WORKLOAD_SNAPSHOT call
+SWNC_QUERY_WINDOW_ALIGNMENT_SECS = 60
+
 class sapNetweaverProviderInstance(ProviderInstance):
     # static / class variables to enforce singleton behavior around rfc sdk installation attempts across all 
     # instances of SAP Netweaver provider
     _isRfcInstalled = None
     _rfcInstallerLock = Lock()
 
+    # static / class variables for the SOAP API fan-out shared across all instances of SAP Netweaver provider
+    _soapFanOutExecutor = None
+    _soapFanOutQueues = {}
+    _soapFanOutAsyncSemaphores = {}
+    _soapFanOutLock = Lock()
+
     def __init__(self,
                 tracer: logging.Logger,
                 ctx: Context,
@@ -64,7 +88,9 @@ class sapNetweaverProviderInstance(ProviderInstance):
         self._soapClientCache = {}
         
         # cache timezone so we can re-use them until the cache expiration time in the same process
-        self._timeZoneCache = {'timeZone':None}
+        self._timeZoneCache = TtlCache("serverTimeZone",
+                                       ttlSecs=SERVER_TIMEZONE_CACHE_EXPIRATIION.total_seconds(),
+                                       maxEntries=1)
         
         # the RFC SDK does not allow client to specify a timeout and in fact appears to have a connection timeout of 60 secs. 
         # In cases where RFC calls timeout due to some misconfiguration, multiple retries can lead to metric gaps of several minutes.  
@@ -480,12 +506,13 @@ class sapNetweaverProviderInstance(ProviderInstance):
                      useCache: bool = True) -> list:
         # Use cached list of instances if available since they should not change within a single monitor run;
         # but if cache is not available or if caller explicitly asks to skip cache then make the SOAP call
-        if ('hostConfig' in self.state and 
-            self.state['hostConfig'] and
-            len(self.state['hostConfig']) > 0 and 
+        # (read the cached list only once, since concurrent checks of this provider may replace it)
+        cachedInstanceList = self.state.get('hostConfig', None)
+        if (cachedInstanceList and
+            len(cachedInstanceList) > 0 and 
             useCache):
             # self.tracer.debug("%s using cached list of system instances", self.logTag)
-            return self.filterInstancesByFeature(self.state['hostConfig'], filterFeatures=filterFeatures, filterType=filterType)
+            return self.filterInstancesByFeature(cachedInstanceList, filterFeatures=filterFeatures, filterType=filterType)
 
         self.tracer.info("%s getting list of system instances", self.logTag)
         startTime = time()
@@ -637,6 +664,37 @@ class sapNetweaverProviderInstance(ProviderInstance):
         # if for some reason we fail to call the message server, then we default to collector VM time
         return datetime.utcnow()
 
+    """
+    submit a SOAP API call for a single SAP instance to the shared fan-out thread pool;
+    at most SOAP_FANOUT_MAX_CONCURRENCY_PER_SID calls per SID are executed at the same time, further calls of the SID
+    wait in its fan-out queue (not in a pool thread), so a SID with many instances cannot starve the other SIDs
+    """
+    def submitSoapCall(self, func: Callable, *args) -> Future:
+        with sapNetweaverProviderInstance._soapFanOutLock:
+            if not sapNetweaverProviderInstance._soapFanOutExecutor:
+                sapNetweaverProviderInstance._soapFanOutExecutor = ThreadPoolExecutor(max_workers=SOAP_FANOUT_MAX_WORKERS,
+                                                                                      thread_name_prefix="soap")
+            queue = sapNetweaverProviderInstance._soapFanOutQueues.get(self.sapSid, None)
+            if not queue:
+                queue = LimitedFanOutQueue(sapNetweaverProviderInstance._soapFanOutExecutor, SOAP_FANOUT_MAX_CONCURRENCY_PER_SID)
+                sapNetweaverProviderInstance._soapFanOutQueues[self.sapSid] = queue
+        return queue.submit(func, *args)
+
+    """
+    schedule a coroutine for the SOAP API call of a single SAP instance on the shared SOAP event loop (asynchronous
+    SOAP clients); the same per-SID limit of concurrent calls applies as for submitSoapCall()
+    """
+    def submitSoapCoroutine(self, coroutineFunc: Callable, *args) -> Future:
+        sapSid = self.sapSid
+        async def runWithSemaphore():
+            # semaphores are only ever touched from the event loop thread, so no locking is needed
+            semaphore = sapNetweaverProviderInstance._soapFanOutAsyncSemaphores.get(sapSid, None)
+            if not semaphore:
+                semaphore = asyncio.BoundedSemaphore(SOAP_FANOUT_MAX_CONCURRENCY_PER_SID)
+                sapNetweaverProviderInstance._soapFanOutAsyncSemaphores[sapSid] = semaphore
+            return await coroutineFunc(semaphore, *args)
+        return SoapEventLoop().submit(runWithSemaphore())
+
     """
     private method to return default provider hostname config (what customer provided at time netweaver provided was added)
     or a fully fleshed out list of <hostname / instance # / https:Port> tuples based on a previous cached call to getInstances()
@@ -644,9 +702,9 @@ class sapNetweaverProviderInstance(ProviderInstance):
     def _getHosts(self) -> list:
         # Fetch last known list from storage. If storage does not have list, use provided
         # hostname and instanceNr
-        if ('hostConfig' not in self.state or 
-            not self.state['hostConfig'] or 
-            len(self.state['hostConfig']) == 0):
+        currentHostConfig = self.state.get('hostConfig', None)
+        if (not currentHostConfig or 
+            len(currentHostConfig) == 0):
             self.tracer.info("%s no host config persisted yet, using user-provided host name and instance nr", self.logTag)
             hosts = [(self.sapHostName,
                       self.sapInstanceNr,
@@ -654,7 +712,6 @@ class sapNetweaverProviderInstance(ProviderInstance):
                       None)]
         else:
             self.tracer.info("%s fetching last known host config", self.logTag)
-            currentHostConfig = self.state['hostConfig']
             hosts = [(hostConfig['hostname'], 
                       hostConfig['instanceNr'], 
                       "https" if (hostConfig['httpsPort'] and hostConfig['httpsPort'] != "0") else "http", 
@@ -840,24 +897,16 @@ class sapNetweaverProviderInstance(ProviderInstance):
     """
     def getRfcServerTimeZone(self):
         logTag = "[%s][%s][ServerTimeZone]" % (self.fullName, self.sapSid)
-        # check if cache dictionary has values initialized and  return the timezone
-        if(self._timeZoneCache['timeZone'] != None and self._timeZoneCache['expirationDateTime'] > datetime.utcnow()):
-            self.tracer.info("%s Return cached server timezone: ", self._timeZoneCache['expirationDateTime'])
-            return (self._timeZoneCache['timeZone'])
-        else:
-            # initialize timezone variables and cache expiration in a dictionary
+        def loadServerTimeZone():
             client = self.getRfcClient(logTag=logTag)
             sapServerTimeZone = client.getLocalTimeZone(logTag=logTag)
-            # if there is an exception with the previous method call return self._timeZoneCache['timeZone'] as None 
-            if sapServerTimeZone != None:
-                self._timeZoneCache['timeZone'] = sapServerTimeZone['ES_TTZZ']
-                self._timeZoneCache['expirationDateTime'] = datetime.utcnow() + SERVER_TIMEZONE_CACHE_EXPIRATIION
-                self.tracer.info("%s Caching Server timezone at: ", self._timeZoneCache['expirationDateTime'])
-            else:
-                # re-initialize the cache variable when self._timeZoneCache['expirationDateTime'] has expired
-                # and also client.getLocalTimeZone(logTag=logTag) has created an exception
-                self._timeZoneCache['timeZone'] = None
-        return self._timeZoneCache['timeZone']
+            # if there is an exception with the previous method call, nothing gets cached and None is returned
+            if sapServerTimeZone is None:
+                return None
+            self.tracer.info("%s Caching Server timezone for %d seconds", logTag, SERVER_TIMEZONE_CACHE_EXPIRATIION.total_seconds())
+            return sapServerTimeZone['ES_TTZZ']
+        # concurrent checks share a single RFC call while the timezone is not cached
+        return self._timeZoneCache.getOrLoad('timeZone', loadServerTimeZone)
 
 ###########################
 class sapNetweaverProviderCheck(ProviderCheck):
@@ -879,6 +928,7 @@ class sapNetweaverProviderCheck(ProviderCheck):
         super().__init__(provider, **kwargs)
         self.lastRunLocal = None
         self.lastRunServer = None
+        self.serializedResult = None
 
         # provider check common logging prefix
         self.logTag = "[%s][%s]" % (self.fullName, self.providerInstance.sapSid)
@@ -1129,7 +1179,8 @@ class sapNetweaverProviderCheck(ProviderCheck):
             (startTime, endTime) = client.getQueryWindow(lastRunServerTime=self.lastRunServer,
                                                          minimumRunIntervalSecs=self.frequencySecs,
                                                          serverTimeZone=sapServerTimeZone,
-                                                         logTag=self.logTag)
+                                                         logTag=self.logTag,
+                                                         alignmentSecs=SWNC_QUERY_WINDOW_ALIGNMENT_SECS)
 
             self.lastResult = client.getSwncWorkloadMetrics(startDateTime=startTime, endDateTime=endTime, logTag=self.logTag)
 
@@ -1182,7 +1233,8 @@ class sapNetweaverProviderCheck(ProviderCheck):
             (startTime, endTime) = client.getQueryWindow(lastRunServerTime=self.lastRunServer, 
                                                          minimumRunIntervalSecs=self.frequencySecs,
                                                          serverTimeZone=sapServerTimeZone,
-                                                         logTag=self.logTag)
+                                                         logTag=self.logTag,
+                                                         alignmentSecs=SWNC_QUERY_WINDOW_ALIGNMENT_SECS)
 
             self.lastResult = client.getSwncMemoryMetrics(startDateTime=startTime, endDateTime=endTime, logTag=self.logTag)
 
@@ -1236,7 +1288,8 @@ class sapNetweaverProviderCheck(ProviderCheck):
             (startTime, endTime) = client.getQueryWindow(lastRunServerTime=self.lastRunServer, 
                                                          minimumRunIntervalSecs=self.frequencySecs,
                                                          serverTimeZone=sapServerTimeZone,
-                                                         logTag=self.logTag)
+                                                         logTag=self.logTag,
+                                                         alignmentSecs=SWNC_QUERY_WINDOW_ALIGNMENT_SECS)
 
             self.lastResult = client.getSwncTransactionMetrics(startDateTime=startTime, endDateTime=endTime, logTag=self.logTag)
 
@@ -1289,7 +1342,8 @@ class sapNetweaverProviderCheck(ProviderCheck):
             (startTime, endTime) = client.getQueryWindow(lastRunServerTime=self.lastRunServer, 
                                                          minimumRunIntervalSecs=self.frequencySecs,
                                                          serverTimeZone=sapServerTimeZone,
-                                                         logTag=self.logTag)
+                                                         logTag=self.logTag,
+                                                         alignmentSecs=SWNC_QUERY_WINDOW_ALIGNMENT_SECS)
 
             self.lastResult = client.getSwncUserMetrics(startDateTime=startTime, endDateTime=endTime, logTag=self.logTag)
 
@@ -1342,7 +1396,8 @@ class sapNetweaverProviderCheck(ProviderCheck):
             (startTime, endTime) = client.getQueryWindow(lastRunServerTime=self.lastRunServer, 
                                                          minimumRunIntervalSecs=self.frequencySecs,
                                                          serverTimeZone=sapServerTimeZone,
-                                                         logTag=self.logTag)
+                                                         logTag=self.logTag,
+                                                         alignmentSecs=SWNC_QUERY_WINDOW_ALIGNMENT_SECS)
 
             self.lastResult = client.getSwncRfcUsageMetrics(startDateTime=startTime, endDateTime=endTime, logTag=self.logTag)
 
@@ -1860,55 +1915,47 @@ class sapNetweaverProviderCheck(ProviderCheck):
             self.tracer.info("%s no instances that support this API: %s", self.logTag, apiName)
 
         # keep track of total instances called for this API and total errors
-        totalCount = 0
+        totalCount = len(sapInstances)
         errorCount = 0
-
-        for instance in sapInstances:
-            totalCount += 1
-
-            # default to https unless the httpsPort was not defined, in which case fallback to http
-            httpProtocol = "https"
-            port = instance['httpsPort']
-            if ((not port) or port == "0"):
-                # fallback to http port instead
-                httpProtocol = "http"
-                port = instance['httpPort']
-
-            results = []
-            try:
-                client = MetricClientFactory.getSoapMetricClientForHostAndPort(tracer=self.tracer,
-                                                                               logTag=logTag,
-                                                                               sapSid=self.providerInstance.sapSid,
-                                                                               sapHostName=instance['hostname'],
-                                                                               sapSubdomain=self.providerInstance.sapSubdomain,
-                                                                               httpProtocol=httpProtocol,
-                                                                               httpPort=port,
-                                                                               useCache=True)
-
-                # invoke SOAP API for this instance client
-                results = clientFunc(logTag, client)
-
-                # if user provided a post-processing method to sanitize raw results, then invoke
-                if sanitizeResultsFunc:
-                    results = sanitizeResultsFunc(results)
-
-                # decorate results with common metric schema properties
-                if len(results) > 0:
-                    for result in results:
-                        result['hostname'] = instance['hostname']
-                        result['instanceNr'] = instance['instanceNr']
-                        result['subdomain'] = self.providerInstance.sapSubdomain
-                        result['timestamp'] = currentTimestamp
-                        result['serverTimestamp'] = self.lastRunServer.isoformat()
-                        result['SID'] = self.providerInstance.sapSid
-                    allResults.extend(results)
-
-            except Exception as e:
+        instanceLatencies = {}
+
+        # call the SOAP API on all instances concurrently; instances that have not responded by the deadline are
+        # counted as errors, and results are merged in the order of the instance list so the output is deterministic
+        deadline = startTime + min(SOAP_FANOUT_DEADLINE_SECS, self.frequencySecs)
+        # with asynchronous SOAP clients, the calls are executed on the shared SOAP event loop instead of the thread pool
+        if MetricClientFactory.isAsyncSoapClientEnabled():
+            submitFunc, callFunc = self.providerInstance.submitSoapCoroutine, self._callSoapApiForInstanceAsync
+        else:
+            submitFunc, callFunc = self.providerInstance.submitSoapCall, self._callSoapApiForInstance
+        futures = [submitFunc(callFunc,
+                              deadline,
+                              logTag,
+                              apiName,
+                              instance,
+                              clientFunc,
+                              sanitizeResultsFunc,
+                              currentTimestamp) for instance in sapInstances]
+        concurrent.futures.wait(futures, timeout=max(0, deadline - time()))
+
+        for instance, future in zip(sapInstances, futures):
+            instanceKey = "%s_%s" % (instance['hostname'], instance['instanceNr'])
+            # cancel() only prevents calls that have not started yet; a running call keeps its slot of the SID until
+            # it has really finished, and its (late) result is ignored
+            if not future.done() or future.cancelled():
+                future.cancel()
+                errorCount += 1
+                instanceLatencies[instanceKey] = None
+                self.tracer.error("%s SOAP API %s for host %s did not complete within %d secs",
+                                  logTag, apiName, instanceKey, deadline - startTime)
+                continue
+            results, latencyMs = future.result()
+            instanceLatencies[instanceKey] = latencyMs
+            if results is None:
                 errorCount += 1
-                # log the fully qualified hostname and exception
-                wsdlUrl = NetWeaverSoapClient._getFullyQualifiedWsdl(instance['hostname'], self.providerInstance.sapSubdomain, httpProtocol, port)
-                self.tracer.error("%s exception trying to call SOAP API %s url: %s, %s", logTag, apiName, wsdlUrl, e, exc_info=True)
                 continue
+            allResults.extend(results)
+
+        self.tracer.info("%s SOAP API: %s latency per instance [ms]: %s", logTag, apiName, json.dumps(instanceLatencies))
 
         self.lastResult = allResults
 
@@ -1920,6 +1967,175 @@ class sapNetweaverProviderCheck(ProviderCheck):
             
         return allResults
 
+    """
+    invoke SOAP API for a single SAP instance (executed on the SOAP fan-out thread pool once a slot of the SID is free);
+    returns the decorated results (None if the call failed) and the latency of the call in ms
+    """
+    def _callSoapApiForInstance(self,
+                                deadline: float,
+                                logTag: str,
+                                apiName: str,
+                                instance: Dict,
+                                clientFunc: Callable[[str, NetWeaverSoapClientBase], list],
+                                sanitizeResultsFunc: Callable[[list], list],
+                                currentTimestamp: str) -> tuple:
+        # the call may have waited in the fan-out queue of the SID beyond the deadline of the check
+        if time() >= deadline:
+            self.tracer.error("%s SOAP API %s for host %s not started before deadline", logTag, apiName, instance['hostname'])
+            return None, None
+        httpProtocol, port = self._getSoapProtocolAndPort(instance)
+        endpoint = self._getAvailableSoapEndpoint(logTag, apiName, instance, httpProtocol, port)
+        if not endpoint:
+            return None, None
+        startTime = time()
+        try:
+            client = self._getSoapClientForInstance(logTag, instance, httpProtocol, port)
+
+            # invoke SOAP API for this instance client
+            try:
+                results = clientFunc(logTag, client)
+            except Exception:
+                EndpointHealthRegistry(self.tracer).recordFailure(endpoint)
+                raise
+            EndpointHealthRegistry(self.tracer).recordSuccess(endpoint)
+            return self._decorateSoapResults(results, instance, sanitizeResultsFunc, currentTimestamp), TimeUtils.getElapsedMilliseconds(startTime)
+        except Exception as e:
+            self._logSoapApiError(logTag, apiName, instance, httpProtocol, port, e)
+            return None, TimeUtils.getElapsedMilliseconds(startTime)
+
+    """
+    invoke SOAP API for a single SAP instance with an asynchronous SOAP client (executed on the shared SOAP event loop);
+    the same client function is used as for the synchronous client, but applied to the coroutine versions of the API methods
+    """
+    async def _callSoapApiForInstanceAsync(self,
+                                           semaphore: asyncio.BoundedSemaphore,
+                                           deadline: float,
+                                           logTag: str,
+                                           apiName: str,
+                                           instance: Dict,
+                                           clientFunc: Callable[[str, NetWeaverSoapClientBase], list],
+                                           sanitizeResultsFunc: Callable[[list], list],
+                                           currentTimestamp: str) -> tuple:
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=max(0, deadline - time()))
+        except asyncio.TimeoutError:
+            self.tracer.error("%s SOAP API %s for host %s not started before deadline", logTag, apiName, instance['hostname'])
+            return None, None
+        # if the fan-out gives up on this call after the deadline, the call is cancelled; the shield keeps the actual
+        # call running (parts of it run on executor threads that cannot be interrupted), so that it only releases
+        # its slot of the SID once it has really finished
+        return await asyncio.shield(self._runSoapApiForInstanceAsync(semaphore,
+                                                                     logTag,
+                                                                     apiName,
+                                                                     instance,
+                                                                     clientFunc,
+                                                                     sanitizeResultsFunc,
+                                                                     currentTimestamp))
+
+    """
+    execute the SOAP API call of _callSoapApiForInstanceAsync() after it has acquired a slot of the SID,
+    and release the slot when done; the endpoint health is only checked here, since checking it claims the probe
+    of an endpoint whose backoff has expired, so the endpoint must then actually be called
+    """
+    async def _runSoapApiForInstanceAsync(self,
+                                          semaphore: asyncio.BoundedSemaphore,
+                                          logTag: str,
+                                          apiName: str,
+                                          instance: Dict,
+                                          clientFunc: Callable[[str, NetWeaverSoapClientBase], list],
+                                          sanitizeResultsFunc: Callable[[list], list],
+                                          currentTimestamp: str) -> tuple:
+        try:
+            httpProtocol, port = self._getSoapProtocolAndPort(instance)
+            endpoint = self._getAvailableSoapEndpoint(logTag, apiName, instance, httpProtocol, port)
+            if not endpoint:
+                return None, None
+            startTime = time()
+            try:
+                # creating a client may have to fetch the WSDL, which is done synchronously, so keep it off the event loop
+                loop = asyncio.get_event_loop()
+                client = await loop.run_in_executor(None, self._getSoapClientForInstance, logTag, instance, httpProtocol, port)
+
+                # invoke SOAP API for this instance client
+                try:
+                    if hasattr(client, 'aio'):
+                        results = await clientFunc(logTag, client.aio)
+                    else:
+                        results = await loop.run_in_executor(None, clientFunc, logTag, client)
+                except Exception:
+                    EndpointHealthRegistry(self.tracer).recordFailure(endpoint)
+                    raise
+                EndpointHealthRegistry(self.tracer).recordSuccess(endpoint)
+                return self._decorateSoapResults(results, instance, sanitizeResultsFunc, currentTimestamp), TimeUtils.getElapsedMilliseconds(startTime)
+            except Exception as e:
+                self._logSoapApiError(logTag, apiName, instance, httpProtocol, port, e)
+                return None, TimeUtils.getElapsedMilliseconds(startTime)
+        finally:
+            semaphore.release()
+
+    """
+    return http protocol and port to use for the SOAP API of an SAP instance
+    """
+    def _getSoapProtocolAndPort(self, instance: Dict) -> tuple:
+        # default to https unless the httpsPort was not defined, in which case fallback to http
+        httpProtocol = "https"
+        port = instance['httpsPort']
+        if ((not port) or port == "0"):
+            # fallback to http port instead
+            httpProtocol = "http"
+            port = instance['httpPort']
+        return httpProtocol, port
+
+    """
+    return the endpoint name of the SOAP API of an SAP instance, or None if the endpoint has recently failed
+    and is skipped until its backoff has expired
+    """
+    def _getAvailableSoapEndpoint(self, logTag: str, apiName: str, instance: Dict, httpProtocol: str, port: int) -> str:
+        endpoint = NetWeaverSoapClient._getFullyQualifiedWsdl(instance['hostname'], self.providerInstance.sapSubdomain, httpProtocol, port)
+        if not EndpointHealthRegistry(self.tracer).isAvailable(endpoint):
+            self.tracer.warning("%s skipping SOAP API %s for unavailable url: %s", logTag, apiName, endpoint)
+            return None
+        return endpoint
+
+    # endpoint health has already been checked by the caller
+    def _getSoapClientForInstance(self, logTag: str, instance: Dict, httpProtocol: str, port: int) -> NetWeaverSoapClientBase:
+        return MetricClientFactory.getSoapMetricClientForHostAndPort(tracer=self.tracer,
+                                                                     logTag=logTag,
+                                                                     sapSid=self.providerInstance.sapSid,
+                                                                     sapHostName=instance['hostname'],
+                                                                     sapSubdomain=self.providerInstance.sapSubdomain,
+                                                                     httpProtocol=httpProtocol,
+                                                                     httpPort=port,
+                                                                     useCache=True,
+                                                                     checkEndpointHealth=False)
+
+    """
+    sanitize raw SOAP API results of an SAP instance and decorate them with common metric schema properties
+    """
+    def _decorateSoapResults(self,
+                             results: list,
+                             instance: Dict,
+                             sanitizeResultsFunc: Callable[[list], list],
+                             currentTimestamp: str) -> list:
+        # if user provided a post-processing method to sanitize raw results, then invoke
+        if sanitizeResultsFunc:
+            results = sanitizeResultsFunc(results)
+
+        # decorate results with common metric schema properties
+        for result in results:
+            result['hostname'] = instance['hostname']
+            result['instanceNr'] = instance['instanceNr']
+            result['subdomain'] = self.providerInstance.sapSubdomain
+            result['timestamp'] = currentTimestamp
+            result['serverTimestamp'] = self.lastRunServer.isoformat()
+            result['SID'] = self.providerInstance.sapSid
+        return results
+
+    def _logSoapApiError(self, logTag: str, apiName: str, instance: Dict, httpProtocol: str, port: int, e: Exception) -> None:
+        # log the fully qualified hostname and exception
+        wsdlUrl = NetWeaverSoapClient._getFullyQualifiedWsdl(instance['hostname'], self.providerInstance.sapSubdomain, httpProtocol, port)
+        self.tracer.error("%s exception trying to call SOAP API %s url: %s, %s", logTag, apiName, wsdlUrl, e, exc_info=True)
+
     """
     Method to parse the value based on the key provided and set the values with None value to empty string ''
     """
@@ -2046,14 +2262,17 @@ class sapNetweaverProviderCheck(ProviderCheck):
             processedSapAzResourceMapping[armType][instanceName] = value
 
         #Replce missing azResourceId values with old value in azResourceConfig. (values could be missing if required vnets are not added to key vault secret)
-        self.providerInstance.state.setdefault("azResourceConfig", {})
-        for resourceType in processedSapAzResourceMapping:
-            currentMapping = self.providerInstance.state.get("azResourceConfig").get(resourceType)
-            for resource in processedSapAzResourceMapping[resourceType]:
-                if(not processedSapAzResourceMapping[resourceType][resource].get("azResourceId") and resource in currentMapping):
-                    processedSapAzResourceMapping[resourceType][resource]["azResourceId"] = currentMapping[resource]["azResourceId"]
-            self.providerInstance.state["azResourceConfig"][resourceType] = processedSapAzResourceMapping[resourceType]
-        self.tracer.info("%s SAP Host - Azure Resource ID mapping: %s", self.logTag, self.providerInstance.state["azResourceConfig"])
+        # The mapping is replaced as a whole (copy-on-write), so concurrent state snapshots never see a partial update
+        with self.providerInstance.stateLock:
+            azResourceConfig = dict(self.providerInstance.state.get("azResourceConfig", {}))
+            for resourceType in processedSapAzResourceMapping:
+                currentMapping = azResourceConfig.get(resourceType, {})
+                for resource in processedSapAzResourceMapping[resourceType]:
+                    if(not processedSapAzResourceMapping[resourceType][resource].get("azResourceId") and resource in currentMapping):
+                        processedSapAzResourceMapping[resourceType][resource]["azResourceId"] = currentMapping[resource]["azResourceId"]
+                azResourceConfig[resourceType] = processedSapAzResourceMapping[resourceType]
+            self.providerInstance.state["azResourceConfig"] = azResourceConfig
+        self.tracer.info("%s SAP Host - Azure Resource ID mapping: %s", self.logTag, azResourceConfig)
         return True
 
     """
@@ -2077,17 +2296,34 @@ class sapNetweaverProviderCheck(ProviderCheck):
         mergedDataFrame = merge(dataFrame1, dataFrame2, on = key, how = 'left')
         return mergedDataFrame.to_dict('records')
 
-    def generateJsonString(self) -> str:
+    """
+    encode the last result into compact JSON records, adding the fields that are the same for all records
+    """
+    def _serializeResult(self) -> RecordBuffer:
         self.tracer.info("%s converting result to json string", self.logTag)
-        if self.lastResult is not None and len(self.lastResult) != 0:
-            for result in self.lastResult:
-                result['SAPMON_VERSION'] = PAYLOAD_VERSION
-                result['PROVIDER_INSTANCE'] = self.providerInstance.name
-                result['METADATA'] = self.providerInstance.metadata
-    
-        resultJsonString = json.dumps(self.lastResult, sort_keys=True, indent=4, cls=JsonEncoder)
-        self.tracer.debug("%s resultJson=%s", self.logTag, str(resultJsonString))
-        return resultJsonString
+        constantFields = {
+            'SAPMON_VERSION': PAYLOAD_VERSION,
+            'PROVIDER_INSTANCE': self.providerInstance.name,
+            'METADATA': self.providerInstance.metadata
+        }
+        self.serializedResult = RecordSerializer(constantFields).serialize(self.lastResult)
+        self.tracer.debug("%s %d result records in %d JSON chunks", self.logTag,
+                          len(self.serializedResult), len(self.serializedResult.getJsonChunks()))
+        return self.serializedResult
+
+    def generateJsonString(self) -> str:
+        return self._serializeResult().getJsonString()
+
+    def generateJsonChunks(self) -> List[str]:
+        return self._serializeResult().getJsonChunks()
+
+    """
+    return the records of the last result as they have been encoded for ingestion
+    """
+    def getResultRecords(self) -> Optional[List[str]]:
+        if self.serializedResult is None:
+            return None
+        return self.serializedResult.records
 
     def updateState(self) -> bool:
         self.tracer.info("%s updating internal state", self.logTag)
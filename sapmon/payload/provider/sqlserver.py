@@ -1,5 +1,4 @@
 # Python modules
-import hashlib
 import json
 import logging
 import re
@@ -10,9 +9,11 @@ import pyodbc
 from const import *
 from helper.azure import *
 from helper.context import *
+from helper.endpointhealth import EndpointHealthRegistry
+from helper.sqlresult import SqlResult
 from helper.tools import *
 from provider.base import ProviderInstance, ProviderCheck
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 ###############################################################################
 
@@ -131,63 +132,60 @@ class MSSQLProviderCheck(ProviderCheck):
    def _getSqlConnection(self):
       self.tracer.info("[%s] establishing connection with sql instance" % self.fullName)
 
+      # Skip the instance if it has recently failed, until its backoff has expired
+      endpointHealth = EndpointHealthRegistry(self.tracer)
+      endpoint = EndpointHealthRegistry.getEndpointName("mssql", self.providerInstance.sqlHostname, self.providerInstance.sqlPort)
+      if not endpointHealth.isAvailable(endpoint):
+         self.tracer.warning("[%s] skipping unavailable sql instance %s" % (self.fullName, endpoint))
+         return (None)
+
       try:
         connection = self.providerInstance._establishSqlConnectionToHost()
         cursor = connection.cursor()
       except Exception as e:
+         endpointHealth.recordFailure(endpoint)
          self.tracer.warning("[%s] could not connect to sql (%s) " % (self.fullName,e))
          return (None)
+      endpointHealth.recordSuccess(endpoint)
       return (connection)
 
-   # Calculate the MD5 hash of a result set
-   def _calculateResultHash(self,
-                            resultRows: List[List[str]]) -> str:
-      self.tracer.info("[%s] calculating hash of SQL query result" % self.fullName)
-      if len(resultRows) == 0:
-         self.tracer.debug("[%s] result set is empty" % self.fullName)
-         return None
-      resultHash = None
-      try:
-         resultHash = hashlib.md5(str(resultRows).encode("utf-8")).hexdigest()
-         self.tracer.debug("resultHash=%s" % resultHash)
-      except Exception as e:
-         self.tracer.error("[%s] could not calculate result hash (%s)" % (self.fullName,e))
-      return resultHash
+   # Create an empty result for the statement of this check, given the columns it returns
+   def _createSqlResult(self,
+                        colIndex: Dict[str, int]) -> SqlResult:
+      # Unless it's the column mapped to TimeGenerated, remove internal fields
+      includedColumns = [c for c in colIndex.keys() if c == self.colTimeGenerated or not (c.startswith("_") or c == "DUMMY")]
+      constantFields = {
+         "SAPMON_VERSION": PAYLOAD_VERSION,
+         "PROVIDER_INSTANCE": self.providerInstance.name,
+         "METADATA": self.providerInstance.metadata
+      }
+      return SqlResult(colIndex,
+                       constantFields,
+                       includedColumns)
 
    # Generate a JSON-encoded string with the last query result
    # This string will be ingested into Log Analytics and Customer Analytics
    def generateJsonString(self) -> str:
-      self.tracer.info("[%s] converting SQL query result set into JSON format" % self.fullName)
-      logData = []
-
-      # Only loop through the result if there is one
-      if self.lastResult:
-         (colIndex, resultRows) = self.lastResult
-         
-         # Iterate through all rows of the last query result
-         for r in resultRows:
-            logItem = {
-               "SAPMON_VERSION": PAYLOAD_VERSION,
-               "PROVIDER_INSTANCE": self.providerInstance.name,
-               "METADATA": self.providerInstance.metadata
-            }
-            for c in colIndex.keys():
-               # Unless it's the column mapped to TimeGenerated, remove internal fields
-               if c != self.colTimeGenerated and (c.startswith("_") or c == "DUMMY"):
-                  continue
-               logItem[c] = r[colIndex[c]]
-            logData.append(logItem)
-
-      # Convert temporary dictionary into JSON string
-      try:
-         resultJsonString = json.dumps(logData, sort_keys=True, indent=4, cls=JsonEncoder)
-         self.tracer.debug("[%s] resultJson=%s" % (self.fullName,
-                                                   str(resultJsonString)))
-      except Exception as e:
-         self.tracer.error("[%s] could not format logItem=%s into JSON (%s)" % (self.fullName,
-                                                                                logItem,
-                                                                                e))
-      return resultJsonString
+      if not self.lastResult:
+         return "[]"
+      return self.lastResult.getJsonString()
+
+   # Return the last query result as (compact) JSON arrays that each fit into one ingestion request
+   # The result has already been encoded while it was fetched
+   def generateJsonChunks(self) -> List[str]:
+      if not self.lastResult:
+         return ["[]"]
+      resultJsonChunks = self.lastResult.getJsonChunks()
+      self.tracer.debug("[%s] %d result rows in %d JSON chunks" % (self.fullName,
+                                                                  self.lastResult.rowCount,
+                                                                  len(resultJsonChunks)))
+      return resultJsonChunks
+
+   # Return the records of the last query result, as they have been encoded while fetching
+   def getResultRecords(self) -> Optional[List[str]]:
+      if not self.lastResult:
+         return []
+      return self.lastResult.getRecords()
 
    # Prepare the SQL statement based on the check-specific query
    def _prepareSql(self,
@@ -198,7 +196,13 @@ class MSSQLProviderCheck(ProviderCheck):
 
       # If time series, insert time condition
       lastRunServer = self.state.get("lastRunServer", None)
-     
+      # Earlier versions stored lastRunServer as TIME_FORMAT_JSON string rather than as datetime
+      if isinstance(lastRunServer, str):
+         try:
+            lastRunServer = datetime.strptime(lastRunServer, TIME_FORMAT_JSON)
+         except ValueError:
+            pass
+
       # TODO(tniek) - make WHERE conditions for time series queries more flexible
       if not lastRunServer:
          self.tracer.info("[%s] time series query has never been run, applying initalTimespanSecs=%d" % (self.fullName, initialTimespanSecs))
@@ -266,14 +270,15 @@ class MSSQLProviderCheck(ProviderCheck):
          while cursor.description is None:
               cursor.nextset()	
          colIndex = {col[0] : idx for idx, col in enumerate(cursor.description)}
-         resultRows = cursor.fetchall()
+         # Rows are fetched in batches and encoded right away
+         result = self._createSqlResult(colIndex)
+         result.fetchFrom(cursor)
 
       except Exception as e:
          raise Exception("[%s] could not execute SQL (%s)" % (self.fullName,e))
 
-      self.lastResult = (colIndex, resultRows)
-      self.tracer.debug("[%s] lastResult.colIndex=%s" % (self.fullName,colIndex))
-      self.tracer.debug("[%s] lastResult.resultRows=%s " % (self.fullName,resultRows))
+      self.lastResult = result
+      self.tracer.debug("[%s] lastResult.colIndex=%s, rowCount=%d" % (self.fullName,colIndex,result.rowCount))
 
       # Update internal state
       if not self.updateState():
@@ -291,17 +296,23 @@ class MSSQLProviderCheck(ProviderCheck):
    # Update the internal state of this check (including last run times)
    def updateState(self) -> bool:
       self.tracer.info("[%s] updating internal state" % self.fullName)
-      (colIndex, resultRows) = self.lastResult
+      result = self.lastResult
+      colIndex = result.colIndex
 
       lastRunLocal = datetime.utcnow()
       self.state["lastRunLocal"] = lastRunLocal
 
       # Only store lastRunServer if we have it in the check result; consider time-series queries
-      if len(resultRows) > 0:
+      if result.rowCount > 0:
          if COL_TIMESERIES_UTC in colIndex:
-            self.state["lastRunServer"] = datetime.strftime(datetime.strptime(resultRows[-1][colIndex[COL_TIMESERIES_UTC]],"%Y-%m-%d %H:%M:%S"),"%Y-%m-%dT%H:%M:%S.000000Z")
+            self.state["lastRunServer"] = datetime.strptime(result.lastRow[colIndex[COL_TIMESERIES_UTC]], "%Y-%m-%d %H:%M:%S")
          elif COL_SERVER_UTC in colIndex:
-            self.state["lastRunServer"] = resultRows[0][colIndex[COL_SERVER_UTC]]
+            self.state["lastRunServer"] = result.firstRow[colIndex[COL_SERVER_UTC]]
+
+      # Remember whether the result is identical to the one of the previous run
+      resultHash = result.getHash()
+      self.resultUnchanged = resultHash is not None and resultHash == self.state.get("lastResultHash", None)
+      self.state["lastResultHash"] = resultHash
 
       self.tracer.info("[%s] internal state successfully updated" % self.fullName)
       return True
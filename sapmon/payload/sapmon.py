@@ -12,9 +12,11 @@ import argparse
 from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
 from datetime import date, datetime, timedelta, timezone
+import hashlib
 import json
 import os
 import re
+import signal
 import sys
 import threading
 from time import sleep, time
@@ -25,12 +27,20 @@ from typing import Dict
 # Payload modules
 from const import *
 from helper.azure import *
+from helper.cache import TtlCache
 from helper.context import Context
+from helper.endpointhealth import EndpointHealthRegistry
 from helper.tools import *
 from helper.tracing import *
+from helper.ingestion import LogAnalyticsIngestionPipeline
 from helper.providerfactory import *
+from helper.scheduler import CheckScheduler
+from helper.spool import IngestionSpool
+from helper.statestore import StateStore
 from helper.updateprofile import *
 from helper.updatefactory import *
+from netweaver.metricclientfactory import MetricClientFactory
+from netweaver.rfcconnectionpool import RfcConnectionPool
 
 # global flag to signal to any threads they should complete so python process can exit
 isShuttingDown = False 
@@ -38,53 +48,89 @@ isShuttingDown = False
 ###############################################################################
 
 def runCheck(check):
-   global ctx, tracer
+   global ctx, tracer, scheduler, ingestionPipeline
 
    wasSuccessful = True
    try:
       # Run all actions that are part of this check
       try:
-         resultJson = check.run()
+         resultJsonChunks = check.run()
       except Exception as e:
          # unhandled exception from check.run() means the action was not successful
          # and the resultJson string will either be uninitialized or will 
          tracer.error("[%s] failed check due to exception: %s", check.fullName, e, exc_info=True)
          wasSuccessful = False
 
-      # Persist updated internal state to provider state file, regardless of whether check succeeded or failed
-      check.providerInstance.writeState()
+      # Results of checks with ingestOnChangeOnly are skipped while they do not change
+      isIngestionRequired = wasSuccessful and check.isIngestionRequired()
+      try:
+         if isIngestionRequired:
+            # Spool result for (batched) ingestion into Log Analytics
+            # This needs to happen before the state is persisted, so no results are lost if ingestion fails
+            for resultJson in resultJsonChunks:
+               ingestionPipeline.submit(check.customLog,
+                                        resultJson,
+                                        check.colTimeGenerated)
+            check.markIngested()
+      finally:
+         # Persist updated internal state of this check, regardless of whether check succeeded or failed
+         check.providerInstance.writeState(check)
 
       if not wasSuccessful:
          # if check action failed, then we can return early since there will be no valid resultJson to emit to Log Analytics
          return
-
-      # Ingest result into Log Analytics
-      ctx.azLa.ingest(check.customLog,
-                        resultJson,
-                        check.colTimeGenerated)
+      if not isIngestionRequired:
+         tracer.info("[%s] result unchanged since last ingestion, skipping ingestion" % check.fullName)
+         return
 
       # Ingest result into Customer Analytics
       enableCustomerAnalytics = ctx.globalParams.get("enableCustomerAnalytics", True)
       if enableCustomerAnalytics and check.includeInCustomerAnalytics:
-            tracing.ingestCustomerAnalytics(tracer,
-                                          ctx,
-                                          check.customLog,
-                                          resultJson)
+         # Use the encoded records of the result if the check has them, rather than parsing the result JSON again
+         resultRecords = check.getResultRecords()
+         if resultRecords is not None:
+            tracing.ingestCustomerAnalyticsRecords(tracer,
+                                                   ctx,
+                                                   check.customLog,
+                                                   resultRecords)
+         else:
+            for resultJson in resultJsonChunks:
+               tracing.ingestCustomerAnalytics(tracer,
+                                             ctx,
+                                             check.customLog,
+                                             resultJson)
       tracer.info("finished check %s" % (check.fullName))
    except Exception as e:
       tracer.error("[%s] unhandled exception in runCheck: %s", check.fullName, e, exc_info=True)
       raise
    finally:
       ctx.checkLockSet.remove(check.getLockName())
+      ctx.runningChecks.discard(check)
+      # Put the check back into the queue, based on its updated last run time
+      scheduler.reschedule(check)
 
 ###############################################################################
 
+# Fingerprint of the configuration of a provider instance, to detect whether it has changed
+def getConfigHash(providerProperties: Dict[str, str]) -> str:
+   return hashlib.sha256(json.dumps(providerProperties, sort_keys = True).encode("utf-8")).hexdigest()
+
+# Check whether the properties of a provider instance refer to a secret in an external KeyVault
+# (e.g. hanaDbPasswordKeyVaultUrl), which can be rotated without changing the properties themselves
+def usesExternalSecrets(providerProperties: Dict[str, str]) -> bool:
+   return any(key.endswith("KeyVaultUrl") and value for (key, value) in providerProperties.items())
+
 # Load entire config from KeyVault (global parameters and provider instances)
-def loadConfig() -> bool:
-   global ctx, tracer
-   tracer.info("loading config from KeyVault")
+# Unless a full reload is requested, provider instances whose configuration is unchanged are kept as they are
+# (including their connections, caches and in-flight checks); only new or changed instances are created
+# With refreshExternalSecrets, instances that read secrets from external KeyVaults are re-created as well
+def loadConfig(fullReload: bool = True,
+               refreshExternalSecrets: bool = False) -> bool:
+   global ctx, tracer, retiredInstances
+   tracer.info("loading config from KeyVault (fullReload=%s)" % fullReload)
 
    secrets = ctx.azKv.getCurrentSecrets()
+   instancesProperties = []
    for secretName in secrets.keys():
       tracer.debug("parsing KeyVault secret %s" % secretName)
       secretValue = secrets[secretName]
@@ -98,20 +144,61 @@ def loadConfig() -> bool:
          ctx.globalParams = providerProperties
          tracer.debug("successfully loaded global config")
       else:
-         instanceName = providerProperties.get("name", None)
-         providerType = providerProperties.get("type", None)
-         try:
-            providerInstance = ProviderFactory.makeProviderInstance(providerType,
-                                                                    tracer,
-                                                                    ctx,
-                                                                    providerProperties,
-                                                                    skipContent = False)
-         except Exception as e:
-            tracer.error("could not validate provider instance %s (%s)" % (instanceName,
-                                                                           e))
-            continue
-         ctx.instances.append(providerInstance)
-         tracer.debug("successfully loaded config for provider instance %s" % instanceName)
+         instancesProperties.append(providerProperties)
+
+   previousInstances = {i.name: i for i in ctx.instances}
+   currentInstances = {} if fullReload else previousInstances
+
+   # Provider instances are independent of each other, so parse their properties (which may
+   # involve KeyVault lookups), content and state in parallel, but keep them in KeyVault order
+   def makeProviderInstance(providerProperties: Dict[str, str]) -> object:
+      instanceName = providerProperties.get("name", None)
+      providerType = providerProperties.get("type", None)
+      configHash = getConfigHash(providerProperties)
+      currentInstance = currentInstances.get(instanceName, None)
+      if currentInstance and currentInstance.configHash == configHash:
+         if not (refreshExternalSecrets and usesExternalSecrets(providerProperties)):
+            tracer.debug("config of provider instance %s unchanged" % instanceName)
+            return currentInstance
+         tracer.debug("re-creating provider instance %s to refresh its external secrets" % instanceName)
+      previousInstance = previousInstances.get(instanceName, None)
+      if previousInstance:
+         # The new instance reads the state of the previous one, which must not write it anymore from now on
+         previousInstance.retire()
+      try:
+         providerInstance = ProviderFactory.makeProviderInstance(providerType,
+                                                                 tracer,
+                                                                 ctx,
+                                                                 providerProperties,
+                                                                 skipContent = False)
+      except Exception as e:
+         tracer.error("could not validate provider instance %s (%s)" % (instanceName,
+                                                                        e))
+         return None
+      providerInstance.configHash = configHash
+      tracer.debug("successfully loaded config for provider instance %s" % instanceName)
+      return providerInstance
+
+   instances = []
+   if instancesProperties:
+      with ThreadPoolExecutor(min(len(instancesProperties), PROVIDER_LOAD_MAX_WORKERS),
+                              thread_name_prefix = "loadconfig") as loadPool:
+         for providerInstance in loadPool.map(makeProviderInstance, instancesProperties):
+            if providerInstance:
+               instances.append(providerInstance)
+
+   keptInstances = [i for i in instances if currentInstances.get(i.name, None) is i]
+   droppedInstances = [i for i in previousInstances.values() if i not in keptInstances]
+   tracer.info("loaded %d provider instances (%d unchanged, %d new or changed, %d changed or removed)" % (len(instances),
+                                                                                                        len(keptInstances),
+                                                                                                        len(instances) - len(keptInstances),
+                                                                                                        len(droppedInstances)))
+   # Replace the list as a whole, since other threads (e.g. the heartbeat) iterate over it
+   ctx.instances = instances
+   # Instances that have been replaced or removed are closed once their running checks have finished
+   for providerInstance in droppedInstances:
+      providerInstance.retire()
+      retiredInstances.append(providerInstance)
    if ctx.globalParams == {} or len(ctx.instances) == 0:
       tracer.error("did not find any provider instances in KeyVault")
       return False
@@ -139,7 +226,8 @@ def onboard(args: str) -> None:
    # Update global parameters and save them to KeyVault
    ctx.globalParams = {"logAnalyticsWorkspaceId": args.logAnalyticsWorkspaceId,
                        "logAnalyticsSharedKey": args.logAnalyticsSharedKey,
-                       "enableCustomerAnalytics": args.enableCustomerAnalytics}
+                       "enableCustomerAnalytics": args.enableCustomerAnalytics,
+                       "enableAsyncSoapClient": args.enableAsyncSoapClient}
    if not ctx.azKv.setSecret(CONFIG_SECTION_GLOBAL,
                              json.dumps(ctx.globalParams)):
       tracer.critical("could not save global config to KeyVault")
@@ -194,7 +282,8 @@ def deleteProvider(args: str) -> None:
    global ctx, tracer
    tracer.info("retrieving provider list from KeyVault")
 
-   # Clean up state file
+   # Clean up state store and (legacy) state file
+   StateStore(tracer).deleteProvider(args.name)
    fileToDelete = "%s.state" % args.name
    found = False
    for f in os.listdir(PATH_STATE):
@@ -204,7 +293,7 @@ def deleteProvider(args: str) -> None:
          found = True
          break
    if not found:
-      tracer.error("state file %s not found" % fileToDelete)
+      tracer.info("state file %s not found" % fileToDelete)
 
    # Delete corresponding secret from KeyVault
    secretToDelete = args.name
@@ -219,13 +308,22 @@ def deleteProvider(args: str) -> None:
          tracer.info("provider %s successfully deleted from KeyVault" % secretToDelete)
    return
 
+# Signal handler (SIGHUP) to pick up config changes right away instead of at the next refresh file poll
+def requestConfigRefresh(signum, frame) -> None:
+   global scheduler, isRefreshRequested
+   isRefreshRequested = True
+   if scheduler:
+      scheduler.wakeUp()
+
 # Execute the actual monitoring payload
 def monitor(args: str) -> None:
-   global ctx, tracer
+   global ctx, tracer, scheduler, ingestionPipeline, isRefreshRequested
    tracer.info("starting monitor payload")
 
    pool = ThreadPoolExecutor(NUMBER_OF_THREADS)
    allChecks = []
+   scheduler = CheckScheduler(tracer)
+   signal.signal(signal.SIGHUP, requestConfigRefresh)
 
    pool.submit(heartbeat)
 
@@ -233,61 +331,115 @@ def monitor(args: str) -> None:
       now = datetime.now()
       secondsSinceRefresh = (now-ctx.lastConfigRefreshTime).total_seconds()
       refresh = False
+      isPeriodicRefresh = False
 
       # check if config needs refresh
-      # needs refresh if 24 hours as passed or refresh file found
+      # needs refresh if 24 hours as passed, refresh file found or refresh requested via SIGHUP
+      # every refresh only updates the provider instances whose config has changed; the periodic refresh
+      # additionally re-creates the instances that read secrets from external KeyVaults, to pick up rotated secrets
       if secondsSinceRefresh > CONFIG_REFRESH_IN_SECONDS:
          tracer.info("Config has not been refreshed in %d seconds, refreshing", secondsSinceRefresh)
          refresh = True
-      elif os.path.isfile(FILENAME_REFRESH):
-         tracer.info("Refresh file found, refreshing")
+         isPeriodicRefresh = True
+      elif isRefreshRequested or os.path.isfile(FILENAME_REFRESH):
+         tracer.info("Refresh requested or refresh file found, refreshing")
          refresh = True
 
       if refresh:
+         # a SIGHUP received during the refresh triggers another one
+         isRefreshRequested = False
+
          allChecks = []
-         ctx.instances = []
 
-         if not loadConfig():
+         fullReload = len(ctx.instances) == 0
+         if not loadConfig(fullReload = fullReload,
+                           refreshExternalSecrets = isPeriodicRefresh):
             tracer.critical("failed to load config from KeyVault")
             shutdownMonitor(ERROR_LOADING_CONFIG)
+         # The asynchronous SOAP client (zeep/httpx) has to be enabled explicitly, since its TLS, proxy and timeout
+         # behaviour differs from the requests-based client
+         MetricClientFactory.setAsyncSoapClientEnabled(ctx.globalParams.get("enableAsyncSoapClient", False))
          logAnalyticsWorkspaceId = ctx.globalParams.get("logAnalyticsWorkspaceId", None)
          logAnalyticsSharedKey = ctx.globalParams.get("logAnalyticsSharedKey", None)
          if not logAnalyticsWorkspaceId or not logAnalyticsSharedKey:
             tracer.critical("global config must contain logAnalyticsWorkspaceId and logAnalyticsSharedKey")
             shutdownMonitor(ERROR_GETTING_LOG_CREDENTIALS)
-         ctx.azLa = AzureLogAnalytics(tracer,
-                                      logAnalyticsWorkspaceId,
-                                      logAnalyticsSharedKey)
+         # Keep the existing instance (and its pooled connections) unless the workspace or its key has changed
+         previousAzLa = ctx.azLa
+         if not previousAzLa or not previousAzLa.hasCredentials(logAnalyticsWorkspaceId, logAnalyticsSharedKey):
+            ctx.azLa = AzureLogAnalytics(tracer,
+                                         logAnalyticsWorkspaceId,
+                                         logAnalyticsSharedKey)
+         if not ingestionPipeline:
+            ingestionPipeline = LogAnalyticsIngestionPipeline(tracer,
+                                                              ctx.azLa,
+                                                              spool = IngestionSpool(tracer))
+            ingestionPipeline.start()
+         elif ctx.azLa is not previousAzLa:
+            ingestionPipeline.setLogAnalytics(ctx.azLa)
+            # a request still in flight on the old session fails and is retried with the new credentials
+            previousAzLa.close()
 
          for i in ctx.instances:
             for c in i.checks:
                allChecks.append(c)
+         if fullReload:
+            scheduler.reset(allChecks)
+         else:
+            scheduler.update(allChecks)
 
-         ctx.lastConfigRefreshTime = datetime.now()
+         if fullReload or isPeriodicRefresh:
+            ctx.lastConfigRefreshTime = datetime.now()
          if os.path.exists(FILENAME_REFRESH):
             os.remove(FILENAME_REFRESH)
 
-      for check in allChecks:
+      # Only checks whose due time has passed are returned by the scheduler;
+      # all other checks stay in the queue and are not touched at all
+      for check in scheduler.popDueChecks():
          try:
             if check.getLockName() in ctx.checkLockSet:
-               tracer.info("[%s] already queued/executing, skipping" % check.fullName)
-               continue
+               # a check with the same name from a previous config is still executing
+               scheduler.incrementCounter("skippedInFlight")
+               scheduler.postpone(check, CONFIG_REFRESH_POLL_IN_SECONDS)
             elif not check.isEnabled():
-               tracer.info("[%s] not enabled, skipping" % check.fullName)
-               continue
+               # re-evaluate disabled checks once per check interval, since they can get enabled at runtime
+               scheduler.incrementCounter("skippedDisabled")
+               scheduler.postpone(check, check.frequencySecs)
             elif not check.isDue():
-               tracer.info("[%s] not due for execution, skipping" % check.fullName)
-               continue
+               # last run time has moved since the check was queued (e.g. state was re-read)
+               scheduler.incrementCounter("rescheduled")
+               scheduler.reschedule(check)
             else:
-               tracer.info("[%s] getting queued" % check.fullName)
+               scheduler.incrementCounter("queued")
                ctx.checkLockSet.add(check.getLockName())
+               ctx.runningChecks.add(check)
                pool.submit(runCheck, check)
          except Exception as e:
             tracer.error("[%s] exception determining execution state of check, %s", check.fullName, e, exc_info=True)
+            scheduler.incrementCounter("errors")
+            scheduler.postpone(check, check.frequencySecs)
+
+      closeRetiredInstances()
 
-      sleep(CHECK_WAIT_IN_SECONDS)
+      # Sleep until the next check is due or a refresh is requested (SIGHUP);
+      # the refresh file is written by separate processes that cannot signal us, so keep looking for it every few seconds
+      scheduler.wait(CONFIG_REFRESH_POLL_IN_SECONDS)
 
 
+# Close provider instances that have been replaced or removed by a config refresh,
+# as soon as none of their checks is running anymore
+def closeRetiredInstances() -> None:
+   global ctx, tracer, retiredInstances
+   for providerInstance in list(retiredInstances):
+      if any(check in ctx.runningChecks for check in providerInstance.checks):
+         continue
+      retiredInstances.remove(providerInstance)
+      tracer.info("[%s] closing retired provider instance" % providerInstance.fullName)
+      try:
+         providerInstance.close()
+      except Exception as e:
+         tracer.error("[%s] could not close provider instance (%s)" % (providerInstance.fullName, e), exc_info=True)
+
 # prepareUpdate will prepare the resources like keyvault, log analytics etc for the version passed as an argument
 # prepareUpdate needs to be run when a version upgrade requires specific update to the content of the resources
 def prepareUpdate(args: str) -> None:
@@ -313,14 +465,24 @@ def ensureDirectoryStructure() -> None:
    return
 
 def shutdownMonitor(status: object) -> None:
-   global isShuttingDown
+   global isShuttingDown, ingestionPipeline
    # signal to threads we need to exit process
    isShuttingDown = True
    tracer.critical("signaling tasks to shutdown")
+   # flush results that are still waiting to be ingested (anything left over stays in the spool)
+   if ingestionPipeline:
+      ingestionPipeline.stop(timeoutSecs = LOG_ANALYTICS_TIMEOUT_SECS)
+   # send customer analytics records that are still buffered
+   if ctx and ctx.analyticsHandler:
+      ctx.analyticsHandler.close()
+   # commit state that has not been written yet
+   StateStore(tracer).close()
+   # log off from SAP systems instead of leaving pooled RFC sessions behind
+   RfcConnectionPool(tracer).closeAll()
    sys.exit(status)
 
 def heartbeat() -> None: 
-   global ctx, isShuttingDown
+   global ctx, isShuttingDown, scheduler, ingestionPipeline
 
    while not isShuttingDown:
       providerJson = {
@@ -352,6 +514,7 @@ def heartbeat() -> None:
                      "Duration": check.duration,
                      "LastRun": '{:%m/%d/%y %H:%M %S}'.format(lastRunLocal),
                      "Success": check.success,
+                     "Unchanged": check.resultUnchanged,
                      "Message": check.checkMessage
                   }
                   checks.append(checkJson)
@@ -363,6 +526,15 @@ def heartbeat() -> None:
             providerJson.update({"Providers":pi})
             providerJson.update({"Count": len(pi)})
       tracer.info(json.dumps(providerJson))
+      tracer.info("scheduler statistics %s" % json.dumps(scheduler.getCounters()))
+      if ingestionPipeline:
+         tracer.info("ingestion statistics %s" % json.dumps(ingestionPipeline.getStatistics()))
+      if ctx.analyticsHandler:
+         tracer.info("customer analytics statistics %s" % json.dumps(ctx.analyticsHandler.getStatistics()))
+      tracer.info("state store statistics %s" % json.dumps(StateStore(tracer).getStatistics()))
+      tracer.info("endpoint health statistics %s" % json.dumps(EndpointHealthRegistry(tracer).getStatistics()))
+      tracer.info("cache statistics %s" % json.dumps(TtlCache.getAllStatistics()))
+      tracer.info("rfc connection pool statistics %s" % json.dumps(RfcConnectionPool(tracer).getStatistics()))
             
       sleep(HEARTBEAT_WAIT_IN_SECONDS)
 
@@ -453,8 +625,14 @@ def main() -> None:
                           help = "Setting to enable sending metrics to Microsoft",
                           action = "store_true",
                           dest="enableCustomerAnalytics")
+   onbParser.add_argument("--enableAsyncSoapClient",
+                          required = False,
+                          help = "Setting to use the asynchronous SOAP client for SAP NetWeaver checks",
+                          action = "store_true",
+                          dest="enableAsyncSoapClient")
    addVerboseToParser(onbParser)
-   onbParser.set_defaults(enableCustomerAnalytics=False)
+   onbParser.set_defaults(enableCustomerAnalytics=False,
+                          enableAsyncSoapClient=False)
 
    # Parsers for "update" command
    updParser = subParsers.add_parser("update",
@@ -479,6 +657,10 @@ def main() -> None:
 
 ctx = None
 tracer = None
+scheduler = None
+ingestionPipeline = None
+retiredInstances = []
+isRefreshRequested = False
 if __name__ == "__main__":
    main()
 